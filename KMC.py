@@ -10,13 +10,21 @@ author: DI WU
 email: stevenwudi@gmail.com
 2017/06/05
 """
+import copy
+import inspect
 import numpy as np
 from scipy.misc import imresize
-import keras
-from keras.models import load_model
 
 
 class KMCTracker:
+    # shared by the trackers made with spawn, everything else is copied
+    SHARED_ATTRIBUTES = ('multi_cnn_model', 'base_model', 'extract_model', 'extract_model_function', 'feature_cache')
+    # constructor arguments, they identify the tracker configuration (e.g. in the collection manifest)
+    PARAM_NAMES = ('feature_type', 'model_path', 'feature_bandwidth_sigma', 'spatial_bandwidth_sigma_factor',
+                   'adaptation_rate_range_max', 'adaptation_rate_scale_range_max', 'sub_feature_type',
+                   'sub_sub_feature_type', 'padding', 'lambda_value', 'sigma_coff', 'acc_time', 'name_suffix',
+                   'cnn_type')
+
     def __init__(self, feature_type='multi_cnn',
                  model_path='./trained_models/CNN_Model_OBT100_multi_cnn_best_cifar_big_valid.h5',
                  feature_bandwidth_sigma=0.2,
@@ -30,14 +38,27 @@ class KMCTracker:
                  sigma_coff=2,
                  acc_time=5,
                  name_suffix="",
-                 cnn_type=""):
+                 cnn_type="",
+                 feature_cache_dir="",
+                 model_tier=""):
         """
         object_example is an image showing the object to track
         feature_type:
             "raw pixels":
             "hog":
             "CNN":
+        feature_cache_dir: if set, the multi_cnn VGG19 features are cached on disk (see models.FeatureCache),
+            the runners select the sequence with self.feature_cache.open_sequence (nothing is cached before),
+            VGG19 is only loaded on the first cache miss
+        model_path: a Keras model
+        model_tier: a tier ("accurate", "balanced", "fast"...) or an architecture of models.ModelZoo, replaces
+            model_path by the trained model of the tier
         """
+        if model_tier:
+            from models.ModelZoo import model_path as tier_model_path
+            model_path = tier_model_path(model_tier)
+        arguments = locals()
+        self.params = dict((name, arguments[name]) for name in self.PARAM_NAMES)
         # parameters according to the paper --
         self.padding = padding  # extra area surrounding the target
         self.lambda_value = lambda_value  # regularization
@@ -70,20 +91,16 @@ class KMCTracker:
         self.sub_feature_type = sub_feature_type
         self.sub_sub_feature_type = sub_sub_feature_type
         self.cnn_type = cnn_type
+        self.feature_cache = None
+        if feature_cache_dir:
+            from models.FeatureCache import FeatureCache
+            self.feature_cache = FeatureCache(feature_cache_dir)
 
         # following is set according to Table 2:
         if self.feature_type == 'multi_cnn':
-            import keras
-            from keras import backend as K
-            from keras.applications.vgg19 import VGG19
-            self.base_model = VGG19(include_top=False, weights='imagenet')
-            self.extract_model_function = K.function([self.base_model.input],
-                                                         [self.base_model.get_layer('block1_conv2').output,
-                                                           self.base_model.get_layer('block2_conv2').output,
-                                                           self.base_model.get_layer('block3_conv4').output,
-                                                           self.base_model.get_layer('block4_conv4').output,
-                                                           self.base_model.get_layer('block5_conv4').output
-                                                          ])
+            self.extract_model_function = None
+            if self.feature_cache is None:
+                self.load_multi_cnn_features()
 
             # we first resize all the response maps to a size of 40*60 (store the resize scale)
             # because average target size is 81 *52
@@ -102,6 +119,7 @@ class KMCTracker:
             self.sigma_coff = sigma_coff
 
             # load trained KMC model here
+            from keras.models import load_model
             self.multi_cnn_model = load_model(model_path)
 
             for i in range(5):
@@ -187,6 +205,15 @@ class KMCTracker:
         if name_suffix:
             self.name += "_" + name_suffix
 
+    def spawn(self):
+        """
+        :return: a tracker with the same configuration and the same models (and feature cache) as this one,
+            and its own copy of the tracking state, to track several sub-sequences side by side
+        """
+        shared = [getattr(self, name) for name in self.SHARED_ATTRIBUTES if getattr(self, name, None) is not None]
+        # deepcopy takes the objects already in its memo as they are
+        return copy.deepcopy(self, dict((id(obj), obj) for obj in shared))
+
     def train(self, im, init_rect):
         """
         :param im: image should be of 3 dimension: M*N*C
@@ -230,6 +257,10 @@ class KMCTracker:
             k = self.dense_gauss_kernel(self.feature_bandwidth_sigma, self.xf, self.x)
             self.alphaf = np.divide(self.yf, self.fft2(k) + self.lambda_value)
 
+        if self.sub_feature_type == 'cnn_scale':
+            self.min_scale_factor = max(5. / self.patch_size)
+            self.max_scale_factor = min(np.array(self.im_sz[:2]).astype(float) / self.target_sz)
+
         if self.sub_feature_type == 'dsst':
             self.min_scale_factor = self.scale_step ** (
             np.ceil(np.log(max(5. / self.patch_size)) / np.log(self.scale_step)))
@@ -265,16 +296,8 @@ class KMCTracker:
                 kf = self.fft2(k)
                 self.response.append(np.real(np.fft.ifft2(np.multiply(self.alphaf[i], kf))))
 
-            response_all = np.zeros(shape=(5, self.resize_size[0], self.resize_size[1]))
             self.max_list = [np.max(x) for x in self.response]
-            for i in range(len(self.response)):
-                response_all[i, :, :] = imresize(self.response[i], size=self.resize_size)
-                #response_all[i, :, :] *= self.max_list[i]
-
-            response_all = response_all.astype('float32') / 255. - 0.5
-            self.response_all = response_all
-            response_all = np.expand_dims(response_all, axis=0)
-            pos_move = self.multi_cnn_model.predict(response_all, batch_size=1)
+            pos_move = self.multi_cnn_model.predict(self.multi_cnn_input(), batch_size=1)
 
             self.vert_delta, self.horiz_delta = [self.target_sz[0] * pos_move[0][0], self.target_sz[1] * pos_move[0][1]]
             self.pos = [self.pos[0] + self.target_sz[0] * pos_move[0][0],
@@ -282,6 +305,16 @@ class KMCTracker:
             self.pos = [max(self.target_sz[0] / 2, min(self.pos[0], self.im_sz[0] - self.target_sz[0] / 2)),
                         max(self.target_sz[1] / 2, min(self.pos[1], self.im_sz[1] - self.target_sz[1] / 2))]
 
+            if self.sub_feature_type == 'cnn_scale':
+                # the 4 output models also regress the scale change of the target (height, width),
+                # no scale sample is extracted
+                if len(pos_move[0]) < 4:
+                    raise ValueError("cnn_scale needs a model with a position and scale head, e.g. cnn_sigma_scale")
+                self.currentScaleFactor = np.clip(self.currentScaleFactor * np.asarray(pos_move[0][2:4]),
+                                                  self.min_scale_factor, self.max_scale_factor)
+                self.target_sz = np.multiply(self.currentScaleFactor, self.first_target_sz)
+                self.patch_size = np.multiply(self.target_sz, (1 + self.padding))
+
         elif self.feature_type == 'vgg':
             k = self.dense_gauss_kernel(self.feature_bandwidth_sigma, self.xf, self.x, zf, z)
             kf = self.fft2(k)
@@ -544,17 +577,29 @@ class KMCTracker:
             features = np.multiply(features, self.cos_window[:, :, None])
 
         elif self.feature_type == "multi_cnn":
-            from keras.applications.vgg19 import preprocess_input
-            x = imresize(self.im_crop.copy(), self.resize_size)
-            x = np.expand_dims(x, axis=0).astype(np.float32)
-            x = preprocess_input(x)
-            if keras.backend._backend == 'theano':
-                features_list = self.extract_model_function(x)
-            else:
-                features_list = self.extract_model_function([x])
+            features_list = None
+            if self.feature_cache is not None:
+                # the normalised features are cached, the cosine window is cheap to apply again
+                cache_key = self.feature_cache.key(self.im_crop, self.resize_size)
+                features_list = self.feature_cache.get(cache_key)
+            if features_list is None:
+                import keras
+                from keras.applications.vgg19 import preprocess_input
+                if self.extract_model_function is None:
+                    self.load_multi_cnn_features()
+                x = imresize(self.im_crop.copy(), self.resize_size)
+                x = np.expand_dims(x, axis=0).astype(np.float32)
+                x = preprocess_input(x)
+                if keras.backend._backend == 'theano':
+                    features_list = self.extract_model_function(x)
+                else:
+                    features_list = self.extract_model_function([x])
+                for i, features in enumerate(features_list):
+                    features = np.squeeze(features)
+                    features_list[i] = (features - features.min()) / (features.max() - features.min())
+                if self.feature_cache is not None:
+                    self.feature_cache.put(cache_key, features_list)
             for i, features in enumerate(features_list):
-                features = np.squeeze(features)
-                features = (features - features.min()) / (features.max() - features.min())
                 features_list[i] = np.multiply(features, self.cos_window[i][:, :, None])
             return features_list
         elif self.feature_type == "HDT":
@@ -575,6 +620,40 @@ class KMCTracker:
 
         return features
 
+    def load_multi_cnn_features(self):
+        from keras import backend as K
+        from keras.applications.vgg19 import VGG19
+        self.base_model = VGG19(include_top=False, weights='imagenet')
+        self.extract_model_function = K.function([self.base_model.input],
+                                                 [self.base_model.get_layer('block1_conv2').output,
+                                                  self.base_model.get_layer('block2_conv2').output,
+                                                  self.base_model.get_layer('block3_conv4').output,
+                                                  self.base_model.get_layer('block4_conv4').output,
+                                                  self.base_model.get_layer('block5_conv4').output
+                                                  ])
+
+    def multi_cnn_input(self):
+        """
+        the input of the regression CNN for the current self.response
+        """
+        if isinstance(self.multi_cnn_model.input_shape, list):
+            # hierarchical models (models.CNN.cnn_sigma...) take every response level at its own size,
+            # as train_cnn collects them, the coarse models do not take the finest levels
+            levels = self.response[len(self.response) - len(self.multi_cnn_model.input_shape):]
+            # the levels zero padded into the top left corner (the padded layout of train_cnn), for display
+            self.response_all = np.zeros(shape=(len(self.response),) + self.response[0].shape, dtype=np.float32)
+            for i in range(len(self.response)):
+                self.response_all[i, :self.response[i].shape[0], :self.response[i].shape[1]] = self.response[i]
+            return [np.asarray(r, dtype=np.float32)[None, :, :, None] for r in levels]
+        response_all = np.zeros(shape=(5, self.resize_size[0], self.resize_size[1]))
+        for i in range(len(self.response)):
+            response_all[i, :, :] = imresize(self.response[i], size=self.resize_size)
+            #response_all[i, :, :] *= self.max_list[i]
+
+        response_all = response_all.astype('float32') / 255. - 0.5
+        self.response_all = response_all
+        return np.expand_dims(response_all, axis=0)
+
     def get_scale_sample(self, im, scaleFactors):
         from pyhog import pyhog
         resized_im_array = []
@@ -640,13 +719,18 @@ class KMCTracker:
             self.xf[i] = (1 - self.adaptation_rate) * self.xf[i] + self.adaptation_rate * xf_new[i]
             self.alphaf[i] = (1 - self.adaptation_rate) * self.alphaf[i] + self.adaptation_rate * alphaf_new
 
-        # we fill the matrix with zeros first
-        response_all = np.zeros(shape=(5, self.resize_size[0], self.resize_size[1]))
+        if type(x_train) == list:
+            # pyramid layout: one dataset per response level, stored without padding
+            for i in range(len(self.response)):
+                x_train[i][count] = self.response[i]
+        else:
+            # we fill the matrix with zeros first
+            response_all = np.zeros(shape=(5, self.resize_size[0], self.resize_size[1]))
 
-        for i in range(len(self.response)):
-            response_all[i, :self.response[i].shape[0], :self.response[i].shape[1]] = self.response[i]
+            for i in range(len(self.response)):
+                response_all[i, :self.response[i].shape[0], :self.response[i].shape[1]] = self.response[i]
 
-        x_train[count, :, :, :] = response_all
+            x_train[count, :, :, :] = response_all
         self.pos_next = [next_rect[1] + next_rect[3] / 2., next_rect[0] + next_rect[2] / 2.]
         pos_move = np.array([(self.pos_next[0] - self.pos[0]) * 1.0 / self.target_sz[0],
                              (self.pos_next[1] - self.pos[1]) * 1.0 / self.target_sz[1]])
@@ -657,3 +741,14 @@ class KMCTracker:
         # ('feature time:', 0.07054710388183594)
         # ('fft2:', 0.22904396057128906)
         # ('guassian kernel + fft2: ', 0.20537400245666504)
+
+
+def tracker_params(**kwargs):
+    """
+    :return: the params of KMCTracker(**kwargs), without building the tracker (no model is loaded)
+    """
+    arguments = inspect.getcallargs(KMCTracker.__init__, None, **kwargs)
+    if arguments['model_tier']:
+        from models.ModelZoo import model_path
+        arguments['model_path'] = model_path(arguments['model_tier'])
+    return dict((name, arguments[name]) for name in KMCTracker.PARAM_NAMES)
@@ -56,7 +56,10 @@ def cnn_cifar_batchnormalisation(image_shape):
     return model
 
 
-def cnn_hiararchical_batchnormalisation():
+def cnn_hiararchical_batchnormalisation(num_outputs=2):
+    """
+    :param num_outputs: 2 regresses the position change, 4 also the scale change (y_train[:, 2:4])
+    """
 
     input_1 = Input(shape=(240, 160, 1), name='input_1')
     input_2 = Input(shape=(120, 80, 1), name='input_2')
@@ -91,17 +94,22 @@ def cnn_hiararchical_batchnormalisation():
     x6 = Flatten()(x5)
     x6 = Dense(512, activation='relu')(x6)
     x6 = BatchNormalization()(x6)
-    out = Dense(2)(x6)
+    out = Dense(num_outputs)(x6)
 
     model = Model(inputs=[input_1, input_2, input_3, input_4, input_5],
                   outputs=[out])
 
     model.name = 'cnn_hiararchical_batchnormalisation'
+    if num_outputs == 4:
+        model.name += '_scale'
 
     return model
 
 
-def cnn_sigma():
+def cnn_sigma(num_outputs=2):
+    """
+    :param num_outputs: 2 regresses the position change, 4 also the scale change (y_train[:, 2:4])
+    """
 
     input_1 = Input(shape=(240, 160, 1), name='input_1')
     input_2 = Input(shape=(120, 80, 1), name='input_2')
@@ -130,16 +138,82 @@ def cnn_sigma():
 
     x6 = Flatten()(x5)
     x6 = Dense(512, activation='relu')(x6)
-    out = Dense(2)(x6)
+    out = Dense(num_outputs)(x6)
 
     model = Model(inputs=[input_1, input_2, input_3, input_4, input_5],
                   outputs=[out])
 
     model.name = 'cnn_sigma'
+    if num_outputs == 4:
+        model.name += '_scale'
 
     return model
 
 
+def cnn_sigma_scale():
+    """
+    position and scale head, for KMCTracker(sub_feature_type='cnn_scale')
+    """
+    return cnn_sigma(num_outputs=4)
+
+
+def cnn_hiararchical_batchnormalisation_scale():
+    return cnn_hiararchical_batchnormalisation(num_outputs=4)
+
+
+def cnn_multi_resolution(filters=(16, 32, 32, 64, 64), dense_units=512, first_level=0, batchnormalisation=False,
+                         num_outputs=2, name='cnn_multi_resolution'):
+    """
+    the hierarchical architecture of cnn_sigma with a configurable width, for the slimmer variants of models.ModelZoo
+    :param filters: number of filters of the convolution of every response level
+    :param first_level: the levels finer than first_level are not used (1 drops the 240x160 level),
+        the model has one input per level used, named after the level as in cnn_sigma
+    """
+    shapes = [(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)]
+    inputs = [Input(shape=shapes[i] + (1,), name='input_%d' % (i + 1)) for i in range(first_level, len(shapes))]
+
+    x = None
+    for level, input_level in zip(range(first_level, len(shapes)), inputs):
+        x = input_level if x is None else concatenate([x, input_level])
+        x = Conv2D(filters[level], (3, 3), padding='same', activation='relu')(x)
+        if batchnormalisation:
+            x = BatchNormalization()(x)
+        x = AveragePooling2D(pool_size=(2, 2))(x)
+
+    x = Flatten()(x)
+    x = Dense(dense_units, activation='relu')(x)
+    if batchnormalisation:
+        x = BatchNormalization()(x)
+    out = Dense(num_outputs)(x)
+
+    model = Model(inputs=inputs, outputs=[out])
+
+    model.name = name
+    if num_outputs == 4:
+        model.name += '_scale'
+
+    return model
+
+
+def cnn_sigma_slim(num_outputs=2):
+    """
+    cnn_sigma with half the filters and dense units
+    """
+    return cnn_multi_resolution((8, 16, 16, 32, 32), 256, num_outputs=num_outputs, name='cnn_sigma_slim')
+
+
+def cnn_sigma_coarse(num_outputs=2):
+    """
+    cnn_sigma without the 240x160 level, the most expensive convolution
+    """
+    return cnn_multi_resolution(first_level=1, num_outputs=num_outputs, name='cnn_sigma_coarse')
+
+
+def cnn_sigma_coarse_slim(num_outputs=2):
+    return cnn_multi_resolution((8, 16, 16, 32, 32), 256, first_level=1, num_outputs=num_outputs,
+                                name='cnn_sigma_coarse_slim')
+
+
 def cnn_cifar_small_batchnormalisation(image_shape=(5, 240, 160)):
     '''
     because of the overfitting problem, we reduce the number of filters to half
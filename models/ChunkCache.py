@@ -0,0 +1,86 @@
+"""
+Bounded in-memory cache of decoded training blocks.
+
+The training set does not fit in memory, but a large part of it does: the blocks read by Generator.generate_blocks
+are kept (decoded to float32, i.e. as the model sees them) until the byte budget is used up. Every pass serves
+the cached blocks first and streams the others from disk, so a pass reads about
+(1 - budget / size of the split) of the data from disk.
+
+Two eviction policies:
+    "static": blocks are admitted until the budget is used up and never evicted, no copy is made once the
+              cache is full, the same blocks are served from memory on every pass
+    "lru":    the least recently used blocks make room for the new ones, since the cached blocks are served
+              first, the cache ends every pass holding its last streamed blocks
+"""
+from collections import OrderedDict
+import numpy as np
+
+
+class ChunkCache(object):
+    def __init__(self, budget_bytes, policy="static"):
+        if policy not in ("static", "lru"):
+            raise ValueError("unknown eviction policy %s" % policy)
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.blocks = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.blocks
+
+    def order(self, keys):
+        """
+        :return: the keys of one pass, the cached ones first, each group in random order
+        """
+        keys = np.random.permutation(keys)
+        cached = np.array([key in self.blocks for key in keys], dtype=bool)
+        return np.concatenate([keys[cached], keys[~cached]])
+
+    def get(self, key, levels, targets, dest):
+        """
+        copy the block into the rows dest of levels and targets
+        :return: False if the block is not cached
+        """
+        block = self.blocks.get(key)
+        if block is None:
+            self.misses += 1
+            return False
+        if self.policy == "lru":
+            self.blocks[key] = self.blocks.pop(key)
+        for level, cached in zip(levels, block[0]):
+            level[dest] = cached
+        targets[dest] = block[1]
+        self.hits += 1
+        self.hit_bytes += block[2]
+        return True
+
+    def put(self, key, levels, targets):
+        """
+        keep a copy of the block if the budget (and the policy) allows it
+        """
+        num_bytes = sum(level.nbytes for level in levels) + targets.nbytes
+        self.miss_bytes += num_bytes
+        if key in self.blocks or num_bytes > self.budget_bytes:
+            return
+        if self.policy == "static" and self.used_bytes + num_bytes > self.budget_bytes:
+            return
+        while self.used_bytes + num_bytes > self.budget_bytes:
+            _, evicted = self.blocks.popitem(last=False)
+            self.used_bytes -= evicted[2]
+            self.evictions += 1
+        self.blocks[key] = ([np.copy(level) for level in levels], np.copy(targets), num_bytes)
+        self.used_bytes += num_bytes
+
+    def hit_rate(self):
+        return self.hits / float(max(self.hits + self.misses, 1))
+
+    def summary(self):
+        return "chunk cache: %d blocks, %.1f of %.1f MB, hit rate %.3f (%d hits, %d misses, %d evictions), " \
+               "%.1f MB served from memory, %.1f MB read from disk" % \
+               (len(self.blocks), self.used_bytes / 2. ** 20, self.budget_bytes / 2. ** 20, self.hit_rate(),
+                self.hits, self.misses, self.evictions, self.hit_bytes / 2. ** 20, self.miss_bytes / 2. ** 20)
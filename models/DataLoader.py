@@ -1,7 +1,11 @@
+import itertools
 import numpy as np
 import h5py
 from keras.utils import np_utils
 from random import shuffle
+from models.DataStore import open_store, get_layout, read_samples
+from models.FlatStore import FlatStore
+from models.ChunkCache import ChunkCache
 
 
 class DataLoader:
@@ -10,7 +14,7 @@ class DataLoader:
     """
     def __init__(self, batch_size=128, filename="/home/stevenwudi/Documents/Python_Project/OBT/Kernelized_Correlation_Filter/data/OBT100_new_multi_cnn%d.hdf5"):
 
-        self.file = h5py.File(filename, "r", driver="family", memb_size=2 ** 32 - 1)
+        self.file = open_store(filename)
         self.batch_size = batch_size
         self.total_num = self.file["x_train"].shape[0]
         self.image_shape = self.file["x_train"][0, :].shape
@@ -37,14 +41,14 @@ class DataLoader:
                 if len(self.pos_train) == 0:
                     self.shuffle_train()
                 pos = self.pos_train.pop()
-                x = (self.file["x_train"][pos:pos + self.batch_size]).astype('float32') / 255. - 0.5
+                x = read_samples(self.file, "x_train", slice(pos, pos + self.batch_size)) / 255. - 0.5
                 y = (self.file["y_train"][pos:pos + self.batch_size][:, :2]).astype('float32')
                 yield (x, y)
             else:
                 if len(self.pos_valid) == 0:
                     self.shuffle_valid()
                 pos = self.pos_valid.pop() + self.train_num
-                x = (self.file["x_train"][pos:pos + self.batch_size]).astype('float32') / 255. - 0.5
+                x = read_samples(self.file, "x_train", slice(pos, pos + self.batch_size)) / 255. - 0.5
                 y = (self.file["y_train"][pos:pos + self.batch_size][:, :2]).astype('float32')
                 yield (x, y)
 
@@ -53,10 +57,33 @@ class Generator(object):
     def __init__(self, filename,
                  batch_size=128,
                  response_map_shape=[(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)],
+                 block_size=0,
+                 shuffle_window=2048,
+                 num_buffers=16,
+                 cache_bytes=0,
+                 cache_policy="static",
+                 target_dim=2,
+                 first_level=0,
                  ):
-        self.file = h5py.File(filename, "r", driver="family", memb_size=2 ** 32 - 1)
+        """
+        :param block_size: 0 shuffles single samples, otherwise the data is read in contiguous blocks of
+            block_size samples (rounded to whole HDF5 chunks), the blocks are visited in random order and their
+            samples are shuffled again inside a window of shuffle_window samples held in memory
+        :param num_buffers: the batches are assembled in num_buffers preallocated float32 batches used in turn,
+            a yielded batch stays valid while the following num_buffers - 1 batches are generated, so this has
+            to be larger than the queue of the consumer (max_queue_size of fit_generator, 10 by default)
+        :param cache_bytes: memory budget of the blocks kept between passes (block mode only), see ChunkCache
+        :param cache_policy: "static" or "lru"
+        :param target_dim: 2 trains on the position change (y_train[:, :2]), 4 also on the scale change
+        :param first_level: the response levels finer than first_level are not read, for the models without
+            the 240x160 input (models.CNN.cnn_sigma_coarse)
+        """
+        # filename is either the family file written by step_1, the merged store of the parallel collection
+        # or the directory of their memory mapped copy
+        self.file = open_store(filename)
+        self.layout = get_layout(self.file)
         self.batch_size = batch_size
-        self.total_num = self.file["x_train"].shape[0]
+        self.total_num = self.file["y_train"].shape[0]
         # using 10% data for validation
         self.train_num = int(self.total_num * 0.9)
         self.valid_num = int(self.total_num * 0.1)
@@ -65,8 +92,105 @@ class Generator(object):
         self.train_batches = len(self.train_keys) / self.batch_size
         self.val_batches = len(self.val_keys) / self.batch_size
         self.response_map_shape = response_map_shape
+        self.x_names = ["x_train_%d" % layer for layer in range(len(response_map_shape))] \
+            if self.layout == "pyramid" else ["x_train"]
+        chunk_rows = (self.file[self.x_names[0]].chunks or (1,))[0]
+        self.block_size = int(np.ceil(block_size / float(chunk_rows))) * chunk_rows
+        self.shuffle_window = max(shuffle_window, self.block_size)
+        self.num_buffers = num_buffers
+        self.target_dim = target_dim
+        self.levels = list(range(first_level, len(response_map_shape)))
+        # a memory mapped store reads a whole shuffled batch with one fancy index per level
+        self.random_access = isinstance(self.file, FlatStore)
+        self.cache = ChunkCache(cache_bytes, cache_policy) if cache_bytes and self.block_size else None
+
+    def allocate(self, num):
+        """
+        :return: float32 arrays with the final model input shapes (num, h, w, 1) and the targets (num, target_dim)
+        """
+        levels = [np.empty((num,) + tuple(self.response_map_shape[layer]) + (1,), dtype=np.float32)
+                  for layer in self.levels]
+        return levels, np.empty((num, self.target_dim), dtype=np.float32)
+
+    def read_into(self, source, levels, targets, dest):
+        """
+        read the samples source (an index, a slice or sorted indices) straight into the rows dest of the buffers,
+        quantised samples are decoded in place
+        """
+        for k, layer in enumerate(self.levels):
+            shape = self.response_map_shape[layer]
+            if self.layout == "pyramid":
+                data = self.file[self.x_names[layer]]
+                data.read_direct(levels[k], np.s_[source], np.s_[dest, :, :, 0])
+            else:
+                data = self.file["x_train"]
+                data.read_direct(levels[k], np.s_[source, layer, :shape[0], :shape[1]], np.s_[dest, :, :, 0])
+            if "scale" in data.attrs:
+                scale = self.file[data.attrs["scale"]][source]
+                level = levels[k][dest]
+                level *= scale[..., 1].reshape(level.shape[:-3] + (1, 1, 1))
+                level += scale[..., 0].reshape(level.shape[:-3] + (1, 1, 1))
+        self.file["y_train"].read_direct(targets, np.s_[source, :self.target_dim], np.s_[dest])
+
+    def generate_blocks(self, train=True, part=None, batches=None):
+        """
+        :param part: (i, n), only visit every n-th block starting from the i-th, so that n readers share a split
+        :param batches: iterator of the (levels, targets) buffers (see allocate) the batches are assembled into,
+            by default the num_buffers preallocated batches of the generator in turn
+        """
+        if train:
+            first, last = 0, self.train_num
+        else:
+            first, last = self.train_num, self.train_num + self.valid_num
+        # blocks are aligned on the chunk grid of the whole dataset, not on the start of the split
+        starts = np.arange(first - first % self.block_size, last, self.block_size)
+        if part is not None:
+            starts = starts[part[0]::part[1]]
+        # the window has room for one more block than it needs, the samples left over from the last window
+        # (less than a batch) are kept at its front
+        window_levels, window_targets = self.allocate(self.shuffle_window + self.block_size + self.batch_size)
+        if batches is None:
+            buffers = [self.allocate(self.batch_size) for _ in range(self.num_buffers)]
+            batches = (buffers[count % self.num_buffers] for count in itertools.count())
+        window_num = 0
+        while True:
+            if self.cache is not None:
+                if self.cache.hits + self.cache.misses:
+                    print(self.cache.summary())
+                order = self.cache.order(starts)
+            else:
+                order = np.random.permutation(starts)
+            for start in order:
+                start, end = max(start, first), min(start + self.block_size, last)
+                rows = slice(window_num, window_num + end - start)
+                if self.cache is None or not self.cache.get(start, window_levels, window_targets, rows):
+                    self.read_into(slice(start, end), window_levels, window_targets, rows)
+                    if self.cache is not None:
+                        self.cache.put(start, [level[rows] for level in window_levels], window_targets[rows])
+                window_num += end - start
+                if window_num < self.shuffle_window:
+                    continue
+                order = np.random.permutation(window_num)
+                num_batches = window_num // self.batch_size
+                for b in range(num_batches):
+                    idx = order[b * self.batch_size:(b + 1) * self.batch_size]
+                    levels, targets = next(batches)
+                    for layer in range(len(levels)):
+                        np.take(window_levels[layer], idx, axis=0, out=levels[layer])
+                    np.take(window_targets, idx, axis=0, out=targets)
+                    yield (levels, targets)
+                idx = np.sort(order[num_batches * self.batch_size:])
+                for layer in range(len(window_levels)):
+                    window_levels[layer][:len(idx)] = window_levels[layer][idx]
+                window_targets[:len(idx)] = window_targets[idx]
+                window_num = len(idx)
 
     def generate(self, train=True):
+        if self.block_size:
+            for batch in self.generate_blocks(train):
+                yield batch
+        buffers = [self.allocate(self.batch_size) for _ in range(self.num_buffers)]
+        num_batches = 0
         while True:
             if train:
                 shuffle(self.train_keys)
@@ -75,29 +199,21 @@ class Generator(object):
                 shuffle(self.val_keys)
                 keys = self.val_keys
 
+            if self.random_access:
+                for start in range(0, len(keys) - self.batch_size + 1, self.batch_size):
+                    levels, targets = buffers[num_batches % self.num_buffers]
+                    # sorted, the pages are touched in file order
+                    self.read_into(np.sort(keys[start:start + self.batch_size]), levels, targets, slice(None))
+                    num_batches += 1
+                    yield (levels, targets)
+                continue
+
             count = 0
-            targets = []
-            input_dict = {}
-            for layer in range(len(self.response_map_shape)):
-                input_dict[layer] = np.zeros(shape=(self.batch_size,
-                                                    self.response_map_shape[layer][0],
-                                                    self.response_map_shape[layer][1],
-                                                    1))
             for key in keys:
-                img_all = self.file["x_train"][key].astype('float32')
-                y = self.file["y_train"][key, :2].astype('float32')
-                for layer in range(len(self.response_map_shape)):
-                    input_dict[layer][count, :, :, 0] = img_all[layer,
-                                                        :self.response_map_shape[layer][0],
-                                                        :self.response_map_shape[layer][1]]
-
-                targets.append(y)
+                levels, targets = buffers[num_batches % self.num_buffers]
+                self.read_into(key, levels, targets, count)
                 count += 1
                 if count == self.batch_size:
-                    inputs = []
-                    for layer in range(len(self.response_map_shape)):
-                        inputs.append(np.array(input_dict[layer]))
-                    tmp_targets = np.array(targets)
                     count = 0
-                    targets = []
-                    yield (inputs, tmp_targets)
\ No newline at end of file
+                    num_batches += 1
+                    yield (levels, targets)
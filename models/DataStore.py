@@ -0,0 +1,278 @@
+"""
+HDF5 storage of the collected response maps (x_train) and the regression targets (y_train).
+step_1 writes the store, models.DataLoader reads it back for training.
+
+Two layouts are supported:
+    "padded":  x_train is one (N, 5, 240, 160) dataset, level i is zero padded into the top left corner
+    "pyramid": one dataset x_train_<i> of shape (N, h_i, w_i) per response level, no padding stored
+
+Samples are stored as float32, float16 or quantised per sample to uint8/int16. A quantised dataset keeps the
+(offset, scale) of every row in a companion (N, 2) dataset named by its "scale" attribute, read_samples
+decodes them back to float32.
+
+Every row also has an entry in the "manifest" dataset: the sequence, sub-sequence and frame it was collected
+from and the digest of the tracker parameters (the parameters themselves are kept in the file attributes
+"params_<digest>"). The "collected" dataset lists the finished (sequence, evalType, params) collections, so an
+interrupted or extended collection resumes after the last finished sequence.
+"""
+import os
+import json
+import hashlib
+import h5py
+import numpy as np
+
+RESPONSE_MAP_SHAPE = [(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)]
+MANIFEST_DTYPE = np.dtype([('sequence', 'S64'), ('sub_sequence', 'i4'), ('frame', 'i4'), ('params', 'S40')])
+COLLECTED_DTYPE = np.dtype([('sequence', 'S64'), ('evalType', 'S8'), ('params', 'S40'), ('end', 'i8')])
+
+
+def open_store(filename, mode="r"):
+    """
+    the original OTB100 store is an h5py family file (the filename contains '%d'), shards and the merged
+    virtual store are plain HDF5 files, so we pick the driver from the filename,
+    a directory is a memory mapped copy written by models.FlatStore.convert
+    """
+    if os.path.isdir(filename):
+        from models.FlatStore import FlatStore
+        return FlatStore(filename, mode)
+    if '%d' in filename:
+        return h5py.File(filename, mode, driver="family", memb_size=2 ** 32 - 1)
+    return h5py.File(filename, mode)
+
+
+def get_layout(f):
+    return f.attrs.get("layout", "pyramid" if "x_train_0" in f else "padded")
+
+
+def x_train_names(f):
+    if get_layout(f) == "pyramid":
+        return ["x_train_%d" % i for i in range(len([k for k in f.keys() if k.startswith("x_train_")]))]
+    return ["x_train"]
+
+
+class QuantisedDataset(object):
+    """
+    write side of a quantised dataset: every row is linearly mapped onto the full integer range,
+    x = q * scale + offset. A write covers whole rows, the first index of key selects them
+    (x_train[count] or x_train[count, :, :, :] for one sample, x_train[start:end] for several)
+    """
+    def __init__(self, data, scale):
+        self.data = data
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def resize(self, size, axis=0):
+        self.data.resize(size, axis=axis)
+        self.scale.resize(size, axis=axis)
+
+    def __setitem__(self, key, value):
+        rows = key[0] if isinstance(key, tuple) else key
+        if isinstance(rows, (int, np.integer)):
+            q, offset, scale = quantise(value, self.data.dtype)
+            self.data[key] = q
+            self.scale[rows] = [offset, scale]
+            return
+        # several samples, each with its own range
+        quantised = [quantise(v, self.data.dtype) for v in value]
+        self.data[key] = np.stack([q for q, _, _ in quantised])
+        self.scale[rows] = [[offset, scale] for _, offset, scale in quantised]
+
+
+def quantise(x, dtype):
+    info = np.iinfo(dtype)
+    x = np.asarray(x, dtype=np.float64)
+    x_min, x_max = x.min(), x.max()
+    scale = (x_max - x_min) / float(info.max - info.min)
+    if scale == 0:
+        scale = 1.
+    q = np.clip(np.round((x - x_min) / scale) + info.min, info.min, info.max).astype(dtype)
+    return q, x_min - info.min * scale, scale
+
+
+def dequantise(q, scale):
+    """
+    :param scale: (..., 2) array of (offset, scale), one row per sample in q
+    """
+    scale = np.asarray(scale, dtype=np.float32)
+    shape = scale.shape[:-1] + (1,) * (q.ndim - scale.ndim + 1)
+    return q.astype(np.float32) * scale[..., 1].reshape(shape) + scale[..., 0].reshape(shape)
+
+
+def _create_samples(f, name, scale_name, num_samples, shape, dtype, compression):
+    shape = (num_samples,) + tuple(shape)
+    # one sample per chunk: a random sample read never touches (or decompresses) its neighbours
+    options = dict(maxshape=(None,) + shape[1:], chunks=(1,) + shape[1:])
+    if compression:
+        options.update(compression=compression, shuffle=True)
+    if np.dtype(dtype).kind not in 'iu':
+        return f.create_dataset(name, shape, dtype=dtype, **options)
+    data = f.create_dataset(name, shape, dtype=dtype, **options)
+    data.attrs["scale"] = scale_name
+    scale = f.create_dataset(scale_name, (num_samples, 2), dtype='float32', maxshape=(None, 2), chunks=True)
+    return QuantisedDataset(data, scale)
+
+
+def read_samples(f, name, key):
+    """
+    read x_train rows as float32, whatever the storage dtype
+    """
+    data = f[name]
+    if "scale" in data.attrs:
+        return dequantise(data[key], f[data.attrs["scale"]][key])
+    return data[key].astype('float32')
+
+
+def create_store(f, num_samples, response_map_shape=RESPONSE_MAP_SHAPE, layout="pyramid", target_dim=4,
+                 dtype='float32', compression=None):
+    """
+    create growable x_train and y_train datasets, so a shard does not need to know its size in advance
+    :param dtype: storage dtype of the response maps: float32, float16, uint8 or int16 (quantised per sample)
+    :param compression: HDF5 filter of the response maps, "lzf" is fast enough not to slow down training
+    :return: x_train (a list of per level datasets for the pyramid layout), y_train
+    """
+    f.attrs["layout"] = layout
+    if layout == "pyramid":
+        x_train = []
+        for i, shape in enumerate(response_map_shape):
+            x_train.append(_create_samples(f, "x_train_%d" % i, "x_scale_%d" % i, num_samples, shape,
+                                           dtype, compression))
+    else:
+        sample_shape = (len(response_map_shape),) + tuple(response_map_shape[0])
+        x_train = _create_samples(f, "x_train", "x_scale", num_samples, sample_shape, dtype, compression)
+    y_train = f.create_dataset("y_train", (num_samples, target_dim), dtype='float32',
+                               maxshape=(None, target_dim), chunks=True)
+    f.create_dataset("manifest", (num_samples,), dtype=MANIFEST_DTYPE, maxshape=(None,), chunks=True)
+    f.create_dataset("collected", (0,), dtype=COLLECTED_DTYPE, maxshape=(None,), chunks=True)
+    return x_train, y_train
+
+
+def get_store(f):
+    """
+    the datasets of an existing store, opened for appending
+    :return: x_train, y_train, manifest as create_store would have returned them
+    """
+    if "manifest" not in f:
+        raise ValueError("%s has no manifest, it can not be resumed" % f.filename)
+    x_train = []
+    for name in x_train_names(f):
+        if "scale" in f[name].attrs:
+            x_train.append(QuantisedDataset(f[name], f[f[name].attrs["scale"]]))
+        else:
+            x_train.append(f[name])
+    if get_layout(f) != "pyramid":
+        x_train = x_train[0]
+    return x_train, f["y_train"], f["manifest"]
+
+
+def params_digest(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def register_params(f, params):
+    """
+    keep the tracker parameters in the store
+    :return: the digest identifying them in the manifest
+    """
+    digest = params_digest(params)
+    f.attrs["params_" + digest] = json.dumps(params, sort_keys=True)
+    return digest
+
+
+def is_collected(f, seqName, evalType, digest):
+    if "collected" not in f:
+        return False
+    collected = f["collected"][:]
+    return bool(np.any((collected['sequence'] == seqName.encode('utf-8')) &
+                       (collected['evalType'] == evalType.encode('utf-8')) &
+                       (collected['params'] == digest.encode('utf-8'))))
+
+
+def mark_collected(f, seqName, evalType, digest, end):
+    collected = f["collected"]
+    collected.resize(collected.shape[0] + 1, axis=0)
+    collected[-1] = (seqName.encode('utf-8'), evalType.encode('utf-8'), digest.encode('utf-8'), end)
+    f.flush()
+
+
+def resume_point(f):
+    """
+    rows after the end of the last finished sequence belong to an interrupted collection and are overwritten
+    """
+    if "collected" not in f or f["collected"].shape[0] == 0:
+        return 0
+    return int(f["collected"]["end"].max())
+
+
+def _flatten(datasets):
+    flat = []
+    for d in datasets:
+        if type(d) == list:
+            flat += d
+        else:
+            flat.append(d)
+    return flat
+
+
+def reserve(datasets, num_samples, grow_step=1000):
+    """
+    make sure every dataset can hold at least num_samples rows
+    """
+    for d in _flatten(datasets):
+        if d.shape[0] < num_samples:
+            d.resize(max(num_samples, d.shape[0] + grow_step), axis=0)
+
+
+def truncate(datasets, num_samples):
+    for d in _flatten(datasets):
+        d.resize(num_samples, axis=0)
+
+
+def merge_shards(shard_filenames, filename):
+    """
+    stitch the shards written by the collection workers into one store of virtual datasets,
+    no sample is copied, the merged file only references the shards (paths relative to the merged file,
+    so the shard directory can be mounted anywhere on a shared filesystem)
+    :return: total number of samples
+    """
+    merge_dir = os.path.dirname(os.path.abspath(filename))
+    sources = []
+    layout = None
+    file_attrs = {}
+    for shard_filename in shard_filenames:
+        with h5py.File(shard_filename, "r") as shard:
+            num = shard["y_train"].shape[0]
+            if num == 0:
+                continue
+            if layout is not None and get_layout(shard) != layout:
+                raise ValueError("cannot merge shards of different layouts: %s" % shard_filename)
+            layout = get_layout(shard)
+            # only the per row datasets are merged, "collected" refers to row numbers inside the shard
+            names = sorted(k for k in shard.keys() if k != "collected")
+            file_attrs.update((k, v) for k, v in shard.attrs.items() if k.startswith("params_"))
+            shapes = dict((name, shard[name].shape) for name in names)
+            dtypes = dict((name, shard[name].dtype) for name in names)
+            attrs = dict((name, dict(shard[name].attrs)) for name in names)
+        sources.append((os.path.relpath(os.path.abspath(shard_filename), merge_dir), num, shapes, dtypes))
+
+    total_num = sum(s[1] for s in sources)
+    if total_num == 0:
+        raise ValueError("no samples found in the shards")
+
+    with h5py.File(filename, "w") as f:
+        for name in names:
+            v_layout = h5py.VirtualLayout(shape=(total_num,) + sources[0][2][name][1:], dtype=sources[0][3][name])
+            offset = 0
+            for shard_filename, num, shapes, _ in sources:
+                v_layout[offset:offset + num] = h5py.VirtualSource(shard_filename, name, shape=shapes[name])
+                offset += num
+            d = f.create_virtual_dataset(name, v_layout)
+            for key, value in attrs[name].items():
+                d.attrs[key] = value
+        f.attrs["layout"] = layout
+        for key, value in file_attrs.items():
+            f.attrs[key] = value
+        f.attrs["shards"] = np.array([s[0] for s in sources], dtype=h5py.special_dtype(vlen=str))
+    return total_num
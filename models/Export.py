@@ -0,0 +1,293 @@
+"""
+Inference export of the trained regression CNNs.
+
+The BatchNormalization layers of models.CNN follow the ReLU of their conv/dense layer, so they can not simply be
+merged into it. fold_batchnorm removes every BN whose affine transform can be moved into a neighbouring layer
+without changing the output:
+    backward, into the Conv2D/Dense right before it when that layer has a linear activation
+    forward, into the next Dense (through Flatten/AveragePooling2D/Dropout, MaxPooling2D for positive scales)
+        or the next Conv2D with 'valid' padding
+A BN followed by a 'same' padded convolution is kept: the zero padding is applied after the BN, the folded shift
+would also be added at the padded border. In cnn_hiararchical_batchnormalisation this folds the BNs of the last
+conv block and of the dense layer.
+
+export_npz writes the (folded) layer graph and weights to a .npz file for the NumPy engine of models.NumpyCNN.
+
+usage:
+    python -m models.Export -m <model.h5> -o <folded.h5>
+    python -m models.Export -b cnn_hiararchical_batchnormalisation -w <weights.hdf5> -o <folded.h5 | model.npz>
+the folded model is saved with model.save, either file can be used as the model_path of KMCTracker.
+"""
+from __future__ import print_function
+import sys
+import getopt
+import numpy as np
+from keras.models import Sequential, Model, load_model
+from models import CNN
+
+PASS_THROUGH = ('AveragePooling2D', 'Dropout', 'Flatten', 'MaxPooling2D')
+
+
+def _graph(model):
+    """
+    :return: the model config, its list of layer configs and the input layer names of every layer
+    """
+    config = model.get_config()
+    if isinstance(model, Sequential):
+        layers = config if isinstance(config, list) else config['layers']
+        names = [layer['config']['name'] for layer in layers]
+        inputs = dict((name, names[i - 1:i]) for i, name in enumerate(names))
+    else:
+        layers = config['layers']
+        inputs = dict((layer['name'], [inbound[0] for node in layer['inbound_nodes'] for inbound in node])
+                      for layer in layers)
+    return config, layers, inputs
+
+
+def _layer_config(layer):
+    return layer['config']
+
+
+def _channel_axis(layer):
+    """
+    :return: the channel axis of the output of a Conv2D/Dense/pooling layer, counted without the batch axis
+    """
+    if layer.__class__.__name__ == 'Dense':
+        return len(layer.output_shape) - 2
+    # Conv2D and the pooling layers
+    return 0 if layer.get_config()['data_format'] == 'channels_first' else 2
+
+
+def bn_affine(layer):
+    """
+    :return: scale and shift of a BatchNormalization layer at inference, bn(x) = x * scale + shift
+    """
+    config = layer.get_config()
+    weights = list(layer.get_weights())
+    gamma = weights.pop(0) if config['scale'] else 1.
+    beta = weights.pop(0) if config['center'] else 0.
+    mean, var = weights
+    scale = gamma / np.sqrt(var + config['epsilon'])
+    return scale, beta - mean * scale
+
+
+def _bias(weights, layer_config, num):
+    if layer_config['use_bias']:
+        return weights[1]
+    layer_config['use_bias'] = True
+    weights.append(np.zeros(num, dtype=weights[0].dtype))
+    return weights[1]
+
+
+def fold_batchnorm(model):
+    """
+    :return: an equivalent model without the foldable BatchNormalization layers, the names of the BNs kept
+    """
+    config, layers, inputs = _graph(model)
+    by_name = dict((_layer_config(layer)['name'], layer) for layer in layers)
+    consumers = dict((name, []) for name in inputs)
+    for name in inputs:
+        for input_name in inputs[name]:
+            consumers[input_name].append(name)
+    weights = dict((layer.name, layer.get_weights()) for layer in model.layers)
+
+    folded, kept = [], []
+    for layer in model.layers:
+        if layer.__class__.__name__ != 'BatchNormalization':
+            continue
+        scale, shift = bn_affine(layer)
+        axis = layer.get_config()['axis'] % len(layer.output_shape) - 1
+
+        # backward: bn(x W + b) = x (W * scale) + b * scale + shift
+        source = model.get_layer(inputs[layer.name][0]) if inputs[layer.name] else None
+        if source.__class__.__name__ in ('Conv2D', 'Dense') and consumers[source.name] == [layer.name] and \
+                source.get_config()['activation'] == 'linear' and _channel_axis(source) == axis:
+            w = weights[source.name]
+            b = _bias(w, _layer_config(by_name[source.name]), len(scale))
+            w[1] = b * scale + shift
+            w[0] = w[0] * scale
+            folded.append(layer.name)
+            continue
+
+        # forward, through layers that act on every channel separately
+        path = []
+        target = layer.name
+        while len(consumers[target]) == 1:
+            target = consumers[target][0]
+            target_class = model.get_layer(target).__class__.__name__
+            if target_class not in PASS_THROUGH or (target_class == 'MaxPooling2D' and np.any(scale <= 0)) or \
+                    ('Pooling' in target_class and _channel_axis(model.get_layer(target)) != axis):
+                break
+            path.append(model.get_layer(target))
+        else:
+            kept.append(layer.name)
+            continue
+        target_layer = model.get_layer(target)
+        flatten = [l for l in path if l.__class__.__name__ == 'Flatten']
+        if target_class == 'Dense':
+            # input unit i of the dense layer sees channel ids[i] of the BN
+            if flatten:
+                shape = flatten[0].input_shape[1:]
+                ids = np.broadcast_to(np.arange(len(scale)).reshape([-1 if i == axis else 1
+                                                                     for i in range(len(shape))]), shape).ravel()
+            elif axis == len(layer.output_shape) - 2:
+                ids = np.arange(len(scale))
+            else:
+                kept.append(layer.name)
+                continue
+            w = weights[target]
+            b = _bias(w, _layer_config(by_name[target]), w[0].shape[1])
+            w[1] = b + np.dot(shift[ids], w[0])
+            w[0] = w[0] * scale[ids][:, None]
+        elif target_class == 'Conv2D' and target_layer.get_config()['padding'] == 'valid' and not flatten and \
+                _channel_axis(target_layer) == axis:
+            w = weights[target]
+            b = _bias(w, _layer_config(by_name[target]), w[0].shape[3])
+            w[1] = b + np.einsum('hwio,i->o', w[0], shift)
+            w[0] = w[0] * scale[None, None, :, None]
+        else:
+            kept.append(layer.name)
+            continue
+        folded.append(layer.name)
+
+    # rebuild the model without the folded layers
+    for name in folded:
+        layers.remove(by_name[name])
+        if isinstance(model, Sequential):
+            if 'batch_input_shape' in by_name[name]['config'] and layers:
+                layers[0]['config']['batch_input_shape'] = by_name[name]['config']['batch_input_shape']
+            continue
+        inbound = by_name[name]['inbound_nodes'][0][0]
+        for layer in layers:
+            layer['inbound_nodes'] = [[inbound if node_input[0] == name else node_input for node_input in node]
+                                      for node in layer['inbound_nodes']]
+        config['output_layers'] = [inbound[:3] if output[0] == name else output
+                                   for output in config['output_layers']]
+    if isinstance(model, Sequential):
+        new_model = Sequential.from_config(config)
+    else:
+        new_model = Model.from_config(config)
+    for layer in new_model.layers:
+        if weights.get(layer.name):
+            layer.set_weights(weights[layer.name])
+    new_model.name = model.name
+    return new_model, kept
+
+
+def random_inputs(model, num_samples=8):
+    """
+    inputs in the range of the response maps fed by KMCTracker (/ 255. - 0.5)
+    """
+    input_shapes = model.input_shape if isinstance(model.input_shape, list) else [model.input_shape]
+    return [np.random.rand(*((num_samples,) + tuple(input_shape[1:]))).astype('float32') - 0.5
+            for input_shape in input_shapes]
+
+
+def max_difference(model, other, inputs):
+    """
+    :return: largest absolute difference of the outputs of the two models, largest absolute output of model
+    """
+    out = model.predict(inputs)
+    other_out = other.predict(inputs)
+    return np.max(np.abs(out - other_out)), np.max(np.abs(out))
+
+
+def export_folded(model, filename, tolerance=1e-4, num_samples=8):
+    """
+    fold the BNs of model, check the folded model against it and save it
+    """
+    folded, kept = fold_batchnorm(model)
+    diff, magnitude = max_difference(model, folded, random_inputs(model, num_samples))
+    print("folded %d BatchNormalization layers, kept %s, max difference %g (outputs up to %g)"
+          % (len([l for l in model.layers if l.__class__.__name__ == 'BatchNormalization']) - len(kept),
+             kept, diff, magnitude))
+    if diff > tolerance * max(magnitude, 1.):
+        raise ValueError("the folded model differs from %s by %g" % (model.name, diff))
+    folded.save(filename)
+    return folded
+
+
+def export_npz(model, filename, fold=True, tolerance=1e-4, num_samples=8):
+    """
+    write the layer graph and the weights of model for models.NumpyCNN, the BNs are folded first
+    and the ones kept are stored as a scale and a shift
+    """
+    from models.NumpyCNN import NumpyModel, LAYERS, save_graph
+    if fold:
+        model = fold_batchnorm(model)[0]
+    config, layers, inputs = _graph(model)
+    if isinstance(model, Sequential):
+        input_names = ['input']
+        inputs[model.layers[0].name] = input_names
+    else:
+        input_names = [layer[0] for layer in config['input_layers']]
+    input_shapes = model.input_shape if isinstance(model.input_shape, list) else [model.input_shape]
+    graph = {'name': model.name,
+             'input_names': input_names,
+             'input_shapes': [list(shape) for shape in input_shapes],
+             'output_names': [model.layers[-1].name] if isinstance(model, Sequential)
+             else [layer[0] for layer in config['output_layers']],
+             'layers': []}
+    arrays = {}
+    for layer in model.layers:
+        class_name = layer.__class__.__name__
+        if class_name == 'InputLayer':
+            continue
+        if class_name != 'Concatenate' and class_name not in LAYERS:
+            raise ValueError("layer %s of type %s is not supported by models.NumpyCNN" % (layer.name, class_name))
+        weights = list(bn_affine(layer)) if class_name == 'BatchNormalization' else layer.get_weights()
+        for i, w in enumerate(weights):
+            arrays['%s:%d' % (layer.name, i)] = np.asarray(w, dtype=np.float32)
+        graph['layers'].append({'name': layer.name, 'class_name': class_name, 'config': layer.get_config(),
+                                'inbound': inputs[layer.name], 'num_weights': len(weights)})
+    save_graph(filename, graph, arrays)
+
+    diff, magnitude = max_difference(model, NumpyModel(filename), random_inputs(model, num_samples))
+    print("exported %s to %s, max difference %g (outputs up to %g)" % (model.name, filename, diff, magnitude))
+    if diff > tolerance * max(magnitude, 1.):
+        raise ValueError("the NumPy model differs from %s by %g" % (model.name, diff))
+
+
+def load(model_file=None, builder=None, weights_file=None):
+    """
+    a complete model saved by model.save, or a models.CNN architecture and the weights saved by the
+    ModelCheckpoint of step_2 (save_weights_only=True)
+    """
+    if model_file:
+        return load_model(model_file, custom_objects={'l1_smooth_loss': CNN.l1_smooth_loss})
+    model = getattr(CNN, builder)()
+    model.load_weights(weights_file)
+    return model
+
+
+def main(argv):
+    model_file, builder, weights_file, output = None, None, None, None
+    usage = 'usage : python -m models.Export -m <model> | -b <models.CNN builder> -w <weights>, -o <output>'
+    try:
+        opts, args = getopt.getopt(argv, "hm:b:w:o:", ["model=", "builder=", "weights=", "output="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-m", "--model"):
+            model_file = arg
+        elif opt in ("-b", "--builder"):
+            builder = arg
+        elif opt in ("-w", "--weights"):
+            weights_file = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+    if output is None or not (model_file or (builder and weights_file)):
+        print(usage)
+        sys.exit(1)
+    if output.endswith('.npz'):
+        export_npz(load(model_file, builder, weights_file), output)
+    else:
+        export_folded(load(model_file, builder, weights_file), output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
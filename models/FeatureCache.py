@@ -0,0 +1,140 @@
+"""
+On-disk cache of the VGG19 feature maps computed by KMCTracker.get_features.
+
+The features only depend on the image crop (and the size it is resized to), not on the kernel parameters
+(feature_bandwidth_sigma, sigma_coff, lambda_value, adaptation_rate...), so a parameter sweep only runs the
+network on its first pass. Entries are addressed by the content of the crop, i.e. by the frame and the
+quantised crop geometry it was cut with, and every sequence has its own directory:
+    <cache_dir>/<sequence>/index.txt       one "key row" line per cached crop
+    <cache_dir>/<sequence>/level_<i>.dat   raw rows of feature level i, read through np.memmap
+    <cache_dir>/<sequence>/lock            taken (fcntl.flock) to change the files of the sequence
+
+Several processes (the workers of a pool, the nodes sharing the cache directory over NFS) can fill the cache of
+a sequence at the same time: a row is appended to the level files and to the index under the lock of the
+sequence, after the index written by the others since it was last read.
+"""
+import os
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+
+
+class FeatureCache(object):
+    def __init__(self, cache_dir, dtype='float32'):
+        """
+        :param dtype: storage dtype, the features are float32 so float16 halves the cache size
+            but the tracker no longer reproduces the uncached results exactly
+        """
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
+        self.seq_dir = None
+        self.index = {}
+        # the bytes of index.txt already read into self.index
+        self.index_offset = 0
+        self.shapes = None
+        self.maps = []
+        self.hits = 0
+        self.misses = 0
+
+    def open_sequence(self, name):
+        """
+        select the directory of sequence name, created on the first call. Until a sequence is opened the cache is
+        empty and put stores nothing
+        """
+        seq_dir = os.path.join(self.cache_dir, name)
+        if seq_dir == self.seq_dir:
+            return
+        if not os.path.exists(seq_dir):
+            os.makedirs(seq_dir)
+        self.seq_dir = seq_dir
+        self.index = {}
+        self.index_offset = 0
+        self.maps = []
+        self.shapes = None
+        with self._locked():
+            self._read_index()
+            if self.shapes is not None:
+                # a crash between writing the levels and the index leaves unindexed rows behind, drop them.
+                # Under the lock the rows of the other writers are all indexed already
+                for i, shape in enumerate(self.shapes):
+                    with open(self._level_file(i), 'ab') as f:
+                        f.truncate(len(self.index) * self._row_bytes(shape))
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.seq_dir, 'lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        """
+        read the meta data and the index lines written since the last call, under the lock
+        """
+        meta_file = os.path.join(self.seq_dir, 'meta.json')
+        if self.shapes is None and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            self.shapes = [tuple(shape) for shape in meta['shapes']]
+            self.dtype = np.dtype(meta['dtype'])
+        index_file = os.path.join(self.seq_dir, 'index.txt')
+        if not os.path.exists(index_file):
+            return
+        with open(index_file, 'rb') as f:
+            f.seek(self.index_offset)
+            data = f.read()
+        self.index_offset += len(data)
+        for line in data.decode('ascii').splitlines():
+            key, row = line.split()
+            self.index[key] = int(row)
+
+    @staticmethod
+    def key(im_crop, resize_size):
+        im_crop = np.ascontiguousarray(im_crop)
+        h = hashlib.sha1(im_crop.tobytes())
+        h.update(repr((im_crop.shape, im_crop.dtype.str, tuple(resize_size))).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        row = self.index.get(key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if len(self.maps) == 0 or self.maps[0].shape[0] <= row:
+            # the level files grew since they were mapped
+            self.maps = [np.memmap(self._level_file(i), dtype=self.dtype, mode='r',
+                                   shape=(len(self.index),) + shape) for i, shape in enumerate(self.shapes)]
+        return [np.array(m[row], dtype=np.float32) for m in self.maps]
+
+    def put(self, key, features_list):
+        if self.seq_dir is None or key in self.index:
+            return
+        with self._locked():
+            # the rows appended by the other writers
+            self._read_index()
+            if key in self.index:
+                return
+            if self.shapes is None:
+                self.shapes = [tuple(features.shape) for features in features_list]
+                with open(os.path.join(self.seq_dir, 'meta.json'), 'w') as f:
+                    json.dump({'shapes': self.shapes, 'dtype': self.dtype.str}, f)
+            row = len(self.index)
+            for i, features in enumerate(features_list):
+                with open(self._level_file(i), 'ab') as f:
+                    f.write(np.ascontiguousarray(features, dtype=self.dtype).tobytes())
+            line = ('%s %d\n' % (key, row)).encode('ascii')
+            with open(os.path.join(self.seq_dir, 'index.txt'), 'ab') as f:
+                f.write(line)
+            self.index_offset += len(line)
+            self.index[key] = row
+
+    def _level_file(self, i):
+        return os.path.join(self.seq_dir, 'level_%d.dat' % i)
+
+    def _row_bytes(self, shape):
+        return int(np.prod(shape)) * self.dtype.itemsize
@@ -0,0 +1,136 @@
+"""
+Memory mapped copy of an HDF5 sample store, for training only.
+
+The store is written once and read many times, so after the collection it can be converted to a directory of
+raw arrays described by a small JSON header:
+    <flat_dir>/header.json   file attributes (layout, params_<digest>...) and name, dtype, shape and attributes
+                             of every dataset
+    <flat_dir>/<name>.dat    the rows of dataset <name>, C order, no padding
+Reads are plain (fancy) indexing of np.memmap arrays served from the OS page cache: no library call per read
+and no file lock, so any number of reader processes (PrefetchGenerator workers) share the same cached pages.
+
+FlatStore mimics the few h5py.File / h5py.Dataset features the loaders use, so models.DataStore.open_store
+returns one whenever it is given a directory and Generator, DataLoader and read_samples work unchanged.
+"""
+import os
+import json
+import numpy as np
+from models.DataStore import open_store
+
+HEADER_FILE = "header.json"
+
+
+class FlatDataset(object):
+    def __init__(self, data, attrs):
+        self.data = data
+        self.attrs = attrs
+        # rows are independent pages, there is no chunk grid to align reads on
+        self.chunks = None
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, key):
+        return np.asarray(self.data[key])
+
+    def read_direct(self, dest, source_sel=None, dest_sel=None):
+        source_sel = Ellipsis if source_sel is None else source_sel
+        dest_sel = Ellipsis if dest_sel is None else dest_sel
+        dest[dest_sel] = self.data[source_sel]
+
+
+class FlatStore(object):
+    def __init__(self, flat_dir, mode="r"):
+        """
+        :param mode: "r", or "r+" to modify rows in place (the number of rows is fixed)
+        """
+        self.filename = flat_dir
+        with open(os.path.join(flat_dir, HEADER_FILE)) as f:
+            header = json.load(f)
+        self.attrs = header["attrs"]
+        self.datasets = {}
+        for name, d in header["datasets"].items():
+            data = np.memmap(os.path.join(flat_dir, name + ".dat"), mode=mode,
+                             dtype=np.dtype(_to_descr(d["dtype"])), shape=tuple(d["shape"]))
+            self.datasets[name] = FlatDataset(data, d["attrs"])
+
+    def __getitem__(self, name):
+        return self.datasets[name]
+
+    def __contains__(self, name):
+        return name in self.datasets
+
+    def keys(self):
+        return self.datasets.keys()
+
+    def flush(self):
+        for d in self.datasets.values():
+            d.data.flush()
+
+    def close(self):
+        self.flush()
+        self.datasets = {}
+
+
+def _to_descr(descr):
+    # json turns the (name, format) tuples of a structured dtype into lists
+    if isinstance(descr, list):
+        return [tuple(field) for field in descr]
+    return descr
+
+
+def _from_dtype(dtype):
+    # field by field, the string fields of h5py carry an encoding in their metadata that json can not store
+    if dtype.names:
+        return [(name, dtype.fields[name][0].str) for name in dtype.names]
+    return dtype.str
+
+
+def _attr_value(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def convert(filename, flat_dir, rows_per_read=1024):
+    """
+    copy every per row dataset of an HDF5 store (family file, shard or merged virtual store) to flat_dir,
+    the storage dtype is kept, quantised datasets stay quantised with their scale datasets
+    :return: number of samples
+    """
+    if not os.path.exists(flat_dir):
+        os.makedirs(flat_dir)
+    f = open_store(filename)
+    # "collected" refers to the collection, not to the samples, it is only needed to resume step_1
+    names = sorted(k for k in f.keys() if k != "collected")
+    num_samples = f["y_train"].shape[0]
+    header = {"attrs": dict((k, _attr_value(v)) for k, v in f.attrs.items()), "datasets": {}}
+    for name in names:
+        data = f[name]
+        out = np.memmap(os.path.join(flat_dir, name + ".dat"), mode="w+", dtype=data.dtype, shape=data.shape)
+        for start in range(0, data.shape[0], rows_per_read):
+            end = min(start + rows_per_read, data.shape[0])
+            data.read_direct(out, np.s_[start:end], np.s_[start:end])
+        out.flush()
+        del out
+        header["datasets"][name] = {"dtype": _from_dtype(data.dtype),
+                                    "shape": list(data.shape),
+                                    "attrs": dict((k, _attr_value(v)) for k, v in data.attrs.items())}
+    f.close()
+    # the header is written last, a directory without one is an unfinished conversion
+    with open(os.path.join(flat_dir, HEADER_FILE + ".tmp"), "w") as f:
+        json.dump(header, f, indent=1)
+    os.rename(os.path.join(flat_dir, HEADER_FILE + ".tmp"), os.path.join(flat_dir, HEADER_FILE))
+    return num_samples
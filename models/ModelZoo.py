@@ -0,0 +1,220 @@
+"""
+Registry of the regression CNN architectures of models.CNN and of their latency tiers.
+
+KMCTracker runs the regression CNN once per frame with a batch of one sample. The architectures differ mostly
+by the convolution of the 240x160 response level and by the width of the layers, the slim variants of
+models.CNN (cnn_sigma_slim, cnn_sigma_coarse...) trade accuracy for throughput. A tier names the architecture
+to use for a latency budget, KMCTracker(model_tier=...) loads the trained model of the tier from MODEL_DIR:
+    <MODEL_DIR>/<architecture>.h5    the Keras model saved by step_2_CNN_training
+    <MODEL_DIR>/latency.json         the latencies measured by the benchmark on this machine
+This module does not import Keras, the builders are looked up in models.CNN when a model is built.
+
+The benchmark reports, for every architecture, the parameter count, the per frame latency (batch of one, the
+median over the repeats) of Keras and of the NumPy engine and the peak memory of a NumPy forward pass (the
+largest amount of memory allocated during the call, weights excluded; tracemalloc, Python 3 only). The
+latencies are kept in latency.json, the tiers stay the fixed mapping of TIERS and within_latency picks the most
+accurate tier architecture whose measured Keras latency fits a budget.
+
+usage:
+    python -m models.ModelZoo [-m <architecture or tier>,...] [-r <repeats>] [-o <report.json>]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import getopt
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+MODEL_DIR = './trained_models/'
+# response levels of the collected store (models.DataStore.RESPONSE_MAP_SHAPE)
+NUM_LEVELS = 5
+
+# architecture: models.CNN builder, number of response levels it takes, description
+MODEL_ZOO = OrderedDict([
+    ('cnn_hiararchical_batchnormalisation', ('cnn_hiararchical_batchnormalisation', 5,
+                                             'cnn_sigma with BatchNormalization')),
+    ('cnn_sigma', ('cnn_sigma', 5, '5 levels, 16-64 filters, dense 512')),
+    ('cnn_sigma_slim', ('cnn_sigma_slim', 5, '5 levels, 8-32 filters, dense 256')),
+    ('cnn_sigma_coarse', ('cnn_sigma_coarse', 4, 'without the 240x160 level')),
+    ('cnn_sigma_coarse_slim', ('cnn_sigma_coarse_slim', 4, 'without the 240x160 level, 8-32 filters, dense 256')),
+])
+
+LATENCY_FILE = 'latency.json'
+
+# from the most accurate to the fastest
+TIERS = OrderedDict([
+    ('accurate', 'cnn_hiararchical_batchnormalisation'),
+    ('balanced', 'cnn_sigma'),
+    ('fast', 'cnn_sigma_slim'),
+    ('faster', 'cnn_sigma_coarse'),
+    ('fastest', 'cnn_sigma_coarse_slim'),
+])
+
+
+def load_latencies(model_dir=MODEL_DIR):
+    """
+    :return: architecture -> {'keras': seconds, 'numpy': seconds} measured by the benchmark
+    """
+    filename = os.path.join(model_dir, LATENCY_FILE)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_latencies(report, model_dir=MODEL_DIR):
+    """
+    add the latencies of a benchmark report to those measured before
+    """
+    latencies = load_latencies(model_dir)
+    for r in report:
+        latencies[r['model']] = {'keras': r['keras_latency'], 'numpy': r['numpy_latency']}
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
+    with open(os.path.join(model_dir, LATENCY_FILE), 'w') as f:
+        json.dump(latencies, f, indent=1, sort_keys=True)
+
+
+def within_latency(budget, model_dir=MODEL_DIR):
+    """
+    :param budget: seconds per frame
+    :return: the most accurate tier architecture whose measured Keras latency is within budget, the fastest
+        measured one if none is
+    """
+    latencies = load_latencies(model_dir)
+    measured = sorted((name for name in TIERS.values() if name in latencies),
+                      key=lambda name: latencies[name]['keras'], reverse=True)
+    if not measured:
+        raise ValueError("no latency measured in %s, run python -m models.ModelZoo first" % model_dir)
+    for name in measured:
+        if latencies[name]['keras'] <= budget:
+            return name
+    return measured[-1]
+
+
+def architecture(name):
+    """
+    :param name: an architecture of MODEL_ZOO or a tier
+    """
+    name = TIERS.get(name, name)
+    if name not in MODEL_ZOO:
+        raise ValueError("unknown model %s, the tiers are %s and the architectures %s"
+                         % (name, list(TIERS), list(MODEL_ZOO)))
+    return name
+
+
+def build(name, **kwargs):
+    from models import CNN
+    return getattr(CNN, MODEL_ZOO[architecture(name)][0])(**kwargs)
+
+
+def first_level(name):
+    """
+    :return: the first response level the architecture takes (models.DataLoader.Generator)
+    """
+    return NUM_LEVELS - MODEL_ZOO[architecture(name)][1]
+
+
+def model_path(name, model_dir=MODEL_DIR):
+    """
+    :return: the trained Keras model of an architecture or a tier
+    """
+    path = os.path.join(model_dir, architecture(name) + '.h5')
+    if not os.path.exists(path):
+        raise IOError("no trained model %s" % path)
+    return path
+
+
+def _latency(predict, inputs, repeats):
+    # the first calls build the Keras/TensorFlow functions and warm the caches
+    for _ in range(3):
+        predict(inputs)
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        predict(inputs)
+        times.append(time.time() - start)
+    return float(np.median(times))
+
+
+def _peak_memory(predict, inputs):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    predict(inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(names=None, repeats=50, model_dir=MODEL_DIR):
+    """
+    the latencies are added to <model_dir>/latency.json
+    :return: one dict per architecture, latencies in seconds, memory in bytes
+    """
+    from models.Export import export_npz, random_inputs
+    from models.NumpyCNN import NumpyModel
+    report = []
+    for name in names or list(MODEL_ZOO):
+        name = architecture(name)
+        model = build(name)
+        inputs = random_inputs(model, 1)
+        inputs = inputs if len(inputs) > 1 else inputs[0]
+        fd, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            export_npz(model, filename)
+            numpy_model = NumpyModel(filename)
+            weight_bytes = os.path.getsize(filename)
+        finally:
+            os.remove(filename)
+        report.append({'model': name,
+                       'levels': MODEL_ZOO[name][1],
+                       'params': model.count_params(),
+                       'weight_bytes': weight_bytes,
+                       'keras_latency': _latency(model.predict, inputs, repeats),
+                       'numpy_latency': _latency(numpy_model.predict, inputs, repeats),
+                       'numpy_peak_memory': _peak_memory(numpy_model.predict, inputs)})
+    save_latencies(report, model_dir)
+    for r in report:
+        r['tiers'] = [tier for tier, arch in TIERS.items() if arch == r['model']]
+
+    print("%-38s %-9s %10s %10s %10s %10s" % ('model', 'tier', 'params', 'keras ms', 'numpy ms', 'peak MB'))
+    for r in report:
+        peak = '-' if r['numpy_peak_memory'] is None else '%.1f' % (r['numpy_peak_memory'] / 2. ** 20)
+        print("%-38s %-9s %10d %10.2f %10.2f %10s" % (r['model'], ','.join(r['tiers']) or '-', r['params'],
+                                                     r['keras_latency'] * 1e3, r['numpy_latency'] * 1e3, peak))
+    return report
+
+
+def main(argv):
+    names, repeats, output = None, 50, None
+    usage = 'usage : python -m models.ModelZoo -m <architecture or tier>,... -r <repeats> -o <report.json>'
+    try:
+        opts, args = getopt.getopt(argv, "hm:r:o:", ["models=", "repeats=", "output="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-m", "--models"):
+            names = arg.split(',')
+        elif opt in ("-r", "--repeats"):
+            repeats = int(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+    report = benchmark(names, repeats)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+"""
+NumPy inference of the regression CNNs exported by models.Export.export_npz.
+
+NumpyModel runs the layer graph of a Keras model with NumPy only. It is the reference the exports are checked
+against (models.Export folds the BNs and compares the outputs), the engine of the int8 calibration of
+models.Quantise and the NumPy column of the models.ModelZoo benchmark. It is not an inference path of KMCTracker:
+it is slower than Keras (the matrix products of the hierarchical models take most of the time and those of
+TensorFlow are faster), the trackers load the Keras models.
+The convolutions are one matrix product of im2col patches (a strided view of the padded input) and the kernel,
+the pooling layers reduce a reshaped or strided view. The padded inputs (per padding) and the patch matrices are
+written into buffers allocated once per shape (per thread) and reused by the following calls: for a batch of one
+most of the time of a fresh allocation goes to the page faults of the new memory.
+
+Supported layers: InputLayer, Conv2D, Dense, BatchNormalization (as scale and shift), AveragePooling2D,
+MaxPooling2D, Concatenate, Flatten, Dropout, Activation. Tensors keep the layout Keras gives them
+(channels_first convolutions are computed channels_last and transposed back).
+
+Conv2D and Dense layers quantised by models.Quantise have an "input_scale" in their config and the weights
+(int8 kernel, bias, per output channel kernel scale): the input is rounded to the int8 grid of input_scale and
+multiplied by the int8 kernel, the products are rescaled by input_scale * kernel_scale. NumPy has no fast int8
+matrix product: the int8 kernels are converted to float32 once, when the model is loaded, and multiplied as
+float32 (the integer values are exact in float32). The int8 model only saves space on disk, it runs at the speed
+of the float one.
+"""
+import json
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 1. / (1. + np.exp(-x)),
+    'tanh': np.tanh,
+}
+
+# the buffers of the calling thread, by (use, shape)
+_workspace = threading.local()
+
+
+def _buffer(use, shape):
+    """
+    :return: a float32 buffer of shape, zeros when it is allocated and left as the last call wrote it
+    """
+    buffers = _workspace.__dict__.setdefault('buffers', {})
+    key = (use, shape)
+    if key not in buffers:
+        buffers[key] = np.zeros(shape, dtype=np.float32)
+    return buffers[key]
+
+
+def _same_padding(size, kernel, stride):
+    # TensorFlow 'same': the output has ceil(size / stride) rows, the extra padding goes to the bottom/right
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _pad(x, kernel_size, strides, padding, value=0.):
+    if padding != 'same':
+        return x
+    pads = [(0, 0)] + [_same_padding(x.shape[i + 1], kernel_size[i], strides[i]) for i in range(2)] + [(0, 0)]
+    return np.pad(x, pads, mode='constant', constant_values=value)
+
+
+def _pad_into(x, kernel_size, strides, padding):
+    """
+    zero 'same' padding of a float32 x into a buffer, only the inside is written: the buffer is kept per
+    padding, so its border is never written and stays 0
+    """
+    if padding != 'same':
+        return np.ascontiguousarray(x, dtype=np.float32)
+    pads = [_same_padding(x.shape[i + 1], kernel_size[i], strides[i]) for i in range(2)]
+    if not any(pads[0] + pads[1]):
+        return np.ascontiguousarray(x, dtype=np.float32)
+    n, h, w, c = x.shape
+    padded = _buffer(('padded',) + pads[0] + pads[1], (n, h + sum(pads[0]), w + sum(pads[1]), c))
+    padded[:, pads[0][0]:pads[0][0] + h, pads[1][0]:pads[1][0] + w] = x
+    return padded
+
+
+def _windows(x, kernel_size, strides):
+    """
+    :param x: (n, h, w, c)
+    :return: strided view (n, out_h, out_w, kh, kw, c) of the windows of x, no copy
+    """
+    n, h, w, c = x.shape
+    out_h = (h - kernel_size[0]) // strides[0] + 1
+    out_w = (w - kernel_size[1]) // strides[1] + 1
+    s = x.strides
+    return as_strided(x, (n, out_h, out_w, kernel_size[0], kernel_size[1], c),
+                      (s[0], s[1] * strides[0], s[2] * strides[1], s[1], s[2], s[3]), writeable=False)
+
+
+def _channels_last(x, config):
+    return x.transpose(0, 2, 3, 1) if config.get('data_format') == 'channels_first' else x
+
+
+def _channels_back(x, config):
+    return x.transpose(0, 3, 1, 2) if config.get('data_format') == 'channels_first' else x
+
+
+def quantise_input(x, config):
+    """
+    round x to the int8 grid of a quantised layer, the float layers get x back
+    """
+    if 'input_scale' not in config:
+        return x
+    return np.clip(np.round(x * np.float32(1. / config['input_scale'])), -127, 127)
+
+
+def _rescale(y, config, kernel_scale):
+    if kernel_scale is not None:
+        y *= kernel_scale * np.float32(config['input_scale'])
+    return y
+
+
+def conv2d(x, config, kernel, bias=None, kernel_scale=None):
+    if tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+        raise ValueError("dilated convolutions are not supported")
+    x = _pad_into(_channels_last(quantise_input(x, config), config), kernel.shape[:2], config['strides'],
+                  config['padding'])
+    windows = _windows(x, kernel.shape[:2], config['strides'])
+    # im2col: the windows are copied into one (n * out_h * out_w, kh * kw * c) matrix
+    patches = _buffer('patches', windows.shape)
+    patches[...] = windows
+    y = np.dot(patches.reshape(-1, int(np.prod(kernel.shape[:3]))), kernel.reshape(-1, kernel.shape[3]))
+    y = _rescale(y.reshape(windows.shape[:3] + (kernel.shape[3],)), config, kernel_scale)
+    if bias is not None:
+        y += bias
+    return _channels_back(ACTIVATIONS[config['activation']](y), config)
+
+
+def dense(x, config, kernel, bias=None, kernel_scale=None):
+    y = _rescale(np.dot(quantise_input(x, config), kernel), config, kernel_scale)
+    if bias is not None:
+        y += bias
+    return ACTIVATIONS[config['activation']](y)
+
+
+def pooling(x, config, reduce):
+    pool_size, strides = tuple(config['pool_size']), tuple(config['strides'] or config['pool_size'])
+    x = _channels_last(x, config)
+    if config['padding'] == 'valid' and pool_size == strides:
+        # non overlapping windows: combine the pool_size[0] * pool_size[1] strided slices of x elementwise,
+        # much faster than reducing over two axes of a reshaped x
+        out_h, out_w = x.shape[1] // pool_size[0], x.shape[2] // pool_size[1]
+        combine = np.add if reduce is np.mean else np.maximum
+        y = None
+        for i in range(pool_size[0]):
+            for j in range(pool_size[1]):
+                window = x[:, i:out_h * pool_size[0]:pool_size[0], j:out_w * pool_size[1]:pool_size[1]]
+                y = window.copy() if y is None else combine(y, window, out=y)
+        if reduce is np.mean:
+            y *= np.float32(1. / (pool_size[0] * pool_size[1]))
+    else:
+        # the padded positions are left out of the average and of the maximum, as in TensorFlow
+        x = _pad(x.astype(np.float32), pool_size, strides, config['padding'], value=np.nan)
+        nan_reduce = np.nanmean if reduce is np.mean else np.nanmax
+        y = nan_reduce(_windows(np.ascontiguousarray(x), pool_size, strides), axis=(3, 4))
+    return _channels_back(y, config)
+
+
+def batch_normalization(x, config, scale, shift):
+    shape = [1] * x.ndim
+    shape[config['axis']] = -1
+    y = x * scale.reshape(shape)
+    y += shift.reshape(shape)
+    return y
+
+
+LAYERS = {
+    'Conv2D': conv2d,
+    'Dense': dense,
+    'BatchNormalization': batch_normalization,
+    'AveragePooling2D': lambda x, config: pooling(x, config, np.mean),
+    'MaxPooling2D': lambda x, config: pooling(x, config, np.max),
+    'Flatten': lambda x, config: x.reshape(x.shape[0], -1),
+    'Dropout': lambda x, config: x,
+    'Activation': lambda x, config: ACTIVATIONS[config['activation']](x.copy()),
+}
+
+
+def load_graph(filename):
+    """
+    :return: the layer graph and a dict of the weights ("<layer name>:<i>") of a file written by save_graph
+    """
+    data = np.load(filename)
+    return json.loads(str(data['graph'])), dict((key, data[key]) for key in data.files if key != 'graph')
+
+
+def save_graph(filename, graph, arrays):
+    np.savez(filename, graph=np.array(json.dumps(graph)), **arrays)
+
+
+class NumpyModel(object):
+    def __init__(self, filename):
+        graph, data = load_graph(filename)
+        self.name = graph['name']
+        self.input_names = graph['input_names']
+        self.output_names = graph['output_names']
+        self.input_shape = [tuple(shape) for shape in graph['input_shapes']]
+        if len(self.input_shape) == 1:
+            self.input_shape = self.input_shape[0]
+        self.layers = []
+        for layer in graph['layers']:
+            if layer['class_name'] != 'Concatenate' and layer['class_name'] not in LAYERS:
+                raise ValueError("layer %s of type %s is not supported" % (layer['name'], layer['class_name']))
+            weights = [data['%s:%d' % (layer['name'], i)] for i in range(layer['num_weights'])]
+            # the int8 kernels of a quantised layer are multiplied as float32, converted once here
+            weights = [w.astype(np.float32) if w.dtype == np.int8 else w for w in weights]
+            self.layers.append((layer['name'], layer['class_name'], layer['config'], layer['inbound'], weights))
+
+    def run(self, x):
+        """
+        :return: the output of every layer (and input) by name
+        """
+        inputs = x if type(x) == list else [x]
+        values = dict((name, np.asarray(v, dtype=np.float32)) for name, v in zip(self.input_names, inputs))
+        for name, class_name, config, inbound, weights in self.layers:
+            if class_name == 'Concatenate':
+                values[name] = np.concatenate([values[i] for i in inbound], axis=config['axis'])
+            else:
+                values[name] = LAYERS[class_name](values[inbound[0]], config, *weights)
+        return values
+
+    def predict(self, x, batch_size=None):
+        """
+        same call as keras Model.predict, the whole input is computed as one batch
+        """
+        values = self.run(x)
+        outputs = [values[name] for name in self.output_names]
+        return outputs[0] if len(outputs) == 1 else outputs
@@ -0,0 +1,139 @@
+"""
+Multi-process prefetching on top of models.DataLoader.Generator.
+
+h5py file handles can not be shared between threads (nor with Keras' thread workers), so every worker process
+opens the store itself, reads its share of the blocks into its shuffle window and gathers complete five-input
+batches from the window directly into a ring of preallocated batch slots in shared memory. The training process
+yields numpy views on the slots, no batch is copied on its way to the model.
+"""
+from collections import deque
+from multiprocessing import Process, Queue, RawArray
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+import numpy as np
+from models.DataLoader import Generator
+
+# seconds between two checks of the workers while the training process waits for a batch
+WAIT_SECONDS = 10
+
+
+class BatchRing(object):
+    """
+    num_slots preallocated batches in shared memory: one float32 array per response level and the targets
+    """
+    def __init__(self, num_slots, batch_size, response_map_shape, target_dim=2):
+        self.levels = [self._shared((num_slots, batch_size) + tuple(shape) + (1,)) for shape in response_map_shape]
+        self.targets = self._shared((num_slots, batch_size, target_dim))
+        self.free_slots = Queue()
+        self.ready_slots = Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    @staticmethod
+    def _shared(shape):
+        return np.frombuffer(RawArray('f', int(np.prod(shape))), dtype=np.float32).reshape(shape)
+
+
+def fill_ring(filename, generator_kwargs, train, part, ring):
+    np.random.seed(part[0] * 7919 + int(train))
+    # the batches are gathered into the ring slots, the generator needs no batch buffer of its own
+    gen = Generator(filename, num_buffers=0, **generator_kwargs)
+    taken = deque()
+
+    def free_slots():
+        while True:
+            slot = ring.free_slots.get()
+            taken.append(slot)
+            yield [level[slot] for level in ring.levels], ring.targets[slot]
+
+    for _ in gen.generate_blocks(train, part, batches=free_slots()):
+        ring.ready_slots.put(taken.popleft())
+
+
+class PrefetchGenerator(object):
+    def __init__(self, filename,
+                 batch_size=128,
+                 response_map_shape=[(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)],
+                 block_size=64,
+                 shuffle_window=2048,
+                 num_workers=4,
+                 num_slots=32,
+                 hold=12,
+                 cache_bytes=0,
+                 cache_policy="static",
+                 target_dim=2,
+                 first_level=0):
+        """
+        :param hold: number of yielded batches whose slots are kept before they are handed back to the workers,
+            it has to be larger than the queue of the consumer (max_queue_size of fit_generator, 10 by default)
+            because the batches are views on the ring
+        :param cache_bytes: memory budget of the chunk caches of all the workers (see ChunkCache), shared out
+            between the training and the validation workers in proportion to the size of their split
+        """
+        if num_slots <= hold + num_workers:
+            raise ValueError("num_slots must be larger than hold + num_workers")
+        self.filename = filename
+        self.batch_size = batch_size
+        self.response_map_shape = response_map_shape[first_level:]
+        self.num_workers = num_workers
+        self.num_slots = num_slots
+        self.hold = hold
+        self.generator_kwargs = dict(batch_size=batch_size, response_map_shape=response_map_shape,
+                                     block_size=max(block_size, 1), shuffle_window=shuffle_window,
+                                     cache_policy=cache_policy, target_dim=target_dim,
+                                     first_level=first_level)
+        self.cache_bytes = cache_bytes
+        self.target_dim = target_dim
+        # the split sizes come from a generator of our own, closed again before any worker is forked
+        gen = Generator(filename, **self.generator_kwargs)
+        self.train_batches = gen.train_batches
+        self.val_batches = gen.val_batches
+        gen.file.close()
+        self.workers = []
+
+    def start(self, train):
+        """
+        :return: the ring the new workers fill and the workers
+        """
+        ring = BatchRing(self.num_slots, self.batch_size, self.response_map_shape, self.target_dim)
+        generator_kwargs = dict(self.generator_kwargs,
+                                cache_bytes=int(self.cache_bytes * (0.9 if train else 0.1) / self.num_workers))
+        workers = []
+        for i in range(self.num_workers):
+            p = Process(target=fill_ring,
+                        args=(self.filename, generator_kwargs, train, (i, self.num_workers), ring))
+            p.daemon = True
+            p.start()
+            workers.append(p)
+        self.workers.extend(workers)
+        return ring, workers
+
+    @staticmethod
+    def ready_slot(ring, workers):
+        """
+        wait for the next batch of the ring, the workers never stop on their own: raise if one of them exited
+        """
+        while True:
+            try:
+                return ring.ready_slots.get(timeout=WAIT_SECONDS)
+            except Empty:
+                for p in workers:
+                    if not p.is_alive():
+                        raise RuntimeError("prefetch worker %s exited with code %s" % (p.name, p.exitcode))
+
+    def generate(self, train=True):
+        ring, workers = self.start(train)
+        in_use = deque()
+        while True:
+            slot = self.ready_slot(ring, workers)
+            in_use.append(slot)
+            if len(in_use) > self.hold:
+                ring.free_slots.put(in_use.popleft())
+            yield ([level[slot] for level in ring.levels], ring.targets[slot])
+
+    def close(self):
+        for p in self.workers:
+            p.terminate()
+        self.workers = []
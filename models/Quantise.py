@@ -0,0 +1,175 @@
+"""
+Post-training int8 quantisation of a regression CNN exported by models.Export.export_npz.
+
+The kernels of the Conv2D and Dense layers are quantised symmetrically per output channel, the inputs of these
+layers per tensor, with a scale calibrated on response maps of the collected HDF5 store (training split). The
+int8 model is written in the format of models.NumpyCNN and runs with its NumpyModel (the trackers run the Keras
+models, the int8 model measures what an int8 deployment of the network would lose). The report compares the int8 and the float outputs on the validation split. The int8 model
+is four times smaller on disk, it is not a faster model: NumpyModel converts its kernels to float32 at load.
+
+usage:
+    python -m models.Quantise -m <model.npz> -d <store> -o <model_int8.npz> [-n <samples>] [-p <percentile>]
+"""
+from __future__ import print_function
+import sys
+import json
+import getopt
+import numpy as np
+from models.NumpyCNN import NumpyModel, load_graph, save_graph
+from models.DataLoader import Generator
+from models.DataStore import RESPONSE_MAP_SHAPE
+
+QUANTISED_LAYERS = ('Conv2D', 'Dense')
+
+
+def model_samples(model):
+    """
+    :return: first_level and target_dim of the samples model takes, the coarse models (cnn_sigma_coarse...)
+        have no input for the finest response levels
+    """
+    first_level = len(RESPONSE_MAP_SHAPE) - len(model.input_shape)
+    outputs = model.predict([np.zeros((1,) + tuple(shape[1:]), np.float32) for shape in model.input_shape])
+    return first_level, outputs.shape[1]
+
+
+def samples(filename, train, num_samples, batch_size=64, target_dim=4, first_level=0):
+    """
+    yield batches of (inputs, targets) of the store, from random blocks of the training or the validation split
+    """
+    gen = Generator(filename, batch_size=batch_size, block_size=batch_size, shuffle_window=batch_size,
+                    num_buffers=1, target_dim=target_dim, first_level=first_level)
+    batches = gen.generate_blocks(train)
+    # the blocks of a split are visited again once they are used up, do not count samples twice
+    num_samples = min(num_samples, gen.train_num if train else gen.valid_num)
+    for _ in range(max(num_samples // batch_size, 1)):
+        yield next(batches)
+
+
+def calibrate(model, batches, percentile=99.99):
+    """
+    :return: the input scale of every quantised layer: the percentile of the absolute input values (the largest
+        over the batches) mapped to 127
+    """
+    layers = [(name, inbound[0]) for name, class_name, config, inbound, weights in model.layers
+              if class_name in QUANTISED_LAYERS]
+    ranges = dict((name, 0.) for name, _ in layers)
+    for inputs, _ in batches:
+        values = model.run(inputs)
+        for name, input_name in layers:
+            ranges[name] = max(ranges[name], float(np.percentile(np.abs(values[input_name]), percentile)))
+    return dict((name, max(r, np.finfo(np.float32).tiny) / 127.) for name, r in ranges.items())
+
+
+def quantise_kernel(kernel):
+    """
+    :return: int8 kernel, float32 scale of every output channel (last axis)
+    """
+    max_abs = np.abs(kernel.reshape(-1, kernel.shape[-1])).max(axis=0)
+    scale = np.where(max_abs > 0, max_abs / 127., 1.).astype(np.float32)
+    return np.clip(np.round(kernel / scale), -127, 127).astype(np.int8), scale
+
+
+def quantise_graph(graph, arrays, input_scales):
+    """
+    :return: the graph and weights of the int8 model
+    """
+    graph = json.loads(json.dumps(graph))
+    arrays = dict(arrays)
+    for layer in graph['layers']:
+        if layer['name'] not in input_scales:
+            continue
+        name = layer['name']
+        kernel, kernel_scale = quantise_kernel(arrays['%s:0' % name])
+        bias = arrays['%s:1' % name] if layer['num_weights'] > 1 else np.zeros(kernel.shape[-1], np.float32)
+        arrays['%s:0' % name], arrays['%s:1' % name], arrays['%s:2' % name] = kernel, bias, kernel_scale
+        layer['num_weights'] = 3
+        layer['config']['input_scale'] = input_scales[name]
+    graph['name'] += '_int8'
+    return graph, arrays
+
+
+def compare(model, quantised, batches):
+    """
+    :return: report of the differences between the float and the int8 outputs and of their errors
+        against the targets, per output
+    """
+    diffs, float_errors, int8_errors = [], [], []
+    for inputs, targets in batches:
+        out = model.predict(inputs)
+        out_q = quantised.predict(inputs)
+        diffs.append(np.abs(out - out_q))
+        float_errors.append(np.abs(out - targets[:, :out.shape[1]]))
+        int8_errors.append(np.abs(out_q - targets[:, :out.shape[1]]))
+    diffs, float_errors, int8_errors = [np.concatenate(d) for d in (diffs, float_errors, int8_errors)]
+    return {'num_samples': len(diffs),
+            'max_abs_difference': diffs.max(axis=0).tolist(),
+            'mean_abs_difference': diffs.mean(axis=0).tolist(),
+            'float_mean_abs_error': float_errors.mean(axis=0).tolist(),
+            'int8_mean_abs_error': int8_errors.mean(axis=0).tolist()}
+
+
+def weight_bytes(arrays):
+    return int(sum(a.nbytes for a in arrays.values()))
+
+
+def quantise(model_file, store, output, num_samples=512, percentile=99.99):
+    model = NumpyModel(model_file)
+    if not isinstance(model.input_shape, list):
+        raise ValueError("the store holds the response levels of the multi-input models, %s has one input"
+                         % model.name)
+    first_level, target_dim = model_samples(model)
+    graph, arrays = load_graph(model_file)
+    input_scales = calibrate(model, samples(store, True, num_samples, target_dim=target_dim,
+                                            first_level=first_level), percentile)
+    graph_q, arrays_q = quantise_graph(graph, arrays, input_scales)
+    save_graph(output, graph_q, arrays_q)
+
+    report = compare(model, NumpyModel(output), samples(store, False, num_samples, target_dim=target_dim,
+                                                        first_level=first_level))
+    report.update({'model': model_file, 'calibration_percentile': percentile, 'input_scales': input_scales,
+                   'float_weight_bytes': weight_bytes(arrays), 'int8_weight_bytes': weight_bytes(arrays_q)})
+    with open(output + '.report.json', 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print("%s: %d held-out samples, weights on disk %d -> %d bytes" % (graph_q['name'], report['num_samples'],
+                                                               report['float_weight_bytes'],
+                                                               report['int8_weight_bytes']))
+    print("%-8s %12s %12s %12s %12s" % ('output', 'max |diff|', 'mean |diff|', 'float err', 'int8 err'))
+    for i in range(len(report['max_abs_difference'])):
+        print("%-8d %12.6f %12.6f %12.6f %12.6f" % (i, report['max_abs_difference'][i],
+                                                     report['mean_abs_difference'][i],
+                                                     report['float_mean_abs_error'][i],
+                                                     report['int8_mean_abs_error'][i]))
+    return report
+
+
+def main(argv):
+    model_file, store, output, num_samples, percentile = None, None, None, 512, 99.99
+    usage = 'usage : python -m models.Quantise -m <model.npz> -d <store> -o <output.npz> ' \
+            '-n <samples> -p <percentile>'
+    try:
+        opts, args = getopt.getopt(argv, "hm:d:o:n:p:", ["model=", "data=", "output=", "samples=", "percentile="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-m", "--model"):
+            model_file = arg
+        elif opt in ("-d", "--data"):
+            store = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt in ("-n", "--samples"):
+            num_samples = int(arg)
+        elif opt in ("-p", "--percentile"):
+            percentile = float(arg)
+    if not (model_file and store and output):
+        print(usage)
+        sys.exit(1)
+    quantise(model_file, store, output, num_samples, percentile)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
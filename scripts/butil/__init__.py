@@ -3,11 +3,15 @@ import math
 from config import *
 from seq_config import *
 from eval_results import *
+from eval_cache import *
+from compare_trackers import *
 from load_results import *
 from shift_bbox import *
 from split_seq import *
 from calc_seq_err_robust import *
 from calc_rect_center import *
+from result_cache import *
+from work_queue import *
 
 def d_to_f(x):
     return map(lambda o:round(float(o),4), x)
@@ -1,19 +1,23 @@
 import math
+import numpy as np
 from scripts import *
 import scripts.butil
 
 def calc_seq_err_robust(results, rect_anno):
+    """
+    the frames are handled as (N, 4) arrays, the values are the ones of the per frame computation: the center
+    errors rounded with round(x, 4), the averages summed frame after frame, -1 for the frames without a valid
+    annotation
+    """
     seq_length = len(results.res)
     res = results.res
-    centerGT = [[r[0]+(r[2]-1)/2.0, r[1]+(r[3]-1)/2.0] for r in rect_anno]
-    
+
     rectMat = [[0, 0, 0, 0]] * seq_length
     # print "%d %d" % (seq_length, len(rect_anno))
     resultType = results.resType
     if resultType == 'rect':
         # get rid of zeros
-        import numpy as np
-        rectMat = [np.clip(x, 1, 10e5) for x in res]
+        rectMat = np.clip(_rects(res), 1, 10e5)
     elif resultType == 'ivtAff' or resultType == 'affine_ivt':
         for i in range(seq_length):
             # rect, c, corn = scripts.butil.calc_rect_center(results['tmplsize'], res[i])
@@ -48,50 +52,76 @@ def calc_seq_err_robust(results, rect_anno):
             # corenr, c = m.getLKcorner(wapr_p, results['tmplsize'], nargout=2)
             # rectMat[i] = scripts.butil.do_to_f(m.corner2rect(corner, nargout=1)[0])
 
-    rectMat[0] = rect_anno[0]
-    center = [[r[0]+(r[2]-1)/2.0, r[1]+(r[3]-1)/2.0] for r in rectMat]
-    if len(centerGT) < seq_length:
-        seq_length = len(centerGT)
-    errCenter = [round(scripts.butil.ssd(center[i], centerGT[i]),4)
-        for i in range(seq_length)]
-
-    idx = [sum([x>0 for x in r])==4 for r in rect_anno]
-    tmp = calc_rect_int(rectMat, rect_anno)
-    errCoverage = [-1] * seq_length
-    totalerrCoverage = 0
-    totalerrCenter = 0
-
-    for i in range(seq_length):
-        if idx[i]:
-            errCoverage[i] = tmp[i]
-            totalerrCoverage += errCoverage[i]
-            totalerrCenter += errCenter[i]
-        else:
-            errCenter[i] = -1
-
-    aveErrCoverage = totalerrCoverage / float(sum(idx))
-    aveErrCenter = totalerrCenter / float(sum(idx))
+    rectMat = _rects(rectMat)
+    anno = _rects(rect_anno)
+    rectMat[0] = anno[0]
+    if len(anno) < seq_length:
+        seq_length = len(anno)
+    center = _centers(rectMat[:seq_length])
+    centerGT = _centers(anno[:seq_length])
+    # sqrt(dx ** 2 + dy ** 2) as butil.ssd
+    distance = np.sqrt((center[:, 0] - centerGT[:, 0]) ** 2 + (center[:, 1] - centerGT[:, 1]) ** 2)
+    errCenter = [round(e, 4) for e in distance.tolist()]
+
+    idx = (anno > 0).sum(axis=1) == 4
+    valid = idx[:seq_length].tolist()
+    tmp = calc_rect_int(rectMat, anno)
+    errCoverage = [c if v else -1 for c, v in zip(tmp, valid)]
+    errCenter = [e if v else -1 for e, v in zip(errCenter, valid)]
+    # the built-in sum adds from left to right, as the per frame loop
+    totalerrCoverage = sum(c for c, v in zip(errCoverage, valid) if v)
+    totalerrCenter = sum(e for e, v in zip(errCenter, valid) if v)
+
+    aveErrCoverage = totalerrCoverage / float(idx.sum())
+    aveErrCenter = totalerrCenter / float(idx.sum())
 
     return aveErrCoverage, aveErrCenter, errCoverage, errCenter
 
+
+def _rects(rects):
+    """
+    :return: the [x, y, w, h] rects as an (N, 4) float array
+    """
+    return np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+
+
+def _centers(rects):
+    return np.stack([rects[:, 0] + (rects[:, 2] - 1) / 2.0, rects[:, 1] + (rects[:, 3] - 1) / 2.0], axis=1)
+
+
+def _max(a, b):
+    # max(a, b) of Python: a unless b is larger
+    return np.where(b > a, b, a)
+
+
+def _min(a, b):
+    return np.where(b < a, b, a)
+
+
 def calc_rect_int(A, B):
-    leftA = [a[0] for a in A]
-    bottomA = [a[1] for a in A]
-    rightA = [leftA[i] + A[i][2] - 1 for i in range(len(A))]
-    topA = [bottomA[i] + A[i][3] - 1 for i in range(len(A))]
-
-    leftB = [b[0] for b in B]
-    bottomB = [b[1] for b in B]
-    rightB = [leftB[i] + B[i][2] - 1 for i in range(len(B))]
-    topB = [bottomB[i] + B[i][3] - 1 for i in range(len(B))]
-
-    overlap = []
-    length = min(len(leftA), len(leftB))
-    for i in range(length):
-        tmp = (max(0, min(rightA[i], rightB[i]) - max(leftA[i], leftB[i])+1)
-            * max(0, min(topA[i], topB[i]) - max(bottomA[i], bottomB[i])+1))
-        areaA = A[i][2] * A[i][3]
-        areaB = B[i][2] * B[i][3]
-        overlap.append(tmp/float(areaA+areaB-tmp))
-
-    return overlap
+    """
+    :return: the overlap (intersection over union) of the rects of A and B, frame by frame, as a list
+    """
+    A = _rects(A)
+    B = _rects(B)
+    length = min(len(A), len(B))
+    A = A[:length]
+    B = B[:length]
+    leftA, bottomA = A[:, 0], A[:, 1]
+    rightA = leftA + A[:, 2] - 1
+    topA = bottomA + A[:, 3] - 1
+
+    leftB, bottomB = B[:, 0], B[:, 1]
+    rightB = leftB + B[:, 2] - 1
+    topB = bottomB + B[:, 3] - 1
+
+    # a nan rect has no overlap, as with the built-in max and min
+    with np.errstate(invalid='ignore'):
+        tmp = (_max(0, _min(rightA, rightB) - _max(leftA, leftB) + 1)
+               * _max(0, _min(topA, topB) - _max(bottomA, bottomB) + 1))
+    areaA = A[:, 2] * A[:, 3]
+    areaB = B[:, 2] * B[:, 3]
+    union = areaA + areaB - tmp
+    if np.any(union == 0):
+        raise ZeroDivisionError("float division by zero")
+    return (tmp / union).tolist()
@@ -0,0 +1,220 @@
+"""
+Scores of several trackers computed together.
+
+compare_trackers takes the errors of every (tracker, sequence) from the eval cache (result_errors, the
+annotations are loaded once for all the trackers) and computes the success and precision curves of all of
+them at once: the frames of every (tracker, sequence) are laid end to end, each error is binned against the
+thresholds (searchsorted) and counted per (tracker, sequence) with a single bincount. An attribute is a mask
+over the sequences, the sequences a tracker has no result for are left out of its averages. The scores are
+those of calc_scores (the rates are added sequence after sequence as well).
+
+The comparison is a dict of arrays indexed by tracker and attribute (sorted by name, as calc_result):
+    success      (trackers, attributes, thresholdSetOverlap)
+    precision    (trackers, attributes, thresholdSetError)
+    overlap, error, numSeqs, auc (mean of the success curve), precision20, rank (by AUC, 1 is the best)
+"""
+import os
+import csv
+import json
+from collections import OrderedDict
+import numpy as np
+from config import thresholdSetOverlap, thresholdSetError, ATTR_DESC_FILE
+from scripts.model.score import Score
+from eval_results import _sequential_sum
+from eval_cache import result_errors, anno_digest
+
+PRECISION_THRESHOLD = 20
+FAILURE_THRESHOLD = 0.5
+
+
+def attribute_names(SRC_DIR):
+    with open(SRC_DIR + ATTR_DESC_FILE) as f:
+        names = [Score.getScoreFromLine(line).name for line in f.readlines()]
+    return sorted(names + ['ALL'])
+
+
+def _frames(errors, index):
+    """
+    :param index: 2 for errCoverage, 3 for errCenter (seq_errors)
+    :return: the errors of every row laid end to end (as set_seq_errors), the number of frames of every row
+    """
+    values = [np.concatenate([np.asarray(sub[index], dtype=np.float64) for sub in row]) for row in errors]
+    return np.concatenate(values) if values else np.zeros(0), np.array([len(v) for v in values], dtype=np.int64)
+
+
+def _row_counts(rows, bins, num_rows, num_bins):
+    return np.bincount(rows * num_bins + bins, minlength=num_rows * num_bins).reshape(num_rows, num_bins)
+
+
+def row_scores(errors):
+    """
+    :param errors: the seq_errors of the results of every row
+    :return: the success rates, precision rates, mean positive overlaps and failures of every row, as seq_scores
+    """
+    if not errors:
+        # no result at all, bincount does not take an empty minlength on older numpy
+        return (np.zeros((0, len(thresholdSetOverlap))), np.zeros((0, len(thresholdSetError))), np.zeros(0),
+                np.zeros(0))
+    overlapThresholds = np.array(thresholdSetOverlap, dtype=np.float64)
+    errorThresholds = np.array(thresholdSetError, dtype=np.float64)
+    coverage, numCoverage = _frames(errors, 2)
+    center, numCenter = _frames(errors, 3)
+    rowsCoverage = np.repeat(np.arange(len(errors)), numCoverage)
+    rowsCenter = np.repeat(np.arange(len(errors)), numCenter)
+    # a nan error is never counted
+    validCoverage = ~np.isnan(coverage)
+    validCenter = ~np.isnan(center)
+
+    # the number of thresholds below each overlap, the overlaps above threshold k are those with more than k
+    bins = np.searchsorted(overlapThresholds, coverage[validCoverage], side='left')
+    counts = _row_counts(rowsCoverage[validCoverage], bins, len(errors), len(overlapThresholds) + 1)
+    above = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    successRates = above / numCoverage[:, None].astype(np.float64)
+
+    # the number of thresholds up to each center error, the errors below threshold k are those with at most k
+    bins = np.searchsorted(errorThresholds, center[validCenter], side='right')
+    counts = _row_counts(rowsCenter[validCenter], bins, len(errors), len(errorThresholds) + 1)
+    below = np.cumsum(counts, axis=1)[:, :len(errorThresholds)]
+    precisionRates = below / numCenter[:, None].astype(np.float64)
+
+    failures = np.bincount(rowsCoverage[validCoverage], weights=coverage[validCoverage] < FAILURE_THRESHOLD,
+                           minlength=len(errors))
+    errorNums = failures / numCenter.astype(np.float64) * 10
+
+    overlapScores = np.zeros(len(errors))
+    ends = np.cumsum(numCoverage)
+    for i in range(len(errors)):
+        values = coverage[ends[i] - numCoverage[i]:ends[i]]
+        with np.errstate(invalid='ignore'):
+            overlapList = values[values > 0]
+        overlapScores[i] = float(_sequential_sum(overlapList)) / len(overlapList)
+    return successRates, precisionRates, overlapScores, errorNums
+
+
+def compare_trackers(trackers, seqs, evalType, SRC_DIR):
+    """
+    :param trackers: objects with a name, the results saved under RESULT_SRC/<evalType>/<name>
+    :return: the comparison, see the module
+    """
+    available = np.zeros((len(trackers), len(seqs)), dtype=bool)
+    annos = [anno_digest(seq) for seq in seqs]
+    errors = []
+    for i, t in enumerate(trackers):
+        for j, seq in enumerate(seqs):
+            seqErrors = result_errors(evalType, t, seq, annos[j])
+            if seqErrors is not None:
+                available[i, j] = True
+                errors.append(seqErrors)
+    successRates, precisionRates, overlapScores, errorNums = row_scores(errors)
+
+    def per_seq(rows):
+        values = np.zeros(available.shape + rows.shape[1:])
+        values[available] = rows
+        return values
+    successRates, precisionRates, overlapScores, errorNums = \
+        [per_seq(rows) for rows in (successRates, precisionRates, overlapScores, errorNums)]
+
+    attributes = attribute_names(SRC_DIR)
+    comparison = {'trackers': [t.name for t in trackers], 'attributes': attributes,
+                  'source': ['results' if available[i].any() else None for i in range(len(trackers))]}
+    shape = (len(trackers), len(attributes))
+    for key, size in (('success', len(thresholdSetOverlap)), ('precision', len(thresholdSetError))):
+        comparison[key] = np.zeros(shape + (size,))
+    for key in ('overlap', 'error', 'numSeqs'):
+        comparison[key] = np.zeros(shape)
+    for a, name in enumerate(attributes):
+        inAttr = np.array([name in seq.attributes or name.lower() == 'all' for seq in seqs], dtype=bool)
+        mask = available & inAttr[None, :]
+        numSeqs = mask.sum(axis=1).astype(np.float64)
+        # the sequences out of the mask add 0., the sums are those of the sequences of the attribute
+        with np.errstate(invalid='ignore', divide='ignore'):
+            comparison['success'][:, a] = \
+                _sequential_sum(np.where(mask[..., None], successRates, 0.).swapaxes(0, 1)) / numSeqs[:, None]
+            comparison['precision'][:, a] = \
+                _sequential_sum(np.where(mask[..., None], precisionRates, 0.).swapaxes(0, 1)) / numSeqs[:, None]
+            comparison['overlap'][:, a] = \
+                _sequential_sum(np.where(mask, overlapScores, 0.).T) / numSeqs * 100
+            comparison['error'][:, a] = _sequential_sum(np.where(mask, errorNums, 0.).T) / numSeqs
+        comparison['numSeqs'][:, a] = numSeqs
+    rank_trackers(comparison)
+    return comparison
+
+
+def use_saved_scores(comparison, name, scores):
+    """
+    fill the row of a tracker without results with its saved scores (load_scores)
+    """
+    i = comparison['trackers'].index(name)
+    byName = dict((attr.name, attr) for attr in scores)
+    for a, attrName in enumerate(comparison['attributes']):
+        attr = byName.get(attrName)
+        if attr is None or not attr.successRateList:
+            for key in ('success', 'precision', 'overlap', 'error'):
+                comparison[key][i, a] = np.nan
+            comparison['numSeqs'][i, a] = 0
+            continue
+        comparison['success'][i, a] = attr.successRateList
+        comparison['precision'][i, a] = attr.precisionRateList
+        comparison['overlap'][i, a] = attr.overlap
+        comparison['error'][i, a] = attr.error
+        comparison['numSeqs'][i, a] = len(attr.seqs)
+    comparison['source'][i] = 'scores'
+    rank_trackers(comparison)
+
+
+def rank_trackers(comparison):
+    """
+    AUC, precision at PRECISION_THRESHOLD pixels and rank by AUC of every tracker for every attribute, the
+    trackers without any sequence of an attribute come last (nan AUC)
+    """
+    comparison['auc'] = comparison['success'].mean(axis=2)
+    comparison['precision20'] = comparison['precision'][:, :, PRECISION_THRESHOLD]
+    rank = np.zeros(comparison['auc'].shape, dtype=np.int64)
+    for a in range(rank.shape[1]):
+        auc = comparison['auc'][:, a]
+        order = np.argsort(np.where(np.isnan(auc), np.inf, -auc), kind='mergesort')
+        rank[order, a] = np.arange(1, len(order) + 1)
+    comparison['rank'] = rank
+
+
+def score_table(comparison):
+    """
+    :return: one row per (attribute, tracker), by attribute and rank
+    """
+    table = []
+    for a, attrName in enumerate(comparison['attributes']):
+        for i in np.argsort(comparison['rank'][:, a], kind='mergesort'):
+            if comparison['numSeqs'][i, a] == 0:
+                continue
+            table.append(OrderedDict([('attribute', attrName),
+                                      ('rank', int(comparison['rank'][i, a])),
+                                      ('tracker', comparison['trackers'][i]),
+                                      ('auc', float(comparison['auc'][i, a])),
+                                      ('precision', float(comparison['precision20'][i, a])),
+                                      ('overlap', float(comparison['overlap'][i, a])),
+                                      ('failures', float(comparison['error'][i, a])),
+                                      ('sequences', int(comparison['numSeqs'][i, a])),
+                                      ('source', comparison['source'][i])]))
+    return table
+
+
+def save_comparison(comparison, filename):
+    """
+    write the score table to <filename>.csv and the table with the curves to <filename>.json
+    """
+    table = score_table(comparison)
+    if not os.path.exists(os.path.dirname(filename) or '.'):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename + '.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(table[0]) if table else [])
+        for row in table:
+            writer.writerow(list(row.values()))
+    curves = dict(((comparison['trackers'][i], attrName),
+                   (comparison['success'][i, a].tolist(), comparison['precision'][i, a].tolist()))
+                  for i in range(len(comparison['trackers'])) for a, attrName in enumerate(comparison['attributes']))
+    for row in table:
+        row['successRateList'], row['precisionRateList'] = curves[(row['tracker'], row['attribute'])]
+    with open(filename + '.json', 'w') as f:
+        json.dump(table, f, indent=1)
+    return table
@@ -0,0 +1,108 @@
+"""
+Errors of the saved results, computed once per result file and annotation.
+
+calc_result computes the errors of every result (calc_seq_err_robust) from the boxes each time a tracker is
+scored. calc_result_incremental scores the results saved under RESULT_SRC/<evalType>/<tracker>/<seq>.json
+with the errors kept in
+    RESULT_SRC/<evalType>/eval_cache/<tracker>/<seq>.json
+an entry is used as long as the result file has the same size and modification time (or, once they changed,
+the same content: the sha1 of the file) and the annotation of the sequence the same digest. Only the new and
+changed result files are loaded and evaluated again.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from config import RESULT_SRC
+from scripts.model.result import Result
+from eval_results import result_annos, seq_errors, set_seq_errors, calc_scores
+from result_cache import _write_json
+
+EVAL_CACHE_DIR = 'eval_cache'
+# to change when the errors computed for the same result change
+EVAL_CACHE_VERSION = 1
+
+# result file -> entry, a process scoring the same trackers again does not read the entries again
+_entries = {}
+
+
+def anno_digest(seq):
+    h = hashlib.sha1(np.asarray(seq.gtRect, dtype=np.float64).tobytes())
+    h.update(str(seq.startFrame).encode('utf-8'))
+    return h.hexdigest()
+
+
+def eval_cache_file(evalType, trackerName, seqName):
+    return os.path.join(RESULT_SRC.format(evalType), EVAL_CACHE_DIR, trackerName, seqName + '.json')
+
+
+def _load_entry(evalType, trackerName, seqName, result_file):
+    if result_file in _entries:
+        return _entries[result_file]
+    cache_file = eval_cache_file(evalType, trackerName, seqName)
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file) as f:
+        return json.load(f)
+
+
+def _save_entry(evalType, trackerName, seqName, result_file, entry):
+    cache_file = eval_cache_file(evalType, trackerName, seqName)
+    if not os.path.exists(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file))
+    _write_json(cache_file, entry)
+    _entries[result_file] = entry
+
+
+def result_errors(evalType, tracker, seq, anno=None):
+    """
+    :param anno: anno_digest(seq), computed once when the results of several trackers are evaluated
+    :return: the seq_errors of every result of the sequence saved for tracker, None without result file
+    """
+    result_file = os.path.join(RESULT_SRC.format(evalType), tracker.name, seq.name + '.json')
+    if not os.path.exists(result_file):
+        return None
+    stat = os.stat(result_file)
+    stamp = [stat.st_size, stat.st_mtime]
+    anno = anno or anno_digest(seq)
+    entry = _load_entry(evalType, tracker.name, seq.name, result_file)
+    if entry is not None and entry['version'] == EVAL_CACHE_VERSION and entry['anno'] == anno and \
+            entry['stamp'] == stamp:
+        return entry['errors']
+
+    with open(result_file, 'rb') as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    if entry is not None and entry['version'] == EVAL_CACHE_VERSION and entry['anno'] == anno and \
+            entry['sha1'] == sha1:
+        # touched or copied, not changed
+        entry['stamp'] = stamp
+        _save_entry(evalType, tracker.name, seq.name, result_file, entry)
+        return entry['errors']
+
+    print('Evaluating {0}/{1}...'.format(tracker.name, seq.name))
+    jsonList = json.loads(data.decode('utf-8'))
+    if type(jsonList) is dict:
+        jsonList = [jsonList]
+    results = [Result(**j) for j in jsonList]
+    errors = [list(seq_errors(result, sub_anno)) for result, sub_anno in result_annos(seq, results, evalType)]
+    _save_entry(evalType, tracker.name, seq.name, result_file,
+                {'version': EVAL_CACHE_VERSION, 'stamp': stamp, 'sha1': sha1, 'anno': anno, 'errors': errors})
+    return errors
+
+
+def calc_result_incremental(tracker, seqs, evalType, SRC_DIR):
+    """
+    calc_result of the results saved for tracker, with the errors of the eval cache. The errors are kept on
+    the sequences as calc_result does, the sequences without result file are left out of the scores.
+    :return: the scores of every attribute, as calc_result
+    """
+    scored = []
+    for seq in seqs:
+        errors = result_errors(evalType, tracker, seq)
+        if errors is None:
+            print('no result of {0} for {1}'.format(tracker.name, seq.name))
+            continue
+        set_seq_errors(seq, errors)
+        scored.append(seq)
+    return calc_scores(tracker, scored, evalType, SRC_DIR)
@@ -1,7 +1,139 @@
+import copy
+import numpy as np
 from config import *
 from scripts import *
 import scripts.butil
 
+
+def screening_padding(result, anno):
+    """
+    a screening run (step_3 -z) gives a sub-sequence up after a failure, its res stops there or holds
+    placeholders for the frames skipped before a re-initialisation
+    :return: the result with a res as long as the sub-sequence, the indices of the frames that were not tracked
+    """
+    length = min(len(anno), result.endFrame - result.startFrame + 1)
+    failed = set(range(len(result.res), length))
+    for start, end in result.screening['skipped']:
+        failed.update(range(start, min(end, length)))
+    padded = copy.copy(result)
+    padded.res = list(result.res[:length]) + [result.res[-1]] * (length - len(result.res))
+    return padded, sorted(failed)
+
+
+def count_failures(errCoverage, errCenter, failed):
+    """
+    the frames that were not tracked have no overlap and a center error beyond every threshold,
+    the average center error is the one of the tracked frames
+    :return: aveCoverage, aveErrCenter
+    """
+    for i in failed:
+        if errCoverage[i] != -1:
+            errCoverage[i] = 0
+            errCenter[i] = float('inf')
+    coverage = [c for c in errCoverage if c != -1]
+    center = [e for e in errCenter if e != -1 and e != float('inf')]
+    return sum(coverage) / float(len(coverage)), sum(center) / float(max(len(center), 1))
+
+
+def _sequential_sum(values):
+    """
+    :return: the sum of values along the first axis added one after the other, as the built-in sum does
+        (np.sum adds pairwise), 0 without values
+    """
+    if len(values) == 0:
+        return 0
+    return np.cumsum(values, axis=0)[-1]
+
+
+def seq_scores(seqs):
+    """
+    the success rate (overlap above every threshold of thresholdSetOverlap), the precision rate (center error
+    below every threshold of thresholdSetError), the mean positive overlap and the failures (overlap below 0.5,
+    per 10 frames) of the frames of every sequence, counted with searchsorted on the sorted errors. The frames
+    without annotation (-1) count in the number of frames, the ones that were not tracked have a center error
+    of inf (count_failures), a nan error is never counted, as in a comparison.
+    :return: arrays of one row or value per sequence
+    """
+    overlapThresholds = np.array(thresholdSetOverlap, dtype=np.float64)
+    errorThresholds = np.array(thresholdSetError, dtype=np.float64)
+    successRates = np.zeros((len(seqs), len(overlapThresholds)))
+    precisionRates = np.zeros((len(seqs), len(errorThresholds)))
+    overlapScores = np.zeros(len(seqs))
+    errorNums = np.zeros(len(seqs))
+    for i, seq in enumerate(seqs):
+        coverage = np.asarray(seq.errCoverage, dtype=np.float64)
+        center = np.asarray(seq.errCenter, dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            overlapList = coverage[coverage > 0]
+        overlapScores[i] = float(_sequential_sum(overlapList)) / len(overlapList)
+
+        sortedCoverage = np.sort(coverage[~np.isnan(coverage)])
+        sortedCenter = np.sort(center[~np.isnan(center)])
+        above = len(sortedCoverage) - np.searchsorted(sortedCoverage, overlapThresholds, side='right')
+        successRates[i] = above / float(len(coverage))
+        below = np.searchsorted(sortedCenter, errorThresholds, side='left')
+        precisionRates[i] = below / float(len(center))
+
+        THRESHOLD = 0.5
+        errorNums[i] = np.searchsorted(sortedCoverage, THRESHOLD, side='left') / float(len(center)) * 10
+    return successRates, precisionRates, overlapScores, errorNums
+
+
+def result_annos(seq, subResults, evalType):
+    """
+    :return: the (result, annotation) pairs evaluated for the results of a sequence, the first one for OPE
+    """
+    if evalType == 'SRE':
+        idxNum = len(subResults)
+    elif evalType == 'TRE':
+        idxNum = len(subResults)
+    elif evalType == 'OPE':
+        idxNum = 1
+    pairs = []
+    for j in range(idxNum):
+        result = subResults[j]
+        anno = seq.gtRect
+        if evalType == 'TRE':
+            if len(seq.gtRect) < result.endFrame:
+                anno = seq.gtRect[result.startFrame-seq.startFrame:
+                    result.endFrame-seq.startFrame+1]
+            else:
+                anno = seq.gtRect[result.startFrame-1:
+                    result.endFrame]
+        pairs.append((result, anno))
+    return pairs
+
+
+def seq_errors(result, anno):
+    """
+    :return: aveCoverage, aveErrCenter, errCoverage, errCenter of a result, the frames given up by a screening
+        run count as failures
+    """
+    evaluated, failed = result, []
+    if getattr(result, 'screening', None):
+        evaluated, failed = screening_padding(result, anno)
+    aveCoverage, aveErrCenter, errCoverage, errCenter = \
+        scripts.butil.calc_seq_err_robust(evaluated, anno)
+    if failed:
+        aveCoverage, aveErrCenter = count_failures(errCoverage, errCenter, failed)
+    return aveCoverage, aveErrCenter, errCoverage, errCenter
+
+
+def set_seq_errors(seq, errors):
+    """
+    keep the errors of the results of a sequence (seq_errors of every result) on seq, as calc_scores reads them
+    """
+    seq.aveCoverage = []
+    seq.aveErrCenter = []
+    seq.errCoverage = []
+    seq.errCenter = []
+    for aveCoverage, aveErrCenter, errCoverage, errCenter in errors:
+        seq.aveCoverage.append(aveCoverage)
+        seq.aveErrCenter.append(aveErrCenter)
+        seq.errCoverage += errCoverage
+        seq.errCenter += errCenter
+
+
 def calc_result(tracker, seqs, results, evalType, SRC_DIR):
 
     seqResultList = dict((s.name,list()) for s in seqs)
@@ -9,41 +141,22 @@ def calc_result(tracker, seqs, results, evalType, SRC_DIR):
         subResults = results[i]
 
         seq = next(seq for seq in seqs if seq.name.lower() == subResults[0].seqName.lower())
-        seq.aveCoverage = []
-        seq.aveErrCenter = []
-        seq.errCoverage = []
-        seq.errCenter = []
-
-        if evalType == 'SRE':
-            idxNum = len(subResults)
-            anno = seq.gtRect
-        elif evalType == 'TRE':
-            idxNum = len(subResults)
-        elif evalType == 'OPE':
-            idxNum = 1
-            anno = seq.gtRect
-
-        for j in range(idxNum):
-            result = subResults[j]
-            if evalType == 'TRE':
-                if len(seq.gtRect) < result.endFrame:
-                    anno = seq.gtRect[result.startFrame-seq.startFrame:
-                        result.endFrame-seq.startFrame+1]
-                else:
-                    anno = seq.gtRect[result.startFrame-1:
-                        result.endFrame]
+        errors = []
+        for result, anno in result_annos(seq, subResults, evalType):
             print(seq.name)
-            aveCoverage, aveErrCenter, errCoverage, errCenter = \
-                scripts.butil.calc_seq_err_robust(result, anno)
-            seq.aveCoverage.append(aveCoverage)
-            seq.aveErrCenter.append(aveErrCenter)
-            seq.errCoverage += errCoverage
-            seq.errCenter += errCenter
-            seqName = seq.name
-            seqResultList[seqName].append(result)
-        #end for j
+            errors.append(seq_errors(result, anno))
+            seqResultList[seq.name].append(result)
+        set_seq_errors(seq, errors)
     # end for i
 
+    return seqResultList, calc_scores(tracker, seqs, evalType, SRC_DIR)
+
+
+def calc_scores(tracker, seqs, evalType, SRC_DIR):
+    """
+    :return: the scores of every attribute (and 'ALL') from the errors kept on the sequences by set_seq_errors
+    """
+
     def getScoreList(SRC_DIR):
         srcAttrFile = open(SRC_DIR + ATTR_DESC_FILE)
         attrLines = srcAttrFile.readlines()
@@ -55,65 +168,31 @@ def calc_result(tracker, seqs, results, evalType, SRC_DIR):
 
     attrList = getScoreList(SRC_DIR)
     allAttr = Score('ALL', 'All attributes', tracker, evalType)
-    allSuccessRateList = []
     attrList.append(allAttr)
+    # the curves and scores of every sequence are computed once, an attribute averages those of its sequences
+    successRates, precisionRates, overlapScores, errorNums = seq_scores(seqs)
     for attr in attrList:
-        successRateList = []
-        precisionRateList = []
         attr.tracker = tracker
         attr.evalType = evalType
-        attr.seqs = []
+        mask = np.array([attr.name in seq.attributes or attr.name.lower() == 'all' for seq in seqs], dtype=bool)
+        attr.seqs = [seq.name for seq, m in zip(seqs, mask) if m]
+        attr.overlapScores = overlapScores[mask].tolist()
+        attr.errorNum = errorNums[mask].tolist()
         attr.successRateList = []
-        attr.overlapScores = []
-        attr.errorNum = []
         attr.precisionRateList = []
-        for seq in seqs:
-            if attr.name in seq.attributes or attr.name.lower() == 'all':
-                attr.seqs.append(seq.name)
-                seqSuccessList = []
-                length = len(seq.errCoverage)
-                for threshold in thresholdSetOverlap:
-                    seqSuccess = [score for score in seq.errCoverage \
-                        if score > threshold]
-                    seqSuccessList.append(len(seqSuccess)/float(length))
-                successRateList.append(seqSuccessList)
-
-                length = len(seq.errCenter)
-                seqPrecisionRateList = []
-                for threshold in thresholdSetError:
-                    seqPrecisions = [score for score in seq.errCenter if score < threshold]
-                    seqPrecisionRateList.append(len(seqPrecisions)/float(length))
-                precisionRateList.append(seqPrecisionRateList)
-
-                overlapList = [score for score in seq.errCoverage 
-                    if score > 0]
-                overlapScore = sum(overlapList) / len(overlapList)
-                attr.overlapScores.append(overlapScore)	
-
-                THRESHOLD = 0.5
-                errorNum = len([score for score in seq.errCoverage \
-                    if score < THRESHOLD]) / float(length) * 10
-                attr.errorNum.append(errorNum)
-            # end if
-        # end for seqs
+
         if len(attr.overlapScores) > 0 :
             attr.overlap = sum(attr.overlapScores) / len(attr.overlapScores) * 100
 
         if len(attr.errorNum) > 0 :
             attr.error = sum(attr.errorNum) / len(attr.errorNum)
 
-        if len(precisionRateList) > 0:
-            for i in range(len(thresholdSetError)):
-                attr.precisionRateList.append(
-                    sum([rates[i] for rates in precisionRateList]) / float(len(precisionRateList)))
-
-        if len(successRateList) > 0:
-            for i in range(len(thresholdSetOverlap)):
-                attr.successRateList.append(
-                    sum([rates[i] for rates in successRateList]) / float(len(successRateList)))
+        if mask.any():
+            attr.precisionRateList = (_sequential_sum(precisionRates[mask]) / float(mask.sum())).tolist()
+            attr.successRateList = (_sequential_sum(successRates[mask]) / float(mask.sum())).tolist()
 
         attr.refresh_dict()
     # end for scores
 
     attrList.sort()
-    return seqResultList, attrList
+    return attrList
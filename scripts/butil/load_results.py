@@ -1,7 +1,15 @@
 from config import *
 from scripts import *
+from result_cache import CACHE_DIR
+from eval_cache import EVAL_CACHE_DIR
 import json, sys
 
+
+def list_trackers(resultSRC):
+    # the result and the eval caches live next to the tracker directories
+    return [name for name in os.listdir(resultSRC)
+            if name not in (CACHE_DIR, EVAL_CACHE_DIR) and os.path.isdir(os.path.join(resultSRC, name))]
+
 def save_seq_result(result):
     tracker = result[0].tracker
     seqName = result[0].seqName
@@ -61,7 +69,7 @@ def save_scores_new_tracker(scoreList, tracker_name='HDT_cvpr2016'):
 
 def load_all_results(evalType):
     resultSRC = RESULT_SRC.format(evalType)
-    trackers = os.listdir(resultSRC)
+    trackers = list_trackers(resultSRC)
     resultList = dict()
     for tracker in trackers:
         results, attrs = load_result(evalType, tracker)
@@ -115,7 +123,7 @@ def load_seq_result(evalType, tracker, sequence):
 
 def load_all_scores(evalType, testname):
     resultSRC = RESULT_SRC.format(evalType)
-    trackers = os.listdir(resultSRC)
+    trackers = list_trackers(resultSRC)
     attrList = [(t, load_scores(evalType, t, testname)) for t in trackers]
     return attrList
 
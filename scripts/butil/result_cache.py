@@ -0,0 +1,131 @@
+"""
+Benchmark results keyed by the full configuration of the tracker.
+
+RESULT_SRC/<evalType>/<tracker name>/<seq>.json only knows the tracker by its name, which leaves out most of
+the KMCTracker parameters (padding, lambda_value, the adaptation rates, model_path...) and the trained model
+itself. Every saved sequence result is also kept under the fingerprint of the configuration that produced it,
+the sha1 of tracker.params and of the content of the model file:
+    RESULT_SRC/<evalType>/cache/<fingerprint>/<seq>.json   the results, as written by save_seq_result
+    RESULT_SRC/<evalType>/cache_index.json                 fingerprint -> tracker name, configuration and
+                                                           sequences done
+so that the runners skip exactly the (configuration, sequence, evalType) jobs already done. The index is
+rewritten under an fcntl.flock of RESULT_SRC/<evalType>/cache_index.json.lock, the workers of a pool or of
+several nodes can add their results at the same time.
+"""
+import os
+import json
+import fcntl
+import hashlib
+from config import RESULT_SRC
+from scripts.model.result import Result
+
+CACHE_DIR = 'cache'
+CACHE_INDEX_FILE = 'cache_index.json'
+
+# (path, size, mtime) -> sha1 of the content, a model file is only read once per process
+_file_digests = {}
+
+
+def file_digest(path, block_size=2 ** 20):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        _file_digests[key] = h.hexdigest()
+    return _file_digests[key]
+
+
+def tracker_config(tracker):
+    """
+    :return: the constructor arguments of tracker and the digest of its model file, None for a tracker
+        without params (only loading results by name)
+    """
+    params = getattr(tracker, 'params', None)
+    if params is None:
+        return None
+    model_path = params.get('model_path')
+    model_digest = file_digest(model_path) if model_path and os.path.isfile(model_path) else None
+    return {'params': params, 'model_digest': model_digest}
+
+
+def config_fingerprint(tracker):
+    config = tracker_config(tracker)
+    if config is None:
+        return None
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_cache_index(evalType):
+    index_file = os.path.join(RESULT_SRC.format(evalType), CACHE_INDEX_FILE)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def cached_result_file(evalType, fingerprint, seqName):
+    return os.path.join(RESULT_SRC.format(evalType), CACHE_DIR, fingerprint, seqName + '.json')
+
+
+def load_cached_result(evalType, tracker, seqName, index=None):
+    """
+    :return: the results of the sequence for the configuration of tracker, None if they are not in the cache
+    """
+    fingerprint = config_fingerprint(tracker)
+    if fingerprint is None:
+        return None
+    if index is None:
+        index = load_cache_index(evalType)
+    result_file = cached_result_file(evalType, fingerprint, seqName)
+    if seqName not in index.get(fingerprint, {}).get('sequences', []) or not os.path.exists(result_file):
+        return None
+    print('Loading {0}/{1} from the result cache ({2})...'.format(tracker.name, seqName, fingerprint[:12]))
+    with open(result_file) as f:
+        jsonList = json.load(f)
+    if type(jsonList) is dict:
+        jsonList = [jsonList]
+    return [Result(**j) for j in jsonList]
+
+
+def _write_json(filename, obj):
+    # written under a temporary name first, readers never see a partial file
+    with open(filename + '.tmp', 'w') as f:
+        f.write(json.dumps(obj, default=lambda o: o.__dict__))
+    os.rename(filename + '.tmp', filename)
+
+
+def cache_result(tracker, result):
+    """
+    keep the results of a sequence (the list of Result of its sub-sequences) under the configuration of tracker
+    """
+    config = tracker_config(tracker)
+    if config is None:
+        return
+    fingerprint = config_fingerprint(tracker)
+    evalType = result[0].evalType
+    seqName = result[0].seqName
+    result_file = cached_result_file(evalType, fingerprint, seqName)
+    if not os.path.exists(os.path.dirname(result_file)):
+        try:
+            os.makedirs(os.path.dirname(result_file))
+        except OSError:
+            # made by another writer in the meantime
+            if not os.path.isdir(os.path.dirname(result_file)):
+                raise
+    _write_json(result_file, result)
+
+    index_file = os.path.join(RESULT_SRC.format(evalType), CACHE_INDEX_FILE)
+    with open(index_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # read again under the lock, with the sequences the other writers added
+            index = load_cache_index(evalType)
+            entry = index.setdefault(fingerprint, dict(config, tracker=tracker.name, sequences=[]))
+            if seqName not in entry['sequences']:
+                entry['sequences'] = sorted(entry['sequences'] + [seqName])
+            _write_json(index_file, index)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
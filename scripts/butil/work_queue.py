@@ -0,0 +1,191 @@
+"""
+Work queue in a directory shared by several nodes (NFS), without any broker or service.
+
+    <queue>/jobs/<id>.json     the job description, added once whichever node adds it first
+    <queue>/locks/<id>         the claim of a job (or of a named lock), holds the id of the worker
+    <queue>/done/<id>          the job is done
+    <queue>/workers/<worker>   the heartbeat of a worker, touched every HEARTBEAT_INTERVAL seconds
+
+Files are created exclusively by linking a private temporary file to the target name, the way lock files are
+taken on NFS (O_EXCL is not reliable there): the link of one worker only succeeds, and the link count of its
+temporary file tells it even when the reply of the server is lost. A claim whose worker has not beaten for
+HEARTBEAT_TIMEOUT seconds is removed by requeue_dead and the job claimed again. The ages are measured against
+the modification time of the own heartbeat file, the clock of the file server, not against the clocks of
+the nodes.
+"""
+import os
+import json
+import time
+import socket
+import threading
+
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 300
+POLL_INTERVAL = 10
+
+
+class WorkQueue(object):
+    def __init__(self, queue_dir, worker=None):
+        self.queue_dir = queue_dir
+        self.worker = worker or '{0}_{1}'.format(socket.gethostname(), os.getpid())
+        for name in ('jobs', 'locks', 'done', 'workers'):
+            path = os.path.join(queue_dir, name)
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # made by another worker in the meantime
+                    if not os.path.isdir(path):
+                        raise
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _path(self, kind, name):
+        return os.path.join(self.queue_dir, kind, name)
+
+    def _create_exclusive(self, path, content):
+        """
+        :return: True if path was created (with content) by this call, False if it already existed
+        """
+        tmp = '{0}.{1}.tmp'.format(path, self.worker)
+        with open(tmp, 'w') as f:
+            f.write(content)
+        try:
+            os.link(tmp, path)
+        except OSError:
+            pass
+        created = os.stat(tmp).st_nlink == 2
+        os.remove(tmp)
+        return created
+
+    def beat(self):
+        heartbeat = self._path('workers', self.worker)
+        with open(heartbeat, 'a'):
+            pass
+        # no times: the NFS client asks the server to set its own time
+        os.utime(heartbeat, None)
+
+    def start(self):
+        """
+        beat in a background thread until stop()
+        """
+        self.beat()
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat_loop)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def _beat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            self.beat()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        try:
+            os.remove(self._path('workers', self.worker))
+        except OSError:
+            pass
+
+    def add(self, job_id, job):
+        """
+        :return: True if the job is new
+        """
+        return self._create_exclusive(self._path('jobs', job_id + '.json'), json.dumps(job))
+
+    def pending(self):
+        """
+        :return: (id, job) of the jobs not done, claimed or not
+        """
+        jobs = []
+        for filename in sorted(os.listdir(os.path.join(self.queue_dir, 'jobs'))):
+            if not filename.endswith('.json'):
+                continue
+            job_id = filename[:-len('.json')]
+            if self.is_done(job_id):
+                continue
+            with open(self._path('jobs', filename)) as f:
+                jobs.append((job_id, json.load(f)))
+        return jobs
+
+    def is_done(self, job_id):
+        return os.path.exists(self._path('done', job_id))
+
+    def claim(self, name):
+        """
+        :param name: the id of a job or of a lock
+        :return: True if the claim was taken by this worker
+        """
+        return self._create_exclusive(self._path('locks', name), self.worker)
+
+    def release(self, name):
+        try:
+            os.remove(self._path('locks', name))
+        except OSError:
+            pass
+
+    def complete(self, job_id):
+        self._create_exclusive(self._path('done', job_id), self.worker)
+        self.release(job_id)
+
+    def lock(self, name):
+        """
+        wait for the lock name, the lock of a dead worker is taken over
+        """
+        while not self.claim(name):
+            self.requeue_dead()
+            time.sleep(POLL_INTERVAL)
+
+    def _server_time(self):
+        self.beat()
+        return os.stat(self._path('workers', self.worker)).st_mtime
+
+    def _owner(self, lock):
+        try:
+            with open(lock) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _alive(self, owner, lock, now):
+        heartbeat = self._path('workers', owner)
+        # a worker always beats before its first claim, without heartbeat the claim is as old as the lock
+        last = os.stat(heartbeat).st_mtime if os.path.exists(heartbeat) else os.stat(lock).st_mtime
+        return last > now - HEARTBEAT_TIMEOUT
+
+    def requeue_dead(self):
+        """
+        remove the claims of the workers that stopped beating
+        :return: the names of the claims removed
+        """
+        now = self._server_time()
+        requeued = []
+        for name in os.listdir(os.path.join(self.queue_dir, 'locks')):
+            if name.endswith('.tmp') or '.stale.' in name:
+                continue
+            lock = self._path('locks', name)
+            owner = self._owner(lock)
+            try:
+                if owner is None or owner == self.worker or self._alive(owner, lock, now):
+                    continue
+            except OSError:
+                # released in the meantime
+                continue
+            # the rename only succeeds for one of the workers removing the claim
+            stale = '{0}.stale.{1}'.format(lock, self.worker)
+            try:
+                os.rename(lock, stale)
+            except OSError:
+                continue
+            if self._owner(stale) != owner:
+                # claimed again between the check and the rename, give the claim back
+                try:
+                    os.link(stale, lock)
+                except OSError:
+                    pass
+            else:
+                print('requeued {0} of the dead worker {1}'.format(name, owner))
+                requeued.append(name)
+            os.remove(stale)
+        return requeued
@@ -9,9 +9,10 @@ class Result:
     # res : results 
     # resType : result type
     # fps
+    # screening : for the runs given up early (step_3 -z), the settings and the frames that were not tracked
 
     def __init__(self, tracker, seqName, startFrame=0, endFrame=0,
-        resType='rect', evalType='OPE', res=[], fps=0, shiftType=None, tmplsize=None):
+        resType='rect', evalType='OPE', res=[], fps=0, shiftType=None, tmplsize=None, screening=None):
         self.tracker = tracker
         self.seqName = seqName
         self.startFrame = startFrame
@@ -22,6 +23,7 @@ class Result:
         self.fps = fps
         self.shiftType = shiftType
         self.tmplsize = tmplsize
+        self.screening = screening
         
         self.__dict__ = OrderedDict([
             ('tracker', self.tracker),
@@ -33,6 +35,7 @@ class Result:
             ('shiftType', self.shiftType),
             ('resType', self.resType),
             ('tmplsize', self.tmplsize),
+            ('screening', self.screening),
             ('res', self.res)])
 
     def refresh_dict(self):
@@ -46,6 +49,7 @@ class Result:
             ('shiftType', self.shiftType),
             ('resType', self.resType),
             ('tmplsize', self.tmplsize),
+            ('screening', self.screening),
             ('res', self.res)])
         
         
@@ -8,27 +8,54 @@ import getopt
 import sys
 import os
 import time
+import glob
+from multiprocessing import Pool
 from keras.preprocessing import image
 # some configurations files for OBT experiments, originally, I would never do that this way of importing,
 # it's simple way too ugly
 from config import SETUP_SEQ, RESULT_SRC, OVERWRITE_RESULT
 from scripts import butil
 from KMC import KMCTracker
+from models.DataStore import open_store, create_store, get_store, reserve, truncate, merge_shards, \
+    params_digest, register_params, is_collected, mark_collected, resume_point
+from models.FlatStore import convert
+
+DATA_FILE = "./data/OTB100_sigma_%d.hdf5"
+# parallel collection: one shard per sequence, merged into a virtual dataset afterwards
+SHARD_DIR = "./data/OTB100_sigma_shards/"
+MERGED_FILE = "./data/OTB100_sigma_merged.hdf5"
+# memory mapped copy of the collected data for training (-f)
+FLAT_DIR = "./data/OTB100_sigma_flat/"
+# storage of the response maps: float32, float16, uint8 or int16 (the last two quantised per sample),
+# compressed with a fast lossless filter ("lzf") or None
+STORE_DTYPE = 'float32'
+STORE_COMPRESSION = None
+
+
+def make_trackers():
+    return [KMCTracker(feature_type='multi_cnn')]
 
 
 def main(argv):
-    trackers = [KMCTracker(feature_type='multi_cnn')]
+    trackers = None
     evalTypes = ['OPE']
     loadSeqs = 'TB100'
+    num_workers = 1
+    node, num_nodes = 0, 1
+    merge_only = False
+    flat_only = False
+    usage = 'usage : run_trackers.py -t <trackers> -s <sequences> -e <evaltypes> ' \
+            '-w <workers> -n <node>/<num_nodes> -m (merge shards only) -f (convert to a flat store only)'
     try:
-        opts, args = getopt.getopt(argv, "ht:e:s:", ["tracker=", "evaltype=", "sequence="])
+        opts, args = getopt.getopt(argv, "ht:e:s:w:n:mf", ["tracker=", "evaltype=", "sequence=",
+                                                            "workers=", "node=", "merge", "flat"])
     except getopt.GetoptError:
-        print('usage : run_trackers.py -t <trackers> -s <sequences>-e <evaltypes>')
+        print(usage)
         sys.exit(1)
 
     for opt, arg in opts:
         if opt == '-h':
-            print('usage : run_trackers.py -t <trackers> -s <sequences>' + '-e <evaltypes>')
+            print(usage)
             sys.exit(0)
         elif opt in ("-t", "--tracker"):
             trackers = [x.strip() for x in arg.split(',')]
@@ -41,6 +68,24 @@ def main(argv):
                 loadSeqs = [x.strip() for x in arg.split(',')]
         elif opt in ("-e", "--evaltype"):
             evalTypes = [x.strip() for x in arg.split(',')]
+        elif opt in ("-w", "--workers"):
+            num_workers = int(arg)
+        elif opt in ("-n", "--node"):
+            node, num_nodes = [int(x) for x in arg.split('/')]
+        elif opt in ("-m", "--merge"):
+            merge_only = True
+        elif opt in ("-f", "--flat"):
+            flat_only = True
+
+    if merge_only:
+        print("merged %d samples" % merge_shards(sorted(glob.glob(SHARD_DIR + '*.hdf5')), MERGED_FILE))
+        return 1
+
+    if flat_only:
+        # the merged store of a parallel collection, the family file otherwise
+        filename = MERGED_FILE if os.path.exists(MERGED_FILE) else DATA_FILE
+        print("converted %d samples" % convert(filename, FLAT_DIR))
+        return 1
 
     if SETUP_SEQ:
         print('Setup sequences ...')
@@ -51,7 +96,15 @@ def main(argv):
         seqNames = butil.get_seq_names(loadSeqs)
         seqs = butil.load_seq_configs(seqNames)
         ######################################################################
-        run_trackers(trackers, seqs, evalType)
+        if num_workers > 1 or num_nodes > 1:
+            # every node collects its own part of the sequences, the last one to finish runs with -m
+            run_trackers_parallel(seqs[node::num_nodes], evalType, num_workers)
+            if num_nodes == 1:
+                print("merged %d samples" % merge_shards(sorted(glob.glob(SHARD_DIR + '*.hdf5')), MERGED_FILE))
+        else:
+            if trackers is None:
+                trackers = make_trackers()
+            run_trackers(trackers, seqs, evalType)
     return 1
 
 
@@ -66,46 +119,116 @@ def run_trackers(trackers, seqs, evalType):
     ##################################################
     # chose sequence to run from below
     ##################################################
-    # we also collect data fro training here
-    import h5py
-    f = h5py.File("./data/OTB100_sigma_%d.hdf5", "w", driver="family", memb_size=2**32-1)
-    X_train = f.create_dataset("x_train", (80000, 5, 240, 160), dtype='float32', chunks=True)
-    y_train = f.create_dataset("y_train", (80000, 4), dtype='float32', chunks=True)
-    count = 0
+    # we also collect data fro training here, an existing store is extended: sequences already collected
+    # with the same tracker parameters are skipped, an interrupted sequence is collected again
+    if os.path.exists(DATA_FILE % 0):
+        f = open_store(DATA_FILE, "a")
+        X_train, y_train, manifest = get_store(f)
+        count = resume_point(f)
+    else:
+        f = open_store(DATA_FILE, "w")
+        X_train, y_train = create_store(f, 0, dtype=STORE_DTYPE, compression=STORE_COMPRESSION)
+        manifest = f["manifest"]
+        count = 0
     for idxSeq in range(0, numSeq):
         s = seqs[idxSeq]
         subSeqs, subAnno = butil.get_sub_seqs(s, 20.0, evalType)
 
         for idxTrk in range(len(trackers)):
             t = trackers[idxTrk]
+            digest = register_params(f, t.params)
+            if is_collected(f, s.name, evalType, digest):
+                print("%s already collected" % s.name)
+                continue
 
             if not OVERWRITE_RESULT:
-                trk_src = os.path.join(RESULT_SRC.format(evalType), t.name)
-                result_src = os.path.join(trk_src, s.name + '.json')
-                if os.path.exists(result_src):
-                    seqResults = butil.load_seq_result(evalType, t, s.name)
+                # only results of this exact configuration (parameters and model file), see butil.result_cache
+                seqResults = butil.load_cached_result(evalType, t, s.name)
+                if seqResults is not None:
                     trackerResults[t].append(seqResults)
                     continue
 
+            if getattr(t, 'feature_cache', None) is not None:
+                t.feature_cache.open_sequence(s.name)
             seqLen = len(subSeqs)
             for idx in range(seqLen):
                 subS = subSeqs[idx]
                 subS.name = s.name + '_' + str(idx)
+                reserve([X_train, y_train, manifest], count + subS.endFrame - subS.startFrame)
                 ####################
-                X_train, y_train, count = run_KCF_variant(t, subS, X_train, y_train, count)
+                X_train, y_train, count = run_KCF_variant(t, subS, X_train, y_train, count,
+                                                          manifest, (s.name, idx, digest))
                 ####################
                 print("count %d" % count)
                 ####################
+            mark_collected(f, s.name, evalType, digest, count)
 
-    X_train.resize(count - 1, axis=0)
-    y_train.resize(count - 1, axis=0)
+    truncate([X_train, y_train, manifest], count)
     f.close()
     print("done")
     # count 58940
     return trackerResults
 
 
-def run_KCF_variant(tracker, seq, X_train, y_train, count):
+def run_trackers_parallel(seqs, evalType, num_workers):
+    """
+    collection is independent per sequence: each pool worker builds its own trackers once and writes
+    every sequence it gets into its own shard SHARD_DIR/<seq>_<evalType>.hdf5, merge_shards stitches them together
+    """
+    if not os.path.exists(SHARD_DIR):
+        os.makedirs(SHARD_DIR)
+    # longest sequences first, so that no worker is left with a long one at the end
+    seqs = sorted(seqs, key=lambda s: s.endFrame - s.startFrame, reverse=True)
+    pool = Pool(processes=num_workers, initializer=init_collect_worker)
+    for seqName, count in pool.imap_unordered(collect_shard, [(s, evalType) for s in seqs]):
+        print("%s: %d samples" % (seqName, count))
+    pool.close()
+    pool.join()
+
+
+_worker_trackers = None
+
+
+def init_collect_worker():
+    global _worker_trackers
+    _worker_trackers = make_trackers()
+
+
+def collect_shard(args):
+    s, evalType = args
+    subSeqs, subAnno = butil.get_sub_seqs(s, 20.0, evalType)
+    shard_filename = os.path.join(SHARD_DIR, '{0}_{1}.hdf5'.format(s.name, evalType))
+    if os.path.exists(shard_filename):
+        with open_store(shard_filename) as f:
+            if all(is_collected(f, s.name, evalType, params_digest(t.params)) for t in _worker_trackers):
+                return s.name, f["y_train"].shape[0]
+    # write to a temporary name first, a crashed worker never leaves a half written shard behind
+    f = open_store(shard_filename + '.tmp', "w")
+    X_train, y_train = create_store(f, 0, dtype=STORE_DTYPE, compression=STORE_COMPRESSION)
+    manifest = f["manifest"]
+    count = 0
+    for t in _worker_trackers:
+        digest = register_params(f, t.params)
+        if t.feature_cache is not None:
+            t.feature_cache.open_sequence(s.name)
+        for idx in range(len(subSeqs)):
+            subS = subSeqs[idx]
+            subS.name = s.name + '_' + str(idx)
+            reserve([X_train, y_train, manifest], count + subS.endFrame - subS.startFrame)
+            X_train, y_train, count = run_KCF_variant(t, subS, X_train, y_train, count,
+                                                      manifest, (s.name, idx, digest))
+        mark_collected(f, s.name, evalType, digest, count)
+
+    truncate([X_train, y_train, manifest], count)
+    f.close()
+    os.rename(shard_filename + '.tmp', shard_filename)
+    return s.name, count
+
+
+def run_KCF_variant(tracker, seq, X_train, y_train, count, manifest=None, manifest_key=None):
+    """
+    :param manifest_key: (sequence name, sub sequence index, params digest) recorded in the manifest for every row
+    """
     start_time = time.time()
 
     for frame in range(seq.endFrame - seq.startFrame):
@@ -129,6 +252,9 @@ def run_KCF_variant(tracker, seq, X_train, y_train, count):
                           seq.gtRect[frame+1],
                           X_train, y_train, count
                           )
+        if manifest is not None:
+            manifest[count - 1] = (manifest_key[0].encode('utf-8'), manifest_key[1], seq.startFrame + frame,
+                                   manifest_key[2].encode('utf-8'))
 
     total_time = time.time() - start_time
     tracker.fps = len(range(seq.endFrame - seq.startFrame)) / total_time
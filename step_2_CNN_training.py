@@ -1,18 +1,37 @@
+import os
 import keras
-from models.CNN import cnn_hiararchical_batchnormalisation, l1_smooth_loss, cnn_sigma
-from models.DataLoader import Generator
+from models.CNN import l1_smooth_loss
+from models.PrefetchLoader import PrefetchGenerator
+from models import ModelZoo
+
+# a tier ("accurate", "fast"...) or a hierarchical architecture of models.ModelZoo
+MODEL = 'accurate'
 
 
 def main():
+    # 2 regresses the position change, 4 also the scale change (for KMCTracker(sub_feature_type='cnn_scale'))
+    target_dim = 2
+    architecture = ModelZoo.architecture(MODEL)
+    # the models without the 240x160 level (models.CNN.cnn_sigma_coarse) start at level 1
+    first_level = ModelZoo.first_level(architecture)
 
-    # generator for data loading
-    gen = Generator(batch_size=128,
-                    filename="./data/OTB100_sigma_%d.hdf5",
-                    response_map_shape=[(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)]
-                    )
+    # generator for data loading, use "./data/OTB100_sigma_merged.hdf5" for the parallel collected data
+    # or "./data/OTB100_sigma_flat/" for the memory mapped copy (step_1 -f)
+    # the batches are read and assembled by 4 worker processes
+    gen = PrefetchGenerator(batch_size=128,
+                            filename="./data/OTB100_sigma_%d.hdf5",
+                            response_map_shape=[(240, 160), (120, 80), (60, 40), (30, 20), (15, 10)],
+                            block_size=64,
+                            shuffle_window=2048,
+                            num_workers=4,
+                            # RAM kept for the blocks served again on every epoch, e.g. 200 * 2 ** 30 on a 256 GB box
+                            cache_bytes=0,
+                            target_dim=target_dim,
+                            first_level=first_level
+                            )
 
     # construct the model here (pre-defined model)
-    model = cnn_hiararchical_batchnormalisation()
+    model = ModelZoo.build(architecture, num_outputs=target_dim)
     #model.load_weights('./checkpoints/weights.14-0.0047.hdf5')
 
     print(model.summary())
@@ -20,7 +39,8 @@ def main():
     def schedule(epoch, decay=0.9):
         return base_lr * decay ** (epoch)
 
-    callbacks = [keras.callbacks.ModelCheckpoint('./checkpoints/weights_sigma.{epoch:02d}-{val_loss:.4f}.hdf5',
+    callbacks = [keras.callbacks.ModelCheckpoint('./checkpoints/weights_' + architecture +
+                                                 '.{epoch:02d}-{val_loss:.4f}.hdf5',
                                                  verbose=1,
                                                  save_weights_only=True),
                  keras.callbacks.LearningRateScheduler(schedule)]
@@ -38,7 +58,17 @@ def main():
                           callbacks=callbacks,
                           validation_data=gen.generate(False),
                           validation_steps=gen.val_batches,
+                          max_queue_size=10,
                           workers=1)
+    gen.close()
+
+    # the trained model of the tier for KMCTracker(model_tier=...), without the training config (the custom loss)
+    # so keras.models.load_model reads it as is
+    if not os.path.exists(ModelZoo.MODEL_DIR):
+        os.makedirs(ModelZoo.MODEL_DIR)
+    model_file = os.path.join(ModelZoo.MODEL_DIR, architecture + '.h5')
+    model.save(model_file, include_optimizer=False)
+    print("saved %s" % model_file)
 
 if __name__ == "__main__":
     main()
@@ -6,6 +6,8 @@ import getopt
 import sys
 import os
 import time
+import json
+from multiprocessing import Pool
 import numpy as np
 # some configurations files for OBT experiments, originally, I would never do that this way of importing,
 # it's simple way too ugly
@@ -15,41 +17,60 @@ from scripts.model.result import Result
 from keras.preprocessing import image
 from scripts.visualisation_utils import plot_tracking_rect, show_precision
 OVERWRITE_RESULT = False
+# a tracker configuration already run on a sequence is loaded from the result cache (butil.result_cache)
+USE_RESULT_CACHE = True
+# the runs an interrupted evaluation wrote to RESULT_SRC/tmp are loaded instead of run again, whatever
+# OVERWRITE_RESULT (-f runs them all again)
+RESUME_RUNS = True
 DEBUG = False
 
 
 class Tracker:
-    def __init__(self, name=''):
+    def __init__(self, name='', params=None):
         self.name = name
+        self.params = params
 
-if OVERWRITE_RESULT:
-    from KMC import KMCTracker
+def make_trackers():
+    if OVERWRITE_RESULT:
+        from KMC import KMCTracker
+        return [KMCTracker(feature_type='multi_cnn',
+                           sub_feature_type='dsst',
+                           model_path='./trained_models/CNN_Model_OBT100_multi_cnn_best_cifar_big_valid.h5',
+                           adaptation_rate_range_max=0.0025,
+                           adaptation_rate_scale_range_max=0.005,
+                           padding=2.2,
+                           sub_sub_feature_type='adapted_lr_hdt'
+                           )]
+    return [Tracker(name='KMC_multi_cnn')]
 
 
 def main(argv):
-    if OVERWRITE_RESULT:
-        trackers = [KMCTracker(feature_type='multi_cnn',
-                               sub_feature_type='dsst',
-                               model_path='./trained_models/CNN_Model_OBT100_multi_cnn_best_cifar_big_valid.h5',
-                               adaptation_rate_range_max=0.0025,
-                               adaptation_rate_scale_range_max=0.005,
-                               padding=2.2,
-                               sub_sub_feature_type='adapted_lr_hdt'
-                               )]
-    else:
-        trackers = [Tracker(name='KMC_multi_cnn')]
-
+    global RESUME_RUNS
+    trackers = None
     evalTypes = ['OPE']
     loadSeqs = 'TB100'
+    num_workers = 1
+    lockstep = False
+    screening = None
+    reinit = False
+    queue_dir = None
+    usage = 'usage : run_trackers.py -t <trackers> -s <sequences> -e <evaltypes> -w <workers> ' \
+            '-l (run the sub-sequences of a sequence in lockstep) ' \
+            '-z <frames> (screening: give a sub-sequence up after <frames> frames without overlap) ' \
+            '-r (screening: re-initialise after a failure instead) ' \
+            '-q <directory> (work queue shared by the nodes of a run) ' \
+            '-f (run again the runs left in RESULT_SRC/tmp by an interrupted evaluation)'
     try:
-        opts, args = getopt.getopt(argv, "ht:e:s:", ["tracker=", "evaltype=", "sequence="])
+        opts, args = getopt.getopt(argv, "ht:e:s:w:lz:rq:f", ["tracker=", "evaltype=", "sequence=", "workers=",
+                                                              "lockstep", "screening=", "reinit", "queue=",
+                                                              "fresh"])
     except getopt.GetoptError:
-        print('usage : run_trackers.py -t <trackers> -s <sequences>' + '-e <evaltypes>')
+        print(usage)
         sys.exit(1)
 
     for opt, arg in opts:
         if opt == '-h':
-            print('usage : run_trackers.py -t <trackers> -s <sequences>' + '-e <evaltypes>')
+            print(usage)
             sys.exit(0)
         elif opt in ("-t", "--tracker"):
             trackers = [x.strip() for x in arg.split(',')]
@@ -62,24 +83,55 @@ def main(argv):
                 loadSeqs = [x.strip() for x in arg.split(',')]
         elif opt in ("-e", "--evaltype"):
             evalTypes = [x.strip() for x in arg.split(',')]
+        elif opt in ("-w", "--workers"):
+            num_workers = int(arg)
+        elif opt in ("-l", "--lockstep"):
+            lockstep = True
+        elif opt in ("-z", "--screening"):
+            screening = {'zero_frames': int(arg)}
+        elif opt in ("-r", "--reinit"):
+            reinit = True
+        elif opt in ("-q", "--queue"):
+            queue_dir = arg
+        elif opt in ("-f", "--fresh"):
+            # set before the pool is forked, the workers see it too
+            RESUME_RUNS = False
+    if screening is not None:
+        screening['reinit'] = reinit
+    if queue_dir is not None and num_workers > 1:
+        # a queue worker is one process, several workers of a node are several runs of this script
+        print('-q runs a single worker, start the script {0} times with -q {1} instead of -w {0}'.format(
+            num_workers, queue_dir))
+        sys.exit(1)
+
+    # with a pool, the trackers are only built in the workers (a forked TensorFlow session is not usable)
+    if trackers is None and num_workers == 1:
+        trackers = make_trackers()
 
     if SETUP_SEQ:
         print('Setup sequences ...')
         butil.setup_seqs(loadSeqs)
 
     print('Starting benchmark for {0} trackers, evalTypes : {1}'.format(
-        len(trackers), evalTypes))
+        len(trackers) if trackers else num_workers, evalTypes))
     for evalType in evalTypes:
         seqNames = butil.get_seq_names(loadSeqs)
         seqs = butil.load_seq_configs(seqNames)
         ######################################################################
-        trackerResults = run_trackers(trackers, seqs, evalType)
+        if queue_dir is not None:
+            trackerResults = run_trackers_queue(trackers, seqs, evalType, queue_dir, lockstep, screening)
+        elif num_workers > 1:
+            trackers, trackerResults = run_trackers_parallel(seqs, evalType, num_workers, lockstep, screening)
+        else:
+            trackerResults = run_trackers(trackers, seqs, evalType, lockstep, screening)
         ######################################################################
         for tracker in trackers:
             results = trackerResults[tracker]
             if len(results) > 0:
                 ######################################################################
-                evalResults, attrList = butil.calc_result(tracker, seqs, results, evalType, SEQ_SRC)
+                # the scores of a screening run are saved apart from those of the full runs
+                scored = Tracker(name=screening_name(tracker.name, screening)) if screening else tracker
+                evalResults, attrList = butil.calc_result(scored, seqs, results, evalType, SEQ_SRC)
                 ######################################################################
                 print ("Result of Sequences\t -- '{0}'".format(tracker.name))
                 for i, seq in enumerate(seqs):
@@ -101,7 +153,10 @@ def main(argv):
                     butil.save_scores(attrList)
 
 
-def run_trackers(trackers, seqs, evalType):
+def run_trackers(trackers, seqs, evalType, lockstep=False, screening=None):
+    """
+    :param screening: {'zero_frames': N, 'reinit': bool} for a screening run, see ScreeningMonitor
+    """
     tmpRes_path = RESULT_SRC.format('tmp/{0}/'.format(evalType))
     if not os.path.exists(tmpRes_path):
         os.makedirs(tmpRes_path)
@@ -119,35 +174,38 @@ def run_trackers(trackers, seqs, evalType):
         for idxTrk in range(len(trackers)):
             t = trackers[idxTrk]
 
-            if not OVERWRITE_RESULT:
-
-                trk_src = os.path.join(RESULT_SRC.format(evalType), t.name)
-                result_src = os.path.join(trk_src, s.name + '.json')
-                if os.path.exists(result_src):
-                    seqResults = butil.load_seq_result(evalType, t, s.name)
-                    trackerResults[t].append(seqResults)
-                    continue
+            seqResults = load_done(t, s.name, evalType, screening=screening)
+            if seqResults is not None:
+                trackerResults[t].append(seqResults)
+                continue
             seqResults = []
+            if getattr(t, 'feature_cache', None) is not None:
+                t.feature_cache.open_sequence(s.name)
             seqLen = len(subSeqs)
-            for idx in range(seqLen):
-                print('{0}_{1}, {2}_{3}:{4}/{5} - {6}'.format(
-                    idxTrk + 1, t.name, idxSeq + 1, s.name, idx + 1, seqLen, evalType))
-                subS = subSeqs[idx]
-                subS.name = s.name + '_' + str(idx)
+            if lockstep:
+                print('{0}_{1}, {2}_{3}: {4} sub-sequences in lockstep - {5}'.format(
+                    idxTrk + 1, t.name, idxSeq + 1, s.name, seqLen, evalType))
+                for idx in range(seqLen):
+                    subSeqs[idx].name = s.name + '_' + str(idx)
                 ####################
-                t, res = run_KCF_variant(t, subS)
+                seqRes = run_lockstep(t, subSeqs, screening)
                 ####################
-                r = Result(t.name, s.name, subS.startFrame, subS.endFrame,
-                           res['type'], evalType, res['res'], res['fps'], None)
-                try:
-                    r.tmplsize = res['tmplsize'][0]
-                except:
-                    pass
-                r.refresh_dict()
-                seqResults.append(r)
+            for idx in range(seqLen):
+                subS = subSeqs[idx]
+                if lockstep:
+                    res = seqRes[idx]
+                else:
+                    print('{0}_{1}, {2}_{3}:{4}/{5} - {6}'.format(
+                        idxTrk + 1, t.name, idxSeq + 1, s.name, idx + 1, seqLen, evalType))
+                    subS.name = s.name + '_' + str(idx)
+                    ####################
+                    t, res = run_KCF_variant(t, subS, screening)
+                    ####################
+                seqResults.append(make_result(t, s.name, subS, res, evalType))
             # end for subseqs
             if SAVE_RESULT:
                 butil.save_seq_result(seqResults)
+                butil.cache_result(t, seqResults)
 
             trackerResults[t].append(seqResults)
             # end for tracker
@@ -155,19 +213,398 @@ def run_trackers(trackers, seqs, evalType):
     return trackerResults
 
 
-def run_KCF_variant(tracker, seq):
+def load_done(t, seqName, evalType, cache_index=None, screening=None):
+    """
+    :return: the results of a sequence already run with the configuration of t (from the result cache,
+        screening results only for the same screening settings), for a tracker without params the results
+        saved under its name (screening_name for a screening run) unless they are overwritten, None if the
+        sequence has to be run
+    """
+    if USE_RESULT_CACHE:
+        seqResults = butil.load_cached_result(evalType, t, seqName, cache_index)
+        if seqResults is not None and all(screening_settings(r.screening) == screening for r in seqResults):
+            return seqResults
+    if not OVERWRITE_RESULT and butil.tracker_config(t) is None:
+        name = screening_name(t.name, screening)
+        result_src = os.path.join(RESULT_SRC.format(evalType), name, seqName + '.json')
+        if os.path.exists(result_src):
+            return butil.load_seq_result(evalType, Tracker(name=name), seqName)
+    return None
+
+
+def screening_settings(summary):
+    if summary is None:
+        return None
+    return {'zero_frames': summary['zero_frames'], 'reinit': summary['reinit']}
+
+
+def screening_name(name, screening):
+    """
+    :return: the name of the runs with the screening settings, RESULT_SRC/<evalType>/<name> of a screening run
+        is not that of the full runs
+    """
+    if screening is None:
+        return name
+    return name + '_screening_{0}{1}'.format(screening['zero_frames'], '_reinit' if screening['reinit'] else '')
+
+
+def make_result(t, seqName, subS, res, evalType):
+    name = screening_name(t.name, screening_settings(res.get('screening')))
+    r = Result(name, seqName, subS.startFrame, subS.endFrame,
+               res['type'], evalType, res['res'], res['fps'], None, screening=res.get('screening'))
+    try:
+        r.tmplsize = res['tmplsize'][0]
+    except:
+        pass
+    r.refresh_dict()
+    return r
+
+
+def run_trackers_parallel(seqs, evalType, num_workers, lockstep=False, screening=None):
+    """
+    every (tracker, sequence, sub-sequence) run is independent: the runs are spread over a pool whose workers
+    build their own trackers with make_trackers, the longest runs are started first so that no worker is left
+    with a long one at the end. Each run is written to RESULT_SRC/tmp/<evalType>/<fingerprint>/<seq>_<idx>.json
+    (an interrupted evaluation only runs the missing ones again), the results are put back together per
+    sequence and sub-sequence as run_trackers returns them.
+    :param lockstep: a job runs all the sub-sequences of a (tracker, sequence) with run_lockstep
+    :return: the trackers (by name, as Tracker) and their results
+    """
+    pool = Pool(processes=num_workers, initializer=init_run_worker)
+    trackers = [Tracker(name=name, params=params) for name, params in pool.apply(worker_tracker_configs)]
+    cache_index = butil.load_cache_index(evalType)
+
+    trackerResults = dict((t, list()) for t in trackers)
+    loaded = {}
+    numSubSeqs = {}
+    jobs = []
+    for s in seqs:
+        subSeqs, subAnno = butil.get_sub_seqs(s, 20.0, evalType)
+        numSubSeqs[s.name] = len(subSeqs)
+        for idxTrk, t in enumerate(trackers):
+            seqResults = load_done(t, s.name, evalType, cache_index, screening)
+            if seqResults is not None:
+                loaded[(idxTrk, s.name)] = seqResults
+                continue
+            for idx, subS in enumerate(subSeqs):
+                subS.name = s.name + '_' + str(idx)
+            runs = list(enumerate(subSeqs))
+            for group in ([runs] if lockstep else [[run] for run in runs]):
+                jobs.append((idxTrk, s.name, group, evalType, screening))
+    jobs.sort(key=lambda job: sum(subS.endFrame - subS.startFrame for idx, subS in job[2]), reverse=True)
+
+    done = {}
+    for count, (idxTrk, seqName, results) in enumerate(pool.imap_unordered(run_job, jobs)):
+        print('{0}_{1}, {2}_{3} - {4}: {5}/{6} runs done'.format(
+            idxTrk + 1, trackers[idxTrk].name, seqName, ','.join(str(idx) for idx, _ in results), evalType,
+            count + 1, len(jobs)))
+        for idx, result in results:
+            done[(idxTrk, seqName, idx)] = Result(**result)
+    pool.close()
+    pool.join()
+
+    for s in seqs:
+        for idxTrk, t in enumerate(trackers):
+            if (idxTrk, s.name) in loaded:
+                trackerResults[t].append(loaded[(idxTrk, s.name)])
+                continue
+            seqResults = [done[(idxTrk, s.name, idx)] for idx in range(numSubSeqs[s.name])]
+            if SAVE_RESULT:
+                butil.save_seq_result(seqResults)
+                butil.cache_result(t, seqResults)
+            trackerResults[t].append(seqResults)
+    return trackers, trackerResults
+
+
+def run_trackers_queue(trackers, seqs, evalType, queue_dir, lockstep=False, screening=None):
+    """
+    one worker of a run spread over several nodes through the butil.WorkQueue in queue_dir/<evalType> (a
+    directory all the nodes share, as RESULT_SRC): every node adds the (tracker configuration, sequence,
+    sub-sequence) jobs not done yet (each job is only added once), then claims and runs them, longest first,
+    until they are all done. Several workers can run on a node, a node can join a run at any time. The runs
+    are written to RESULT_SRC/tmp/<evalType>/ as by run_trackers_parallel, the jobs of a dead worker are
+    claimed again once its heartbeat is HEARTBEAT_TIMEOUT seconds old. The results of a sequence are saved to
+    RESULT_SRC (and the result cache) by the first worker to put them together.
+    :return: the results of the trackers, as run_trackers returns them
+    """
+    queue = butil.WorkQueue(os.path.join(queue_dir, evalType))
+    queue.start()
+    try:
+        cache_index = butil.load_cache_index(evalType)
+        byName = dict((job_name(t, screening), t) for t in trackers)
+        subSeqsOf = {}
+        loaded = {}
+        for s in seqs:
+            subSeqs, subAnno = butil.get_sub_seqs(s, 20.0, evalType)
+            for idx, subS in enumerate(subSeqs):
+                subS.name = s.name + '_' + str(idx)
+            subSeqsOf[s.name] = subSeqs
+            for name, t in byName.items():
+                seqResults = load_done(t, s.name, evalType, cache_index, screening)
+                if seqResults is not None:
+                    loaded[(t, s.name)] = seqResults
+                    continue
+                runs = list(range(len(subSeqs)))
+                for group in ([runs] if lockstep else [[idx] for idx in runs]):
+                    job = {'tracker': name, 'seqName': s.name, 'runs': group, 'screening': screening,
+                           'frames': sum(subSeqs[idx].endFrame - subSeqs[idx].startFrame + 1 for idx in group)}
+                    queue.add('{0}_{1}_{2}'.format(name, s.name, '-'.join(str(idx) for idx in group)), job)
+
+        while True:
+            # the jobs of other trackers or sequences of the queue are left to the nodes running them
+            pending = [(job_id, job) for job_id, job in queue.pending()
+                       if job['tracker'] in byName and job['seqName'] in subSeqsOf and
+                       (byName[job['tracker']], job['seqName']) not in loaded]
+            if not pending:
+                break
+            pending.sort(key=lambda item: item[1]['frames'], reverse=True)
+            claimed = False
+            for job_id, job in pending:
+                if not queue.claim(job_id):
+                    continue
+                claimed = True
+                # done by another worker between the listing and the claim
+                if not queue.is_done(job_id):
+                    print('{0}, {1}_{2} - {3}: {4}'.format(queue.worker, job['seqName'], job['runs'], evalType,
+                                                            job['tracker']))
+                    t = byName[job['tracker']]
+                    runs = [(idx, subSeqsOf[job['seqName']][idx]) for idx in job['runs']]
+                    run_tracker_job(t, job['seqName'], runs, evalType, job['screening'])
+                    queue.complete(job_id)
+                else:
+                    queue.release(job_id)
+            if not claimed:
+                # the remaining jobs are claimed by other workers
+                queue.requeue_dead()
+                time.sleep(butil.POLL_INTERVAL)
+
+        trackerResults = dict((t, list()) for t in trackers)
+        for s in seqs:
+            for t in trackers:
+                if (t, s.name) in loaded:
+                    trackerResults[t].append(loaded[(t, s.name)])
+                    continue
+                # all the runs are done, they are only loaded
+                runs = list(enumerate(subSeqsOf[s.name]))
+                seqResults = [Result(**result) for idx, result in
+                              run_tracker_job(t, s.name, runs, evalType, screening, overwrite=False)]
+                if SAVE_RESULT:
+                    # the cache index is rewritten by a single worker at a time
+                    queue.lock('save_results')
+                    try:
+                        if load_done(t, s.name, evalType, screening=screening) is None:
+                            butil.save_seq_result(seqResults)
+                            butil.cache_result(t, seqResults)
+                    finally:
+                        queue.release('save_results')
+                trackerResults[t].append(seqResults)
+    finally:
+        queue.stop()
+    return trackerResults
+
+
+_worker_trackers = None
+
+
+def init_run_worker():
+    global _worker_trackers
+    _worker_trackers = make_trackers()
+
+
+def worker_tracker_configs():
+    return [(t.name, getattr(t, 'params', None)) for t in _worker_trackers]
+
+
+def run_job(args):
+    """
+    :return: the result of every (sub-sequence index, sub-sequence) of the job, as a dict
+    """
+    idxTrk, seqName, runs, evalType, screening = args
+    return idxTrk, seqName, run_tracker_job(_worker_trackers[idxTrk], seqName, runs, evalType, screening)
+
+
+def job_name(t, screening=None):
+    # the runs of different configurations of a tracker (and the screening runs) are kept apart
+    return screening_name(butil.config_fingerprint(t) or t.name, screening)
+
+
+def run_tracker_job(t, seqName, runs, evalType, screening=None, overwrite=None):
+    """
+    run the (sub-sequence index, sub-sequence) runs of a sequence with tracker t, each one is written to
+    RESULT_SRC/tmp/<evalType>/<job_name>/<seq>_<idx>.json, the runs already there are loaded unless overwrite
+    (by default not RESUME_RUNS)
+    :return: the result of every run, as a dict
+    """
+    if overwrite is None:
+        overwrite = not RESUME_RUNS
+    job_src = os.path.join(RESULT_SRC.format('tmp/{0}/'.format(evalType)), job_name(t, screening))
+    job_files = [os.path.join(job_src, '{0}_{1}.json'.format(seqName, idx)) for idx, subS in runs]
+    if not overwrite and all(os.path.exists(job_file) for job_file in job_files):
+        results = []
+        for (idx, subS), job_file in zip(runs, job_files):
+            with open(job_file) as f:
+                results.append((idx, json.load(f)))
+        return results
+    if getattr(t, 'feature_cache', None) is not None:
+        t.feature_cache.open_sequence(seqName)
+    if len(runs) > 1:
+        seqRes = run_lockstep(t, [subS for idx, subS in runs], screening)
+    else:
+        seqRes = [run_KCF_variant(t, runs[0][1], screening)[1]]
+    if not os.path.exists(job_src):
+        os.makedirs(job_src)
+    results = []
+    for (idx, subS), res, job_file in zip(runs, seqRes, job_files):
+        result = json.loads(json.dumps(make_result(t, seqName, subS, res, evalType), default=lambda o: o.__dict__))
+        # written under a temporary name first, an interrupted run never leaves a partial file behind
+        with open(job_file + '.tmp', 'w') as f:
+            json.dump(result, f)
+        os.rename(job_file + '.tmp', job_file)
+        results.append((idx, result))
+    return results
+
+
+def run_lockstep(tracker, subSeqs, screening=None):
+    """
+    run the sub-sequences of one sequence (the SRE shifts, the TRE start frames) side by side: every frame is
+    decoded once and handed to the tracker of each sub-sequence that covers it. Each sub-sequence is tracked by
+    its own tracker.spawn() (same models and feature cache, own state), frames and initialisation are those of
+    run_KCF_variant, the decoding time of a frame is shared out between the trackers it is handed to.
+    :return: the res of run_KCF_variant of every sub-sequence
+    """
+    trackers = [tracker.spawn() for _ in subSeqs]
+    monitors = [ScreeningMonitor(subS, **screening) if screening else None for subS in subSeqs]
+    times = [0.] * len(subSeqs)
+    num_frames = [0] * len(subSeqs)
+    for t in trackers:
+        t.res = []
+    first = min(subS.startFrame for subS in subSeqs)
+    last = max(subS.endFrame for subS in subSeqs)
+    for frameNo in range(first, last + 1):
+        active = []
+        for i, subS in enumerate(subSeqs):
+            if not subS.startFrame <= frameNo <= subS.endFrame:
+                continue
+            if monitors[i] is None or monitors[i].tracking(frameNo - subS.startFrame):
+                active.append(i)
+            elif not monitors[i].stopped:
+                # skipped before a re-initialisation
+                trackers[i].res.append(trackers[i].res[-1])
+        if not active:
+            continue
+        start_time = time.time()
+        subS = subSeqs[active[0]]
+        img_rgb = image.load_img(os.path.join(subS.path, subS.s_frames[frameNo - subS.startFrame]))
+        img_rgb = image.img_to_array(img_rgb)
+        decode_time = (time.time() - start_time) / len(active)
+        for i in active:
+            start_time = time.time()
+            track_frame(trackers[i], subSeqs[i], img_rgb, frameNo - subSeqs[i].startFrame, monitors[i])
+            times[i] += time.time() - start_time + decode_time
+            num_frames[i] += 1
+
+    seqRes = []
+    for t, total_time, num, monitor in zip(trackers, times, num_frames, monitors):
+        t.fps = num / total_time
+        seqRes.append({'type': 'rect', 'res': t.res, 'fps': t.fps})
+        if monitor is not None:
+            seqRes[-1]['screening'] = monitor.summary()
+    print("Frames-per-second:", np.mean([res['fps'] for res in seqRes]))
+    return seqRes
+
+
+class ScreeningMonitor(object):
+    """
+    online overlap of a screening run with the ground truth: once it has been zero for zero_frames frames in a
+    row, the sub-sequence has failed (at the first of them) and the rest of it is given up or, with reinit
+    (VOT protocol), the tracker is initialised again on the ground truth REINIT_SKIP frames later.
+    The frames given up are listed in summary()['skipped'], butil.calc_result counts them as failures.
+    """
+    REINIT_SKIP = 5
+
+    def __init__(self, seq, zero_frames, reinit=False):
+        # frame i of the sub-sequence, aligned as in butil.calc_result
+        self.anno = seq.gtRect[seq.startFrame - getattr(seq, 'annoBegin', seq.startFrame):]
+        self.length = seq.endFrame - seq.startFrame + 1
+        self.zero_frames = zero_frames
+        self.reinit = reinit
+        self.zeros = 0
+        self.failures = []
+        self.skipped = []
+        self.restart_frame = None
+        self.stopped = False
+
+    def valid(self, frame):
+        return frame < len(self.anno) and all(x > 0 for x in self.anno[frame])
+
+    def tracking(self, frame):
+        """
+        :return: False for a frame given up
+        """
+        if self.stopped:
+            return False
+        return not self.skipped or frame >= self.skipped[-1][1]
+
+    def update(self, frame, rect):
+        if not self.valid(frame):
+            return
+        if butil.calc_rect_int([rect], [self.anno[frame]])[0] > 0:
+            self.zeros = 0
+            return
+        self.zeros += 1
+        if self.zeros < self.zero_frames:
+            return
+        self.failures.append(frame - self.zeros + 1)
+        self.zeros = 0
+        restart = frame + self.REINIT_SKIP
+        while self.reinit and restart < self.length and not self.valid(restart):
+            restart += 1
+        if not self.reinit or restart >= self.length:
+            self.stopped = True
+            restart = self.length
+        self.restart_frame = restart
+        self.skipped.append([frame + 1, restart])
+
+    def summary(self):
+        return {'zero_frames': self.zero_frames, 'reinit': self.reinit,
+                'failures': self.failures, 'skipped': self.skipped}
+
+
+def track_frame(tracker, seq, img_rgb, frame, monitor=None):
+    if frame == 0:
+        # the first box of the sub-sequence: the TRE start frame, shifted for SRE (butil.get_sub_seqs)
+        tracker.train(img_rgb, seq.init_rect)
+    elif monitor is not None and frame == monitor.restart_frame:
+        tracker.train(img_rgb, monitor.anno[frame])
+    else:
+        tracker.detect(img_rgb, frame)
+    if monitor is not None:
+        monitor.update(frame, tracker.res[-1])
+
+
+def run_KCF_variant(tracker, seq, screening=None):
+    """
+    :param screening: {'zero_frames': N, 'reinit': bool} to give the sub-sequence up once the tracker has lost
+        the target (ScreeningMonitor)
+    """
     start_time = time.time()
     start_frame = 0
     tracker.res = []
+    monitor = ScreeningMonitor(seq, **screening) if screening else None
+    num_frames = 0
     for frame in range(start_frame, seq.endFrame - seq.startFrame+1):
+        if monitor is not None and not monitor.tracking(frame):
+            if monitor.stopped:
+                break
+            # skipped before a re-initialisation
+            tracker.res.append(tracker.res[-1])
+            continue
         image_filename = seq.s_frames[frame]
         image_path = os.path.join(seq.path, image_filename)
         img_rgb = image.load_img(image_path)
         img_rgb = image.img_to_array(img_rgb)
-        if frame == start_frame:
-            tracker.train(img_rgb, seq.gtRect[start_frame])
-        else:
-            tracker.detect(img_rgb, frame)
+        track_frame(tracker, seq, img_rgb, frame, monitor)
+        num_frames += 1
 
         if DEBUG and frame > start_frame:
             print("Frame ==", frame)
@@ -178,13 +615,15 @@ def run_KCF_variant(tracker, seq):
             plot_tracking_rect(seq.name, frame + seq.startFrame, img_rgb, tracker, seq.gtRect)
 
     total_time = time.time() - start_time
-    tracker.fps = len(tracker.res) / total_time
+    tracker.fps = num_frames / total_time
     print("Frames-per-second:", tracker.fps)
 
     if DEBUG:
         tracker.precisions = show_precision(np.array(tracker.res), np.array(seq.gtRect), seq.name)
 
     res = {'type': 'rect', 'res': tracker.res, 'fps': tracker.fps}
+    if monitor is not None:
+        res['screening'] = monitor.summary()
 
     return tracker, res
 
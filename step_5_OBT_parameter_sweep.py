@@ -0,0 +1,276 @@
+"""
+Hyperparameter sweep of KMCTracker on the OTB benchmark.
+
+The configurations are the BASE_CONFIG updated by every combination of GRID, or NUM_SAMPLES draws of RANDOM
+(or the same read from a JSON spec given with -c, see load_spec). The (configuration, sequence) runs are spread
+over a process pool, a job runs all the sub-sequences of a sequence (in lockstep with -l). A worker keeps at
+most MAX_TRACKERS_PER_WORKER trackers (and their models) and gets the jobs of one configuration in a row, every
+tracker adds its Keras model to the TensorFlow graph of the worker, so the workers are replaced after
+MAX_JOBS_PER_WORKER jobs. With a feature cache (feature_cache_dir) the jobs of the first configuration are run
+before the others: they fill the cache of every sequence once, the other configurations find the features there
+instead of computing them side by side.
+
+The results go to the result cache of butil.result_cache, an interrupted or extended sweep only runs the
+(configuration, sequence) jobs not done yet. The table RESULT_SRC/<evalType>/sweep_<name>.csv (and .json) has
+one row per configuration: the parameters swept, the AUC of the success plot, the precision at 20 pixels
+and the mean fps, sorted by AUC.
+"""
+from __future__ import print_function
+import getopt
+import sys
+import os
+import csv
+import json
+import itertools
+from collections import OrderedDict
+from multiprocessing import Pool
+import numpy as np
+from config import SETUP_SEQ, RESULT_SRC, SEQ_SRC
+from scripts import butil
+from scripts.model.result import Result
+from KMC import tracker_params
+from step_3_OBT_run_trackers import Tracker, run_KCF_variant, run_lockstep, make_result, screening_settings
+
+SWEEP_NAME = 'kmc_kernel'
+BASE_CONFIG = dict(feature_type='multi_cnn',
+                   sub_feature_type='dsst',
+                   sub_sub_feature_type='adapted_lr_hdt',
+                   model_path='./trained_models/CNN_Model_OBT100_multi_cnn_best_cifar_big_valid.h5',
+                   feature_cache_dir='./data/feature_cache/')
+# grid search: every combination of the values
+GRID = OrderedDict([('padding', [1.8, 2.2, 2.6]),
+                    ('lambda_value', [1e-4, 1e-3]),
+                    ('adaptation_rate_range_max', [0.0025, 0.005])])
+# random search: NUM_SAMPLES configurations, every parameter drawn from ('uniform', low, high),
+# ('loguniform', low, high) or ('choice', [values])
+RANDOM = OrderedDict([('padding', ('uniform', 1.5, 3.0)),
+                      ('lambda_value', ('loguniform', 1e-5, 1e-2)),
+                      ('feature_bandwidth_sigma', ('uniform', 0.1, 0.4)),
+                      ('adaptation_rate_range_max', ('loguniform', 1e-3, 1e-2)),
+                      ('adaptation_rate_scale_range_max', ('loguniform', 1e-3, 1e-2)),
+                      ('acc_time', ('choice', [3, 5, 7]))])
+NUM_SAMPLES = 20
+SEED = 0
+MAX_TRACKERS_PER_WORKER = 2
+MAX_JOBS_PER_WORKER = 200
+# success plot thresholds (config.thresholdSetOverlap) and precision at 20 pixels (config.thresholdSetError)
+PRECISION_THRESHOLD = 20
+
+
+def main(argv):
+    spec = {'name': SWEEP_NAME, 'base': BASE_CONFIG, 'grid': GRID}
+    evalType = 'OPE'
+    loadSeqs = 'TB100'
+    num_workers = 4
+    lockstep = False
+    screening = None
+    usage = 'usage : step_5_OBT_parameter_sweep.py -c <spec.json> -r (random search) -s <sequences> ' \
+            '-e <evaltype> -w <workers> -l (lockstep) -z <frames> (screening, see step_3)'
+    try:
+        opts, args = getopt.getopt(argv, "hc:rs:e:w:lz:", ["config=", "random", "sequence=", "evaltype=",
+                                                           "workers=", "lockstep", "screening="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-c", "--config"):
+            spec = load_spec(arg)
+        elif opt in ("-r", "--random"):
+            spec = {'name': SWEEP_NAME + '_random', 'base': BASE_CONFIG, 'random': RANDOM,
+                    'num_samples': NUM_SAMPLES, 'seed': SEED}
+        elif opt in ("-s", "--sequence"):
+            loadSeqs = arg
+            if loadSeqs != 'All' and loadSeqs != 'all' and \
+                            loadSeqs != 'tb50' and loadSeqs != 'tb100' and \
+                            loadSeqs != 'cvpr13':
+                loadSeqs = [x.strip() for x in arg.split(',')]
+        elif opt in ("-e", "--evaltype"):
+            evalType = arg
+        elif opt in ("-w", "--workers"):
+            num_workers = int(arg)
+        elif opt in ("-l", "--lockstep"):
+            lockstep = True
+        elif opt in ("-z", "--screening"):
+            screening = {'zero_frames': int(arg), 'reinit': False}
+
+    if SETUP_SEQ:
+        print('Setup sequences ...')
+        butil.setup_seqs(loadSeqs)
+
+    configs = make_configs(spec)
+    seqs = butil.load_seq_configs(butil.get_seq_names(loadSeqs))
+    print('Sweep {0}: {1} configurations x {2} sequences, evalType : {3}'.format(
+        spec['name'], len(configs), len(seqs), evalType))
+    results = run_sweep(configs, seqs, evalType, num_workers, lockstep, screening)
+    table = score_table(spec, configs, seqs, results, evalType)
+    save_table(table, os.path.join(RESULT_SRC.format(evalType), 'sweep_{0}'.format(spec['name'])))
+
+
+def load_spec(filename):
+    """
+    {"name": ..., "base": {KMCTracker arguments}, "grid": {parameter: [values]}}
+    or {"name": ..., "base": {...}, "random": {parameter: ["uniform" | "loguniform", low, high] or
+    ["choice", [values]]}, "num_samples": N, "seed": S}
+    """
+    with open(filename) as f:
+        spec = json.load(f, object_pairs_hook=OrderedDict)
+    spec.setdefault('name', os.path.splitext(os.path.basename(filename))[0])
+    spec.setdefault('base', BASE_CONFIG)
+    return spec
+
+
+def make_configs(spec):
+    """
+    :return: the KMCTracker arguments of every configuration of the sweep
+    """
+    configs = []
+    if 'grid' in spec:
+        names = list(spec['grid'])
+        for values in itertools.product(*[spec['grid'][name] for name in names]):
+            configs.append(dict(spec['base'], **dict(zip(names, values))))
+    else:
+        rng = np.random.RandomState(spec.get('seed', SEED))
+        for _ in range(spec.get('num_samples', NUM_SAMPLES)):
+            config = dict(spec['base'])
+            for name, distribution in spec['random'].items():
+                config[name] = draw(rng, distribution)
+            configs.append(config)
+    return configs
+
+
+def draw(rng, distribution):
+    kind = distribution[0]
+    if kind == 'uniform':
+        return float(rng.uniform(distribution[1], distribution[2]))
+    if kind == 'loguniform':
+        return float(np.exp(rng.uniform(np.log(distribution[1]), np.log(distribution[2]))))
+    if kind == 'choice':
+        value = distribution[1][rng.randint(len(distribution[1]))]
+        return value.item() if isinstance(value, np.generic) else value
+    raise ValueError("unknown distribution {0}".format(kind))
+
+
+def sweep_trackers(configs):
+    """
+    :return: a Tracker (name and params, no model) per configuration, their results are cached by params
+    """
+    return [Tracker(name='sweep_{0:03d}'.format(i), params=tracker_params(**config))
+            for i, config in enumerate(configs)]
+
+
+def run_sweep(configs, seqs, evalType, num_workers, lockstep=False, screening=None):
+    """
+    :return: for every configuration, the list of results of every sequence (as run_trackers returns them)
+    """
+    trackers = sweep_trackers(configs)
+    cache_index = butil.load_cache_index(evalType)
+    results = dict((i, {}) for i in range(len(configs)))
+    jobs = []
+    # the jobs of a configuration follow each other, the workers rarely have to build a tracker again
+    for i, t in enumerate(trackers):
+        for s in seqs:
+            seqResults = butil.load_cached_result(evalType, t, s.name, cache_index)
+            if seqResults is not None and all(screening_settings(r.screening) == screening for r in seqResults):
+                results[i][s.name] = seqResults
+                continue
+            subSeqs, subAnno = butil.get_sub_seqs(s, 20.0, evalType)
+            for idx, subS in enumerate(subSeqs):
+                subS.name = s.name + '_' + str(idx)
+            jobs.append((i, configs[i], s.name, subSeqs, evalType, lockstep, screening))
+    print('{0} jobs to run, {1} in the result cache'.format(
+        len(jobs), len(configs) * len(seqs) - len(jobs)))
+
+    if jobs:
+        # the first configuration to run fills the feature cache of every sequence before the others start
+        first = jobs[0][0]
+        phases = [[job for job in jobs if job[0] == first], [job for job in jobs if job[0] != first]] \
+            if any(config.get('feature_cache_dir') for config in configs) else [jobs]
+        pool = Pool(processes=num_workers, maxtasksperchild=MAX_JOBS_PER_WORKER)
+        count = 0
+        for phase in phases:
+            for i, seqName, seqRes in pool.imap_unordered(run_sweep_job, phase, chunksize=1):
+                seqResults = [Result(**r) for r in seqRes]
+                # only the parent writes the cache index
+                butil.cache_result(trackers[i], seqResults)
+                results[i][seqName] = seqResults
+                count += 1
+                print('{0}/{1}: configuration {2}, {3}'.format(count, len(jobs), i, seqName))
+        pool.close()
+        pool.join()
+    return dict((i, [results[i][s.name] for s in seqs]) for i in results)
+
+
+_worker_trackers = OrderedDict()
+
+
+def worker_tracker(config):
+    """
+    :return: the tracker of a configuration, the least recently used one is dropped beyond
+        MAX_TRACKERS_PER_WORKER
+    """
+    from KMC import KMCTracker
+    key = json.dumps(config, sort_keys=True)
+    if key in _worker_trackers:
+        _worker_trackers[key] = _worker_trackers.pop(key)
+        return _worker_trackers[key]
+    while len(_worker_trackers) >= MAX_TRACKERS_PER_WORKER:
+        _worker_trackers.popitem(last=False)
+    _worker_trackers[key] = KMCTracker(**config)
+    return _worker_trackers[key]
+
+
+def run_sweep_job(args):
+    i, config, seqName, subSeqs, evalType, lockstep, screening = args
+    t = worker_tracker(config)
+    if t.feature_cache is not None:
+        t.feature_cache.open_sequence(seqName)
+    if lockstep and len(subSeqs) > 1:
+        seqRes = run_lockstep(t, subSeqs, screening)
+    else:
+        seqRes = [run_KCF_variant(t, subS, screening)[1] for subS in subSeqs]
+    return i, seqName, [json.loads(json.dumps(make_result(t, seqName, subS, res, evalType),
+                                              default=lambda o: o.__dict__))
+                        for subS, res in zip(subSeqs, seqRes)]
+
+
+def score_table(spec, configs, seqs, results, evalType):
+    """
+    :return: one row per configuration, by decreasing AUC
+    """
+    swept = list(spec['grid'] if 'grid' in spec else spec['random'])
+    table = []
+    for i, config in enumerate(configs):
+        t = Tracker(name='sweep_{0:03d}'.format(i))
+        evalResults, attrList = butil.calc_result(t, seqs, results[i], evalType, SEQ_SRC)
+        allAttr = next(attr for attr in attrList if attr.name == 'ALL')
+        fps = [r.fps for seqResults in results[i] for r in seqResults]
+        row = OrderedDict([('config', i)])
+        row.update((name, config[name]) for name in swept)
+        row['auc'] = float(np.mean(allAttr.successRateList))
+        row['precision'] = allAttr.precisionRateList[PRECISION_THRESHOLD]
+        row['fps'] = float(np.mean(fps))
+        table.append(row)
+    table.sort(key=lambda row: row['auc'], reverse=True)
+    return table
+
+
+def save_table(table, filename):
+    with open(filename + '.json', 'w') as f:
+        json.dump(table, f, indent=1)
+    with open(filename + '.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(table[0]))
+        for row in table:
+            writer.writerow(list(row.values()))
+    print('\t'.join(table[0]))
+    for row in table:
+        print('\t'.join('{0:.4g}'.format(v) if isinstance(v, float) else str(v) for v in row.values()))
+    print('written to {0}.csv'.format(filename))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
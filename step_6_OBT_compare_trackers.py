@@ -0,0 +1,84 @@
+"""
+Comparison of the trackers of a benchmark in one pass (butil.compare_trackers).
+
+The results saved under RESULT_SRC/<evalType>/<tracker>/ are evaluated once (butil.eval_cache), the trackers
+with saved scores only (RESULT_SRC/<evalType>/<tracker>/scores..., KCF, DSST, MEEM, MUSTer, HDT as in
+butil.load_scores) are compared with those. The table RESULT_SRC/<evalType>/comparison_<testname>.csv (and
+.json, with the curves) has one row per attribute and tracker: rank, AUC of the success plot, precision at
+20 pixels, mean overlap, failures and number of sequences.
+
+usage:
+    python step_6_OBT_compare_trackers.py -t <trackers> -s <sequences> -e <evaltypes> -n <testname>
+"""
+from __future__ import print_function
+import getopt
+import sys
+import os
+from config import SETUP_SEQ, RESULT_SRC, SEQ_SRC
+from scripts import butil
+
+
+class Tracker:
+    def __init__(self, name=''):
+        self.name = name
+
+
+def main(argv):
+    trackerNames = None
+    evalTypes = ['OPE']
+    loadSeqs = 'TB100'
+    testname = 'tb100'
+    usage = 'usage : step_6_OBT_compare_trackers.py -t <trackers> -s <sequences> -e <evaltypes> -n <testname>'
+    try:
+        opts, args = getopt.getopt(argv, "ht:e:s:n:", ["tracker=", "evaltype=", "sequence=", "testname="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-t", "--tracker"):
+            trackerNames = [x.strip() for x in arg.split(',')]
+        elif opt in ("-s", "--sequence"):
+            loadSeqs = arg
+            if loadSeqs != 'All' and loadSeqs != 'all' and \
+                            loadSeqs != 'tb50' and loadSeqs != 'tb100' and \
+                            loadSeqs != 'cvpr13':
+                loadSeqs = [x.strip() for x in arg.split(',')]
+        elif opt in ("-e", "--evaltype"):
+            evalTypes = [x.strip() for x in arg.split(',')]
+        elif opt in ("-n", "--testname"):
+            testname = arg
+
+    if SETUP_SEQ:
+        print('Setup sequences ...')
+        butil.setup_seqs(loadSeqs)
+
+    seqs = butil.load_seq_configs(butil.get_seq_names(loadSeqs))
+    for evalType in evalTypes:
+        resultSRC = RESULT_SRC.format(evalType)
+        names = trackerNames or sorted(butil.list_trackers(resultSRC))
+        comparison = compare(names, seqs, evalType, testname)
+        table = butil.save_comparison(comparison, os.path.join(resultSRC, 'comparison_{0}'.format(testname)))
+
+        print("Ranking of {0} trackers on {1} sequences - {2}".format(len(names), len(seqs), evalType))
+        for row in table:
+            if row['attribute'] == 'ALL':
+                print("\t{0:2d} {1:<30s} AUC : {2:.3f}\tprecision : {3:.3f}\t({4})".format(
+                    row['rank'], row['tracker'], row['auc'], row['precision'], row['source']))
+
+
+def compare(names, seqs, evalType, testname):
+    comparison = butil.compare_trackers([Tracker(name) for name in names], seqs, evalType, SEQ_SRC)
+    for name, source in zip(names, list(comparison['source'])):
+        if source is None:
+            scores = butil.load_scores(evalType, name, testname, RESULT_SRC)
+            if scores:
+                butil.use_saved_scores(comparison, name, scores)
+    return comparison
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
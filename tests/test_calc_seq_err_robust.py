@@ -0,0 +1,139 @@
+"""
+calc_seq_err_robust and calc_rect_int against the per frame loops they replaced, on synthetic rect results.
+
+run from the root of the repository: python -m unittest discover tests
+"""
+import random
+import unittest
+import numpy as np
+from scripts import butil
+
+
+def loop_calc_rect_int(A, B):
+    leftA = [a[0] for a in A]
+    bottomA = [a[1] for a in A]
+    rightA = [leftA[i] + A[i][2] - 1 for i in range(len(A))]
+    topA = [bottomA[i] + A[i][3] - 1 for i in range(len(A))]
+
+    leftB = [b[0] for b in B]
+    bottomB = [b[1] for b in B]
+    rightB = [leftB[i] + B[i][2] - 1 for i in range(len(B))]
+    topB = [bottomB[i] + B[i][3] - 1 for i in range(len(B))]
+
+    overlap = []
+    length = min(len(leftA), len(leftB))
+    for i in range(length):
+        tmp = (max(0, min(rightA[i], rightB[i]) - max(leftA[i], leftB[i])+1)
+            * max(0, min(topA[i], topB[i]) - max(bottomA[i], bottomB[i])+1))
+        areaA = A[i][2] * A[i][3]
+        areaB = B[i][2] * B[i][3]
+        overlap.append(tmp/float(areaA+areaB-tmp))
+
+    return overlap
+
+
+def loop_calc_seq_err_robust(results, rect_anno):
+    # the 'rect' results only
+    seq_length = len(results.res)
+    centerGT = [[r[0]+(r[2]-1)/2.0, r[1]+(r[3]-1)/2.0] for r in rect_anno]
+    rectMat = [np.clip(x, 1, 10e5) for x in results.res]
+
+    rectMat[0] = rect_anno[0]
+    center = [[r[0]+(r[2]-1)/2.0, r[1]+(r[3]-1)/2.0] for r in rectMat]
+    if len(centerGT) < seq_length:
+        seq_length = len(centerGT)
+    errCenter = [round(butil.ssd(center[i], centerGT[i]),4)
+        for i in range(seq_length)]
+
+    idx = [sum([x>0 for x in r])==4 for r in rect_anno]
+    tmp = loop_calc_rect_int(rectMat, rect_anno)
+    errCoverage = [-1] * seq_length
+    totalerrCoverage = 0
+    totalerrCenter = 0
+
+    for i in range(seq_length):
+        if idx[i]:
+            errCoverage[i] = tmp[i]
+            totalerrCoverage += errCoverage[i]
+            totalerrCenter += errCenter[i]
+        else:
+            errCenter[i] = -1
+
+    aveErrCoverage = totalerrCoverage / float(sum(idx))
+    aveErrCenter = totalerrCenter / float(sum(idx))
+
+    return aveErrCoverage, aveErrCenter, errCoverage, errCenter
+
+
+class RectResult(object):
+    def __init__(self, res):
+        self.res = res
+        self.resType = 'rect'
+
+
+def outcome(f, *args):
+    """
+    :return: the repr of the value of f (nan == nan) or the name of the exception it raised
+    """
+    try:
+        return repr(f(*args))
+    except Exception as e:
+        return type(e).__name__
+
+
+class CalcSeqErrRobustTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def rect(self, integer):
+        r = self.random
+        if integer:
+            return [r.randint(-5, 300), r.randint(-5, 300), r.randint(0, 80), r.randint(0, 80)]
+        return [r.uniform(-5, 300), r.uniform(-5, 300), r.uniform(0, 80), r.uniform(0.5, 80)]
+
+    def sequence(self):
+        """
+        :return: results and annotations, with zero-area and nan annotations and nan results
+        """
+        r = self.random
+        n = r.randint(2, 40)
+        integer = r.random() < 0.5
+        anno = [self.rect(integer) for _ in range(max(n + r.choice([0, 0, -3, 4]), 2))]
+        res = [self.rect(r.random() < 0.5) for _ in range(n)]
+        for i in range(min(len(res), len(anno))):
+            if r.random() < 0.6:
+                res[i] = [v + r.choice([0, 1, 2.5, -1]) for v in anno[i]]
+            if i and r.random() < 0.1:
+                anno[i] = [0, 0, 0, 0]
+            if i and r.random() < 0.05:
+                anno[i] = [float('nan')] * 4
+            if r.random() < 0.05:
+                res[i] = [float('nan')] * 4
+        return res, anno
+
+    def test_calc_seq_err_robust(self):
+        for _ in range(500):
+            res, anno = self.sequence()
+            self.assertEqual(outcome(butil.calc_seq_err_robust, RectResult(res), anno),
+                             outcome(loop_calc_seq_err_robust, RectResult(res), anno))
+
+    def test_zero_area_first_frame(self):
+        # the first frame is the annotation, a zero-area one divides 0 by 0
+        res, anno = self.sequence()
+        anno[0] = [0, 0, 0, 0]
+        self.assertEqual(outcome(butil.calc_seq_err_robust, RectResult(res), anno), 'ZeroDivisionError')
+        self.assertEqual(outcome(loop_calc_seq_err_robust, RectResult(res), anno), 'ZeroDivisionError')
+
+    def test_calc_rect_int(self):
+        for _ in range(500):
+            A = [self.rect(False) for _ in range(5)]
+            B = [self.rect(True) for _ in range(4)]
+            if self.random.random() < 0.2:
+                B[self.random.randrange(4)] = [float('nan')] * 4
+            if self.random.random() < 0.2:
+                A[self.random.randrange(5)] = [0, 0, 0, 0]
+            self.assertEqual(outcome(butil.calc_rect_int, A, B), outcome(loop_calc_rect_int, A, B))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+"""
+calc_result (the scores of seq_scores and calc_scores) against the per sequence and per threshold loops it
+replaced, on synthetic sequences and rect results.
+
+run from the root of the repository: python -m unittest discover tests
+"""
+import os
+import sys
+import copy
+import random
+import shutil
+import tempfile
+import unittest
+from config import ATTR_DESC_FILE, thresholdSetOverlap, thresholdSetError
+from scripts import butil
+from scripts.model.result import Result
+from scripts.model.score import Score
+
+ATTRIBUTES = ['IV', 'SV', 'OCC', 'DEF', 'MB', 'FM', 'IPR', 'OPR', 'OV', 'BC', 'LR']
+
+
+def loop_calc_result(tracker, seqs, results, evalType, SRC_DIR):
+    seqResultList = dict((s.name,list()) for s in seqs)
+    for i in range(len(results)):
+        subResults = results[i]
+
+        seq = next(seq for seq in seqs if seq.name.lower() == subResults[0].seqName.lower())
+        seq.aveCoverage = []
+        seq.aveErrCenter = []
+        seq.errCoverage = []
+        seq.errCenter = []
+
+        if evalType == 'SRE':
+            idxNum = len(subResults)
+            anno = seq.gtRect
+        elif evalType == 'TRE':
+            idxNum = len(subResults)
+        elif evalType == 'OPE':
+            idxNum = 1
+            anno = seq.gtRect
+
+        for j in range(idxNum):
+            result = subResults[j]
+            if evalType == 'TRE':
+                if len(seq.gtRect) < result.endFrame:
+                    anno = seq.gtRect[result.startFrame-seq.startFrame:
+                        result.endFrame-seq.startFrame+1]
+                else:
+                    anno = seq.gtRect[result.startFrame-1:
+                        result.endFrame]
+            evaluated, failed = result, []
+            if getattr(result, 'screening', None):
+                evaluated, failed = butil.screening_padding(result, anno)
+            aveCoverage, aveErrCenter, errCoverage, errCenter = \
+                butil.calc_seq_err_robust(evaluated, anno)
+            if failed:
+                aveCoverage, aveErrCenter = butil.count_failures(errCoverage, errCenter, failed)
+            seq.aveCoverage.append(aveCoverage)
+            seq.aveErrCenter.append(aveErrCenter)
+            seq.errCoverage += errCoverage
+            seq.errCenter += errCenter
+            seqResultList[seq.name].append(result)
+
+    attrList = [Score.getScoreFromLine(line) for line in open(SRC_DIR + ATTR_DESC_FILE).readlines()]
+    attrList.append(Score('ALL', 'All attributes', tracker, evalType))
+    for attr in attrList:
+        successRateList = []
+        precisionRateList = []
+        attr.tracker = tracker
+        attr.evalType = evalType
+        attr.seqs = []
+        attr.successRateList = []
+        attr.overlapScores = []
+        attr.errorNum = []
+        attr.precisionRateList = []
+        for seq in seqs:
+            if attr.name in seq.attributes or attr.name.lower() == 'all':
+                attr.seqs.append(seq.name)
+                seqSuccessList = []
+                length = len(seq.errCoverage)
+                for threshold in thresholdSetOverlap:
+                    seqSuccess = [score for score in seq.errCoverage \
+                        if score > threshold]
+                    seqSuccessList.append(len(seqSuccess)/float(length))
+                successRateList.append(seqSuccessList)
+
+                length = len(seq.errCenter)
+                seqPrecisionRateList = []
+                for threshold in thresholdSetError:
+                    seqPrecisions = [score for score in seq.errCenter if score < threshold]
+                    seqPrecisionRateList.append(len(seqPrecisions)/float(length))
+                precisionRateList.append(seqPrecisionRateList)
+
+                overlapList = [score for score in seq.errCoverage
+                    if score > 0]
+                overlapScore = sum(overlapList) / len(overlapList)
+                attr.overlapScores.append(overlapScore)
+
+                THRESHOLD = 0.5
+                errorNum = len([score for score in seq.errCoverage \
+                    if score < THRESHOLD]) / float(length) * 10
+                attr.errorNum.append(errorNum)
+        if len(attr.overlapScores) > 0 :
+            attr.overlap = sum(attr.overlapScores) / len(attr.overlapScores) * 100
+
+        if len(attr.errorNum) > 0 :
+            attr.error = sum(attr.errorNum) / len(attr.errorNum)
+
+        if len(precisionRateList) > 0:
+            for i in range(len(thresholdSetError)):
+                attr.precisionRateList.append(
+                    sum([rates[i] for rates in precisionRateList]) / float(len(precisionRateList)))
+
+        if len(successRateList) > 0:
+            for i in range(len(thresholdSetOverlap)):
+                attr.successRateList.append(
+                    sum([rates[i] for rates in successRateList]) / float(len(successRateList)))
+
+        attr.refresh_dict()
+
+    attrList.sort()
+    return seqResultList, attrList
+
+
+class Sequence(object):
+    def __init__(self, name, gtRect, attributes):
+        self.name = name
+        self.startFrame = 1
+        self.endFrame = len(gtRect)
+        self.gtRect = gtRect
+        self.attributes = attributes
+
+
+def scores(attrList):
+    return repr([(a.name, a.seqs, a.overlapScores, a.errorNum, getattr(a, 'overlap', None),
+                  getattr(a, 'error', None), a.successRateList, a.precisionRateList) for a in attrList])
+
+
+class CalcResultTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(3)
+        self.src_dir = tempfile.mkdtemp() + os.sep
+        with open(self.src_dir + ATTR_DESC_FILE, 'w') as f:
+            f.write(''.join('%s\t%s description\n' % (a, a) for a in ATTRIBUTES))
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+    def sequence(self, i):
+        """
+        :return: a sequence whose annotation has zero-area and nan frames
+        """
+        r = self.random
+        gtRect = [[r.randint(1, 300), r.randint(1, 300), r.randint(5, 60), r.randint(5, 60)]
+                  for _ in range(r.randint(30, 200))]
+        for k in range(1, len(gtRect)):
+            if r.random() < 0.03:
+                gtRect[k] = [0, 0, 0, 0]
+            elif r.random() < 0.02:
+                gtRect[k] = [float('nan')] * 4
+        return Sequence('seq%d' % i, gtRect, r.sample(ATTRIBUTES, r.randint(0, 5)))
+
+    def results(self, seq, evalType):
+        """
+        :return: the results of seq with nan frames, some of them given up by a screening run (frames not tracked)
+        """
+        r = self.random
+        valid = [k for k in range(1, seq.endFrame // 2) if seq.gtRect[k - 1][2] > 0]
+        starts = [1] if evalType == 'OPE' else sorted(r.sample(valid, 3))
+        subResults = []
+        for start in starts:
+            res = [[v + r.choice([0, 0.5, 2, 7, 30]) * r.choice([-1, 1]) for v in rect]
+                   for rect in seq.gtRect[start - 1:]]
+            for k in range(1, len(res)):
+                if r.random() < 0.02:
+                    res[k] = [float('nan')] * 4
+            screening = None
+            if r.random() < 0.3:
+                cut = r.randint(5, len(res) - 1)
+                res = res[:cut]
+                screening = {'zero_frames': 10, 'reinit': False, 'failures': [cut - 9],
+                             'skipped': [[cut, seq.endFrame - start + 1]]}
+            subResults.append(Result('T', seq.name, start, seq.endFrame, 'rect', evalType, res, 10.,
+                                     screening=screening))
+        return subResults
+
+    def check(self, evalType):
+        for _ in range(4):
+            seqs = [self.sequence(i) for i in range(self.random.randint(3, 30))]
+            results = [self.results(seq, evalType) for seq in seqs]
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                seqResultList, attrList = butil.calc_result('T', copy.deepcopy(seqs), results, evalType,
+                                                            self.src_dir)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            loopResultList, loopAttrList = loop_calc_result('T', copy.deepcopy(seqs), results, evalType,
+                                                            self.src_dir)
+            self.assertEqual(seqResultList, loopResultList)
+            self.assertEqual(scores(attrList), scores(loopAttrList))
+
+    def test_ope(self):
+        self.check('OPE')
+
+    def test_tre(self):
+        self.check('TRE')
+
+
+if __name__ == '__main__':
+    unittest.main()